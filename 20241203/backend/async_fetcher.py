@@ -0,0 +1,155 @@
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 配置 ---
+CONCURRENCY = 20  # 同时在途的请求数
+RATE_PER_SECOND = 50  # 令牌桶速率 (请求/秒)
+BURST = 20  # 令牌桶容量
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # 首次重试的基准等待 (秒)
+BACKOFF_MAX = 8.0
+REQUEST_TIMEOUT = 15
+FRAME_QUEUE_SIZE = 200  # 待写入数据帧的缓冲上限，写入跟不上时反压抓取
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36"
+}
+
+
+class TokenBucket:
+    """异步令牌桶限速器"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt: int) -> float:
+    """带抖动的指数退避：基准值翻倍，再乘以 [0.5, 1.5) 的随机系数"""
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def secid_of(code: str) -> str:
+    market = '1' if code.startswith('6') else '0'
+    return f'{market}.{code}'
+
+
+async def fetch_one(session, code, url_template, parse, bucket, semaphore, max_retries=MAX_RETRIES):
+    """抓取并解析单支股票，失败时按退避策略重试，重试耗尽后抛出最后一次的异常"""
+    import aiohttp
+    url = url_template.format(secid=secid_of(code))
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            async with semaphore:
+                async with session.get(url) as resp:
+                    resp.raise_for_status()
+                    payload = await resp.json(content_type=None)
+            return parse(code, payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+async def fetch_pipeline(codes, url_template, parse, on_frame=None, on_result=None,
+                         concurrency=CONCURRENCY, rate=RATE_PER_SECOND, burst=BURST):
+    """
+    异步抓取流水线：一个复用长连接的 HTTP 客户端 + 令牌桶限速 + 有界并发。
+    解析好的数据帧通过有界队列流式交给 on_frame (如数据库写入)，写入在单独线程中顺序执行，
+    与后续抓取并行。on_result(code, status, message) 用于汇报每支股票的结果，
+    status 为 'fetched' (已交给 on_frame；写入器只是缓冲时，是否成功由写入器在提交后另行汇报) / 'empty' / 'failed'。
+    返回吞吐统计。
+    """
+    # aiohttp 只在真正抓取时导入，避免拖慢 API 服务的启动
+    import aiohttp
+    start = time.perf_counter()
+    bucket = TokenBucket(rate, burst)
+    semaphore = asyncio.Semaphore(concurrency)
+    frames = asyncio.Queue(maxsize=FRAME_QUEUE_SIZE)
+    stats = {"total": len(codes), "fetched": 0, "empty": 0, "failed": 0, "rows": 0}
+    loop = asyncio.get_running_loop()
+    write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kline-writer')
+
+    def report(code, status, message):
+        if on_result is not None:
+            on_result(code, status, message)
+
+    async def producer(session, code):
+        try:
+            df = await fetch_one(session, code, url_template, parse, bucket, semaphore)
+        except Exception as e:
+            stats["failed"] += 1
+            report(code, 'failed', f"失败: {code} - {e}")
+            return
+        if df.empty:
+            stats["empty"] += 1
+            report(code, 'empty', f"无数据: {code}")
+            return
+        stats["fetched"] += 1
+        stats["rows"] += len(df)
+        await frames.put((code, df))
+
+    async def consumer():
+        while True:
+            item = await frames.get()
+            if item is None:
+                return
+            code, df = item
+            # 先汇报已抓取，再交给 on_frame：写入器在其中提交时汇报的最终结果不会被覆盖
+            report(code, 'fetched', f"已抓取: {code}")
+            try:
+                if on_frame is not None:
+                    await loop.run_in_executor(write_executor, on_frame, df)
+            except Exception as e:
+                report(code, 'failed', f"写入失败: {code} - {e}")
+
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS) as session:
+            writer_task = asyncio.ensure_future(consumer())
+            await asyncio.gather(*(producer(session, code) for code in codes))
+            await frames.put(None)
+            await writer_task
+    finally:
+        write_executor.shutdown(wait=True)
+    elapsed = time.perf_counter() - start
+    stats["elapsed"] = round(elapsed, 3)
+    stats["stocks_per_sec"] = round(len(codes) / elapsed, 1) if elapsed > 0 else 0.0
+    return stats
+
+
+def run_fetch_pipeline(codes, url_template, parse, on_frame=None, on_result=None, **kwargs):
+    """同步入口，供后台线程调用"""
+    return asyncio.run(fetch_pipeline(codes, url_template, parse, on_frame, on_result, **kwargs))
+
+
+if __name__ == '__main__':
+    # 对本地桩服务做端到端吞吐测试 (不写数据库)
+    import data_updater
+    from kline_stub import start_stub_server
+
+    server, base_url = start_stub_server(latency_ms=20, failure_rate=0.02)
+    try:
+        codes = [f"{600000 + i:06d}" for i in range(1000)]
+        result = run_fetch_pipeline(codes, data_updater.KLINE_URL.replace(data_updater.KLINE_BASE_URL, base_url),
+                                    data_updater.parse_kline_json, rate=1000, burst=100, concurrency=50)
+        print(result)
+    finally:
+        server.shutdown()
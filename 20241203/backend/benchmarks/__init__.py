@@ -0,0 +1,3 @@
+# 可复现的性能基准：合成行情数据写入本地 SQLite，K 线接口使用本地桩服务，
+# 各场景在独立进程中运行并输出延迟分位数、吞吐与峰值内存，结果为 JSON，可与上一次运行对比。
+# 用法 (在 backend 目录下)：python -m benchmarks.run --codes 500 --days 500 --output bench.json
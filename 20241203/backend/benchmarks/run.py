@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import shutil
+import socket
+import argparse
+import platform
+import subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks import synthetic_data
+from benchmarks.scenarios import SCENARIOS, run_scenario
+
+# --- 配置 ---
+WORKDIR = os.path.join(BACKEND_DIR, 'cache', 'bench')
+REQUESTS = 200  # 每个接口场景计时的请求数
+WARMUP = 5  # 每个接口场景不计时的预热请求数
+CONCURRENCY = 1
+REPEAT = 1  # 批处理场景 (全部更新/训练) 的重复次数
+STUB_LATENCY_MS = 0
+MODEL_FILES = ['models/stock_model_all.h5', 'models/stock_model_all.norm.npz']
+# 与基准结果对比时展示的指标: (名称, 取值路径, 越大越好)
+COMPARE_METRICS = [
+    ('p50(ms)', ('latency_ms', 'p50'), False),
+    ('p95(ms)', ('latency_ms', 'p95'), False),
+    ('p99(ms)', ('latency_ms', 'p99'), False),
+    ('吞吐(/s)', ('throughput_per_sec',), True),
+    ('峰值内存(MB)', ('peak_rss_mb',), False),
+]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def prepare_workdir(args):
+    """生成 (或复用) 合成数据库，并把当前模型复制到工作目录，服务模块的相对路径都落在这里"""
+    os.makedirs(os.path.join(args.workdir, 'models'), exist_ok=True)
+    for relative in MODEL_FILES:
+        source = os.path.join(BACKEND_DIR, relative)
+        if os.path.exists(source):
+            shutil.copyfile(source, os.path.join(args.workdir, relative))
+    db_path = os.path.join(args.workdir, 'bench.db')
+    params_path = db_path + '.json'
+    params = {"codes": args.codes, "days": args.days, "users": args.users, "seed": args.seed}
+    if args.reuse_data and os.path.exists(db_path) and os.path.exists(params_path):
+        with open(params_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == params:
+                print(f"复用已有的合成数据 {db_path}。")
+                return db_path, synthetic_data.stock_codes(args.codes), \
+                    [f"bench_user_{i}" for i in range(args.users)]
+    codes, usernames = synthetic_data.generate(db_path, args.codes, args.days, args.users, seed=args.seed)
+    with open(params_path, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    return db_path, codes, usernames
+
+
+def _metric(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def print_results(results, baseline=None):
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<18} 失败: {result['error']}")
+            continue
+        latency = result.get('latency_ms', {})
+        line = (f"{name:<18} 次数 {result['requests']:>5}  p50 {latency.get('p50', 0):>9.2f}ms  "
+                f"p95 {latency.get('p95', 0):>9.2f}ms  p99 {latency.get('p99', 0):>9.2f}ms  "
+                f"吞吐 {result['throughput_per_sec']:>9.2f}/s  峰值内存 {result['peak_rss_mb']:>7.1f}MB")
+        if result.get('errors'):
+            line += f"  错误 {result['errors']}"
+        print(line)
+        previous = (baseline or {}).get(name)
+        if not previous or 'error' in previous:
+            continue
+        changes = []
+        for label, path, higher_is_better in COMPARE_METRICS:
+            old, new = _metric(previous, path), _metric(result, path)
+            if old and new is not None:
+                change = (new - old) / old * 100
+                better = change > 0 if higher_is_better else change < 0
+                changes.append(f"{label} {change:+.1f}%{'' if abs(change) < 5 else (' ↑' if better else ' ↓')}")
+        if changes:
+            print(f"{'':<18} 对比基准: {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用合成数据与本地 SQLite 运行可复现的性能基准")
+    parser.add_argument('--codes', type=int, default=synthetic_data.DEFAULT_CODES, help="股票数")
+    parser.add_argument('--days', type=int, default=synthetic_data.DEFAULT_DAYS, help="每支股票的交易日数")
+    parser.add_argument('--users', type=int, default=synthetic_data.DEFAULT_USERS)
+    parser.add_argument('--seed', type=int, default=synthetic_data.SEED)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"逗号分隔的场景名，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=REQUESTS)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="批处理场景的重复次数")
+    parser.add_argument('--stub-latency-ms', type=int, default=STUB_LATENCY_MS, help="K 线桩服务的模拟延迟")
+    parser.add_argument('--workdir', default=WORKDIR)
+    parser.add_argument('--reuse-data', action='store_true', help="参数相同时复用上次生成的合成数据库")
+    parser.add_argument('--output', help="把结果写入 JSON 文件")
+    parser.add_argument('--baseline', help="与之前输出的 JSON 结果对比")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(unknown)}")
+    args.workdir = os.path.abspath(args.workdir)
+    db_path, codes, usernames = prepare_workdir(args)
+    run_db_path = os.path.join(args.workdir, 'bench-run.db')
+    config = {
+        "workdir": args.workdir, "db_uri": f"sqlite:///{run_db_path}", "codes": codes, "usernames": usernames,
+        "seed": args.seed, "requests": args.requests, "warmup": args.warmup, "concurrency": args.concurrency,
+        "repeat": args.repeat, "stub_latency_ms": args.stub_latency_ms,
+    }
+
+    # 每个场景在新的 spawn 子进程中运行：互不共享缓存与连接池，峰值内存也只反映该场景。
+    # 子进程会重新导入本模块 (及 db_compat)，连接串须在创建子进程前通过环境变量传入
+    os.environ['STOCK_DB_URI'] = config['db_uri']
+    results = {}
+    for name in names:
+        print(f"运行场景 {name} ({SCENARIOS[name][1]})...")
+        # 更新等场景会写入数据库，每个场景都从合成数据的干净副本和空的本地缓存 (历史缓存、任务库) 开始
+        shutil.copyfile(db_path, run_db_path)
+        shutil.rmtree(os.path.join(args.workdir, 'cache'), ignore_errors=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results[name] = pool.submit(run_scenario, name, dict(config)).result()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "git_revision": git_revision(),
+            "host": socket.gethostname(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "params": {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        },
+        "scenarios": results,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('scenarios', {})
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import random
+import resource
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 场景名 -> (函数名, 说明)
+SCENARIOS = {
+    'stocklist_page': ('bench_stocklist_page', "/api/stocklist 按页码随机翻页"),
+    'stocklist_cursor': ('bench_stocklist_cursor', "/api/stocklist 按游标 (after) 顺序翻页"),
+    'stocklist_search': ('bench_stocklist_search', "/api/stocklist 按代码/名称关键字搜索"),
+    'stockkline_day': ('bench_stockkline_day', "/api/stockkline 日线 (含预测)"),
+    'stockkline_week': ('bench_stockkline_week', "/api/stockkline 周线"),
+    'stockkline_month': ('bench_stockkline_month', "/api/stockkline 月线"),
+    'watchlist_list': ('bench_watchlist_list', "GET /api/watchlist"),
+    'watchlist_status': ('bench_watchlist_status', "GET /api/watchlist/status"),
+    'watchlist_toggle': ('bench_watchlist_toggle', "POST + DELETE /api/watchlist"),
+    'full_update': ('bench_full_update', "全部股票更新 (K 线桩服务 + 增量写入)"),
+    'train_epoch': ('bench_train_epoch', "全量数据训练一个 epoch (需要 TensorFlow)"),
+}
+
+
+def peak_rss_mb():
+    """
+    本进程的峰值常驻内存。Linux 上读 /proc 的 VmHWM：ru_maxrss 会跨 exec 保留，
+    spawn 出的子进程会带上父进程的峰值；其他平台退回 ru_maxrss (macOS 单位为字节，其余为 KB)。
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(latencies, operations, wall_seconds, errors=0, **extra):
+    latencies_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    summary = {
+        "requests": len(latencies),
+        "operations": operations,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_per_sec": round(operations / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+    }
+    if len(latencies_ms):
+        p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+        summary["latency_ms"] = {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3),
+                                 "mean": round(latencies_ms.mean(), 3), "max": round(latencies_ms.max(), 3)}
+    summary.update(extra)
+    return summary
+
+
+class BenchContext:
+    """子进程内的场景运行环境：在独立的工作目录中使用合成数据库，与正式的缓存/模型文件互不影响"""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config['seed'])
+        self.codes = config['codes']
+        self._app = None
+        self._tokens = None
+
+    @property
+    def api(self):
+        """导入 api_server (按环境变量连接合成数据库)，等待模型加载完成"""
+        if self._app is None:
+            import api_server
+            if not api_server.model_registry.wait_ready(timeout=120):
+                print("模型未能在 120 秒内加载，日线预测的耗时不计入。")
+            self._app = api_server
+        return self._app
+
+    def client(self):
+        return self.api.app.test_client()
+
+    def tokens(self):
+        """用合成数据中的用户登录，取得 JWT"""
+        if self._tokens is None:
+            from benchmarks.synthetic_data import USER_PASSWORD
+            client = self.client()
+            self._tokens = []
+            for username in self.config['usernames']:
+                response = client.post('/api/login', json={"username": username, "password": USER_PASSWORD})
+                self._tokens.append(response.get_json()['token'])
+        return self._tokens
+
+    def run_requests(self, make_request, expected=(200,)):
+        """
+        先不计时地预热 warmup 次 (触发快照/聚合表的首次构建)，再按 concurrency 个线程共发出 requests 次请求。
+        make_request(client, i) 返回响应对象，状态码不在 expected 中的记为错误。
+        """
+        requests, concurrency = self.config['requests'], self.config['concurrency']
+        warm_client = self.client()
+        for i in range(self.config['warmup']):
+            make_request(warm_client, -1 - i)
+
+        def worker(indices):
+            client = self.client()
+            latencies, errors = [], 0
+            for i in indices:
+                start = time.perf_counter()
+                response = make_request(client, i)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code not in expected:
+                    errors += 1
+            return latencies, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, [range(k, requests, concurrency) for k in range(concurrency)]))
+        wall = time.perf_counter() - start
+        latencies = [value for result in results for value in result[0]]
+        return summarize(latencies, len(latencies), wall, errors=sum(result[1] for result in results))
+
+
+# --- 接口场景 ---
+def bench_stocklist_page(ctx):
+    pages = max(1, len(ctx.codes) // 20)
+    page_numbers = [ctx.rng.randint(1, pages) for _ in range(ctx.config['requests'])]
+    return ctx.run_requests(lambda client, i: client.get(f"/api/stocklist?page={page_numbers[i]}&pageSize=20"))
+
+
+def bench_stocklist_cursor(ctx):
+    cursor = {"after": None}
+
+    def request(client, i):
+        url = "/api/stocklist?pageSize=20"
+        if cursor["after"]:
+            url += f"&after={cursor['after']}"
+        response = client.get(url)
+        # 翻到最后一页后从头开始
+        cursor["after"] = response.get_json()['pagination']['nextCursor']
+        return response
+
+    ctx.config['concurrency'] = 1  # 游标翻页有先后依赖，只能单线程
+    return ctx.run_requests(request)
+
+
+def bench_stocklist_search(ctx):
+    from benchmarks.synthetic_data import NAME_SUFFIXES
+    keywords = [code[:4] for code in ctx.codes] + NAME_SUFFIXES
+    chosen = [ctx.rng.choice(keywords) for _ in range(ctx.config['requests'])]
+    return ctx.run_requests(lambda client, i: client.get(f"/api/stocklist?keyword={chosen[i]}&pageSize=20"))
+
+
+def _bench_kline(ctx, period):
+    chosen = [ctx.rng.choice(ctx.codes) for _ in range(ctx.config['requests'])]
+    return ctx.run_requests(lambda client, i: client.get(f"/api/stockkline?stockCode={chosen[i]}&period={period}"))
+
+
+def bench_stockkline_day(ctx):
+    return _bench_kline(ctx, 'day')
+
+
+def bench_stockkline_week(ctx):
+    return _bench_kline(ctx, 'week')
+
+
+def bench_stockkline_month(ctx):
+    return _bench_kline(ctx, 'month')
+
+
+def bench_watchlist_list(ctx):
+    tokens = ctx.tokens()
+    return ctx.run_requests(lambda client, i: client.get(
+        '/api/watchlist', headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"}))
+
+
+def bench_watchlist_status(ctx):
+    tokens = ctx.tokens()
+    batches = [','.join(ctx.rng.sample(ctx.codes, min(20, len(ctx.codes)))) for _ in range(ctx.config['requests'])]
+    return ctx.run_requests(lambda client, i: client.get(
+        f"/api/watchlist/status?stockCodes={batches[i]}",
+        headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"}))
+
+
+def bench_watchlist_toggle(ctx):
+    tokens = ctx.tokens()
+    chosen = [ctx.rng.choice(ctx.codes) for _ in range(ctx.config['requests'])]
+
+    def request(client, i):
+        # 预热请求的 i 为负数，与计时请求使用不同的股票/用户组合
+        headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+        code = chosen[i]
+        response = client.post('/api/watchlist', json={"stockCode": code}, headers=headers)
+        if response.status_code == 409:
+            # 本来就在自选中：先移除再添加，结束时恢复原状
+            client.delete(f'/api/watchlist/{code}', headers=headers)
+            return client.post('/api/watchlist', json={"stockCode": code}, headers=headers)
+        return client.delete(f'/api/watchlist/{code}', headers=headers)
+
+    return ctx.run_requests(request, expected=(200, 201))
+
+
+# --- 批处理场景 ---
+def bench_full_update(ctx):
+    """
+    与 /api/update_all_stocks 相同的更新流程 (update_jobs 提交并运行全部更新)，K 线请求发往本地桩服务；
+    任务状态写入临时库，不影响服务的续跑记录。每支股票记为一次操作，未完成的股票计入错误数
+    """
+    import shutil
+    import tempfile
+    import data_updater
+    import update_jobs
+    from kline_stub import start_stub_server
+    stub, base_url = start_stub_server(latency_ms=ctx.config['stub_latency_ms'])
+    data_updater.KLINE_URL = data_updater.KLINE_URL.replace(data_updater.KLINE_BASE_URL, base_url)
+    job_dir = tempfile.mkdtemp(prefix='bench_jobs_')
+    manager = update_jobs.UpdateJobManager(db_path=os.path.join(job_dir, 'update_jobs.db'), workers=0)
+    latencies, operations, errors = [], 0, 0
+    try:
+        for _ in range(ctx.config['repeat']):
+            run_start = time.perf_counter()
+            run_id, _ = manager.start_full_update(resume=False)
+            manager._full_thread.join()
+            latencies.append(time.perf_counter() - run_start)
+            status = manager.status(run_id=run_id)
+            counts = status.get('jobCounts', {})
+            operations += status.get('total', 0)
+            errors += sum(n for job_status, n in counts.items() if job_status not in ('done', 'empty'))
+            errors += int(status.get('runStatus') == 'failed')
+    finally:
+        stub.shutdown()
+        shutil.rmtree(job_dir, ignore_errors=True)
+    return summarize(latencies, operations, sum(latencies), errors=errors,
+                     unit="stocks", stub_latency_ms=ctx.config['stub_latency_ms'])
+
+
+def bench_train_epoch(ctx):
+    """与全量训练相同的数据准备与模型结构，只训练一个 epoch 且不发布模型；吞吐按样本数计"""
+    import ml
+    from norm_stats import NormalizationStats
+    latencies, operations = [], 0
+    start = time.perf_counter()
+    history = ml.load_history(ml.connect_db())
+    norm = NormalizationStats.from_history(history, ml.NORMALIZATION, min_length=ml.LOOK_BACK_DAYS)
+    flat_data, window_starts = ml.prepare_training_windows(history, norm)
+    prepare_seconds = time.perf_counter() - start
+    for _ in range(ctx.config['repeat']):
+        dataset = ml.create_dataset(flat_data, window_starts, ml.LOOK_BACK_DAYS, ml.BATCH_SIZE)
+        stats = ml.timed_fit(ml.build_model(), dataset, len(window_starts))
+        latencies.append(stats['train_seconds'])
+        operations += stats['samples']
+    return summarize(latencies, operations, sum(latencies), unit="samples",
+                     prepare_seconds=round(prepare_seconds, 3))
+
+
+def run_scenario(name, config):
+    """在子进程中执行：切换到基准工作目录、指向合成数据库后再导入服务模块"""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    os.chdir(config['workdir'])
+    os.environ['STOCK_DB_URI'] = config['db_uri']
+    ctx = BenchContext(config)
+    try:
+        result = globals()[SCENARIOS[name][0]](ctx)
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    result["description"] = SCENARIOS[name][1]
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
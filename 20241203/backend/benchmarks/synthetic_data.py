@@ -0,0 +1,104 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+import db_compat
+import schema
+from data_updater import KLINE_COLUMNS
+
+# --- 配置 ---
+DEFAULT_CODES = 500
+DEFAULT_DAYS = 500
+DEFAULT_USERS = 20
+WATCHLIST_SIZE = 20  # 每个用户的自选股数
+END_DATE = '2024-11-29'  # 固定的最后交易日，保证每次生成的数据完全一致
+SEED = 42
+INSERT_CHUNK_ROWS = 5000
+USER_PASSWORD = 'bench-password'
+
+NAME_PREFIXES = ['华', '中', '国', '东', '新', '海', '天', '金', '长', '大']
+NAME_SUFFIXES = ['科技', '银行', '证券', '电子', '医药', '能源', '汽车', '地产', '食品', '化工']
+
+
+def stock_codes(n):
+    """沪市 6 开头与深市 0 开头的代码各一半，与 async_fetcher.secid_of 的市场划分一致"""
+    shanghai = [f"{600000 + i:06d}" for i in range((n + 1) // 2)]
+    shenzhen = [f"{1 + i:06d}" for i in range(n // 2)]
+    return shanghai + shenzhen
+
+
+def stock_name(i):
+    return f"{NAME_PREFIXES[i % 10]}{NAME_PREFIXES[i // 10 % 10]}{NAME_SUFFIXES[i // 100 % 10]}{i}"
+
+
+def synthetic_klines(codes, days, end=END_DATE, seed=SEED):
+    """按股票生成对数正态随机游走的日 K 线 (整块向量化生成)，列与 t_stocks 一致"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=end, periods=days).date
+    n = len(codes)
+    start_prices = rng.uniform(5, 100, size=(n, 1))
+    log_returns = rng.normal(0, 0.02, size=(n, days))
+    close = np.maximum(0.5, start_prices * np.exp(np.cumsum(log_returns, axis=1)))
+    prev_close = np.concatenate([start_prices, close[:, :-1]], axis=1)
+    open_price = prev_close * (1 + rng.normal(0, 0.005, size=(n, days)))
+    high = np.maximum(open_price, close) * (1 + np.abs(rng.normal(0, 0.005, size=(n, days))))
+    low = np.minimum(open_price, close) * (1 - np.abs(rng.normal(0, 0.005, size=(n, days))))
+    volume = rng.integers(10000, 2000000, size=(n, days)).astype(np.float64)
+    change = close - prev_close
+    frame = pd.DataFrame({
+        '股票代码': np.repeat(codes, days),
+        '日期': np.tile(dates, n),
+        '开盘价': open_price.ravel().round(2),
+        '收盘价': close.ravel().round(2),
+        '最高价': high.ravel().round(2),
+        '最低价': low.ravel().round(2),
+        '成交量': volume.ravel(),
+        '成交额': (volume * close * 100).ravel().round(2),
+        '振幅': ((high - low) / prev_close * 100).ravel().round(2),
+        '涨跌幅': (change / prev_close * 100).ravel().round(2),
+        '涨跌额': change.ravel().round(2),
+        '换手率': rng.uniform(0.1, 5, size=n * days).round(2),
+    })
+    return frame[KLINE_COLUMNS]
+
+
+def _insert(conn, table, frame):
+    columns = ', '.join(f"`{c}`" for c in frame.columns)
+    placeholders = ', '.join(f":p{i}" for i in range(len(frame.columns)))
+    stmt = text(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})")
+    records = [{f"p{i}": value for i, value in enumerate(row)} for row in frame.itertuples(index=False, name=None)]
+    for start in range(0, len(records), INSERT_CHUNK_ROWS):
+        conn.execute(stmt, records[start:start + INSERT_CHUNK_ROWS])
+
+
+def generate(db_path, codes=DEFAULT_CODES, days=DEFAULT_DAYS, users=DEFAULT_USERS,
+             watchlist_size=WATCHLIST_SIZE, end=END_DATE, seed=SEED):
+    """
+    在 db_path 新建 SQLite 数据库并写入合成数据 (已存在的文件会被覆盖)。
+    相同的参数总是生成相同的数据，返回生成的股票代码与用户名。
+    """
+    start = time.perf_counter()
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    engine = db_compat.create_db_engine(f"sqlite:///{db_path}")
+    code_list = stock_codes(codes)
+    usernames = [f"bench_user_{i}" for i in range(users)]
+    rng = np.random.default_rng(seed + 1)
+    # 所有用户使用同一个口令，只计算一次哈希
+    password_hash = generate_password_hash(USER_PASSWORD, method='pbkdf2:sha256')
+    schema.migrate(engine)
+    with engine.begin() as conn:
+        _insert(conn, 't_stocks', synthetic_klines(code_list, days, end, seed))
+        _insert(conn, 't_stock_basic', pd.DataFrame({
+            '股票代码': code_list, '股票名称': [stock_name(i) for i in range(len(code_list))]}))
+        _insert(conn, 't_users', pd.DataFrame({'username': usernames, 'password_hash': password_hash}))
+        watchlists = [(user_id, code) for user_id in range(1, users + 1)
+                      for code in rng.choice(code_list, size=min(watchlist_size, len(code_list)), replace=False)]
+        _insert(conn, 't_watchlists', pd.DataFrame(watchlists, columns=['user_id', 'stock_code']))
+        conn.execute(text("ANALYZE"))  # 写入后重新收集统计信息，执行计划与迁移后的正式库一致
+    engine.dispose()
+    print(f"合成数据已写入 {db_path}: {len(code_list)} 支股票 x {days} 个交易日, {users} 个用户, "
+          f"耗时 {time.perf_counter() - start:.1f} 秒。")
+    return code_list, usernames
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from inference_engine import rollout_forecast, FORECAST_DAYS
+from model_registry import load_model_file, load_norm_stats
+from norm_stats import scale, unscale
+import prediction_job
+
+# --- 配置 ---
+MODEL_PATH = 'models/stock_model_all.h5'
+LOOK_BACK_DAYS = 60
+EVAL_DATES = 120  # 回测起始日期之后最近多少个交易日
+EVAL_STEP = 1  # 每隔几个交易日做一次预测
+WORKERS = max(1, (os.cpu_count() or 2) - 1)
+DATES_PER_TASK = 8  # 每个进程任务处理的日期数
+MAX_BATCH_SIZE = 4096  # 单次前向计算的股票数上限
+TRAIN_META_SUFFIX = '.train.json'  # ml.publish_model 在模型旁写入的训练元数据 (含水位线)
+
+# 工作进程内的全局状态，由 _init_worker 设置
+_worker = {}
+
+
+def _init_worker(model_path, backend, flat, offsets, row_mins, row_maxs, look_back, horizon):
+    _worker.update(
+        model=load_model_file(model_path, backend), flat=flat, offsets=offsets,
+        row_mins=row_mins, row_maxs=row_maxs, look_back=look_back, horizon=horizon,
+        windows=sliding_window_view(flat, look_back), futures=sliding_window_view(flat, horizon),
+    )
+
+
+def _evaluate_rows(row_groups):
+    """
+    row_groups 为若干个交易日各自的样本行号 (每个行号是某支股票在该日的收盘价位置)。
+    每个交易日的全部股票合成一批做 horizon 步递归预测，返回按预测步累计的误差统计。
+    """
+    w = _worker
+    look_back, horizon = w['look_back'], w['horizon']
+    sums = {key: np.zeros(horizon) for key in ('abs_error', 'abs_pct_error', 'direction_hits')}
+    count, model_seconds = 0, 0.0
+    for rows in row_groups:
+        for start in range(0, len(rows), MAX_BATCH_SIZE):
+            batch_rows = rows[start:start + MAX_BATCH_SIZE]
+            lo, hi = w['row_mins'][batch_rows][:, None], w['row_maxs'][batch_rows][:, None]
+            windows = w['windows'][batch_rows - look_back + 1]
+            actual = w['futures'][batch_rows + 1].astype(np.float64)
+            last_close = w['flat'][batch_rows].astype(np.float64)[:, None]
+            scaled = scale(windows, lo, hi).astype(np.float32)[..., None]
+            started = time.perf_counter()
+            predicted = unscale(rollout_forecast(w['model'].predict_on_batch, scaled, horizon), lo, hi)
+            model_seconds += time.perf_counter() - started
+            error = np.abs(predicted - actual)
+            sums['abs_error'] += error.sum(axis=0)
+            sums['abs_pct_error'] += (error / np.maximum(np.abs(actual), 1e-9)).sum(axis=0)
+            sums['direction_hits'] += (np.sign(predicted - last_close) == np.sign(actual - last_close)).sum(axis=0)
+            count += len(batch_rows)
+    return {key: value.tolist() for key, value in sums.items()}, count, model_seconds
+
+
+def train_meta_path_for(model_path):
+    """models/stock_model_all.h5 -> models/stock_model_all.train.json (与 ml.TRAIN_META_PATH 一致)"""
+    return os.path.splitext(model_path)[0] + TRAIN_META_SUFFIX
+
+
+def read_watermark(model_path):
+    """模型的训练水位线 (训练数据的最新日期)；没有训练元数据时返回 None"""
+    path = train_meta_path_for(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        watermark = json.load(f).get('watermark')
+    return np.datetime64(watermark, 'D') if watermark else None
+
+
+def running_bounds(prices, offsets):
+    """每一行截至该行 (含) 所在股票的最低/最高收盘价，回测时只用当时已经知道的数据"""
+    prices = prices.astype(np.float64)
+    mins, maxs = np.empty_like(prices), np.empty_like(prices)
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        np.minimum.accumulate(prices[start:end], out=mins[start:end])
+        np.maximum.accumulate(prices[start:end], out=maxs[start:end])
+    return mins, maxs
+
+
+def build_eval_rows(history, look_back, horizon, eval_dates, step, since=None):
+    """
+    选出回测日期 (不早于 since 的最近 eval_dates 个)，并为每个日期找出所有可评估的样本行：
+    该日之前 (含) 至少有 look_back 天数据、之后至少还有 horizon 天真实收盘价的股票。
+    """
+    offsets = history.offsets
+    dates = history.columns['date']
+    row_stock = np.repeat(np.arange(len(history.codes)), np.diff(offsets))
+    position = np.arange(len(dates)) - offsets[row_stock]
+    remaining = offsets[row_stock + 1] - 1 - np.arange(len(dates))
+    valid = (position >= look_back - 1) & (remaining >= horizon)
+    candidate_dates = np.unique(dates[valid])
+    if since is not None:
+        candidate_dates = candidate_dates[candidate_dates >= since]
+    selected = candidate_dates[-eval_dates * step::step] if eval_dates else candidate_dates[::step]
+    valid_rows = np.flatnonzero(valid & np.isin(dates, selected))
+    # 按日期分组 (稳定排序保持股票顺序)
+    order = valid_rows[np.argsort(dates[valid_rows], kind='stable')]
+    bounds = np.searchsorted(dates[order], selected)
+    groups = np.split(order, bounds[1:])
+    return selected, groups, row_stock
+
+
+def evaluate(engine, model_path=MODEL_PATH, backend='numpy', look_back=LOOK_BACK_DAYS, horizon=FORECAST_DAYS,
+             eval_dates=EVAL_DATES, step=EVAL_STEP, workers=WORKERS, since=None):
+    """
+    样本外回测：默认只评估训练水位线当日及之后的交易日 (预测的目标收盘价都在水位线之后)，
+    since 显式指定回测的起始日期。
+    """
+    from history_cache import HistoryCache
+
+    watermark = read_watermark(model_path)
+    since = np.datetime64(since, 'D') if since is not None else watermark
+    if since is None:
+        raise ValueError(f"找不到训练水位线 ({train_meta_path_for(model_path)})，请用 --since 指定回测起始日期")
+    history = HistoryCache(engine).refresh()
+    if not len(history):
+        raise ValueError("没有可用于回测的股票数据")
+    prices = history.columns['close']
+    offsets = history.offsets
+    selected, groups, row_stock = build_eval_rows(history, look_back, horizon, eval_dates, step, since)
+    if not len(selected):
+        raise ValueError(f"{since} 之后没有满足回测条件的交易日 (需要之后还有 {horizon} 天行情)")
+    # 与在线推理相同的归一化区间：训练时保存的参数并入截至预测日的历史区间 (不使用预测日之后的价格)
+    norm = load_norm_stats(model_path)
+    n = len(history.codes)
+    stock_mins, stock_maxs = norm.bounds_many(history.codes, np.full(n, np.inf), np.full(n, -np.inf))
+    if norm.mode == 'global':
+        row_mins, row_maxs = stock_mins[row_stock], stock_maxs[row_stock]
+    else:
+        running_mins, running_maxs = running_bounds(prices, offsets)
+        row_mins = np.minimum(running_mins, stock_mins[row_stock])
+        row_maxs = np.maximum(running_maxs, stock_maxs[row_stock])
+    tasks = [groups[i:i + DATES_PER_TASK] for i in range(0, len(groups), DATES_PER_TASK)]
+    print(f"回测 {len(selected)} 个交易日 ({selected[0]} ~ {selected[-1]})，"
+          f"{sum(len(g) for g in groups)} 个样本，{len(tasks)} 个任务，{workers} 个进程...")
+
+    start = time.perf_counter()
+    totals = {key: np.zeros(horizon) for key in ('abs_error', 'abs_pct_error', 'direction_hits')}
+    count, model_seconds = 0, 0.0
+    init_args = (model_path, backend, prices, offsets, row_mins, row_maxs, look_back, horizon)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+        for sums, n, seconds in pool.map(_evaluate_rows, tasks):
+            for key in totals:
+                totals[key] += sums[key]
+            count += n
+            model_seconds += seconds
+    elapsed = time.perf_counter() - start
+    if count == 0:
+        raise ValueError("没有满足回测条件的样本")
+
+    per_horizon = [{
+        "horizon": h + 1,
+        "mae": round(float(totals['abs_error'][h] / count), 6),
+        "mape": round(float(totals['abs_pct_error'][h] / count * 100), 4),
+        "direction_accuracy": round(float(totals['direction_hits'][h] / count * 100), 2),
+    } for h in range(horizon)]
+    return {
+        "model_path": model_path,
+        "model_version": prediction_job.model_version_of(model_path),
+        "backend": backend,
+        "normalization": norm.mode,
+        "watermark": str(watermark) if watermark is not None else None,
+        "since": str(since),
+        "eval_dates": len(selected),
+        "first_date": str(selected[0]),
+        "last_date": str(selected[-1]),
+        "stocks": len(history.codes),
+        "forecasts": count,
+        "workers": workers,
+        "elapsed_seconds": round(elapsed, 3),
+        "forecasts_per_sec": round(count / elapsed, 1),
+        "model_seconds": round(model_seconds, 3),
+        "per_horizon": per_horizon,
+    }
+
+
+def print_report(report):
+    print(f"模型 {report['model_path']} (版本 {report['model_version']}, 后端 {report['backend']})")
+    print(f"训练水位线 {report['watermark']}，回测 {report['first_date']} ~ {report['last_date']} (自 {report['since']} 起)")
+    print(f"{report['forecasts']} 个预测，耗时 {report['elapsed_seconds']} 秒，吞吐 {report['forecasts_per_sec']} 个/秒")
+    print(f"{'步':>4} {'MAE':>12} {'MAPE(%)':>10} {'方向准确率(%)':>14}")
+    for row in report['per_horizon']:
+        print(f"{row['horizon']:>4} {row['mae']:>12.4f} {row['mape']:>10.3f} {row['direction_accuracy']:>14.2f}")
+
+
+if __name__ == '__main__':
+    import db_compat
+
+    parser = argparse.ArgumentParser(description="滚动回测 (walk-forward) 评估预测模型的精度与速度")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'keras'])
+    parser.add_argument('--dates', type=int, default=EVAL_DATES, help="回测起始日期之后最近多少个交易日，0 表示全部")
+    parser.add_argument('--step', type=int, default=EVAL_STEP)
+    parser.add_argument('--since', help="回测起始日期 (YYYY-MM-DD)，默认取模型的训练水位线")
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--output', help="把结果写入 JSON 文件，便于比较不同模型版本/推理后端")
+    args = parser.parse_args()
+
+    result = evaluate(db_compat.create_db_engine(), args.model, args.backend, eval_dates=args.dates,
+                      step=args.step, workers=args.workers, since=args.since)
+    print_report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
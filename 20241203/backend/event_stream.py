@@ -0,0 +1,257 @@
+import json
+import time
+import threading
+from collections import deque
+from sqlalchemy import text
+import metrics
+import quote_snapshot
+
+# --- 配置 ---
+CLIENT_BUFFER_SIZE = 64  # 每个客户端缓冲的事件数上限，满了丢弃最旧的
+MAX_CLIENTS = 500  # 单个进程同时保持的推送连接上限
+MAX_CODES = 300  # 单个连接订阅行情的股票数上限
+PUBLISH_INTERVAL = 1.0  # 发布线程检查任务进度与行情变化的间隔 (秒)
+HEARTBEAT_INTERVAL = 15.0  # 没有事件时发送注释行保活，断开的连接也借此被发现
+RETRY_MS = 3000  # 浏览器 EventSource 断线重连的间隔
+QUOTE_BATCH_LIMIT = 10000  # 单次轮询读取的行情变化行数上限
+TOPICS = ('progress', 'jobs', 'quotes')
+
+CHANGED_QUOTES_SQL = f"""
+SELECT `股票代码` as code, `日期` as date, `开盘价` as prevPrice, `收盘价` as price,
+       `日内涨跌幅` as changePercent, `成交量` as volume, `更新时间` as updatedAt
+FROM {quote_snapshot.SNAPSHOT_TABLE}
+WHERE `更新时间` >= :since
+ORDER BY `更新时间`
+LIMIT :limit
+"""
+QUOTE_BASELINE_SQL = f"SELECT MAX(`更新时间`) FROM {quote_snapshot.SNAPSHOT_TABLE}"
+
+SSE_CLIENTS = metrics.gauge('stock_sse_clients', "当前进程保持的推送连接数")
+SSE_EVENTS = metrics.counter('stock_sse_events_total', "推送给客户端的事件数", ('event',))
+SSE_DROPPED = metrics.counter('stock_sse_events_dropped_total', "客户端缓冲已满被丢弃的事件数", ('event',))
+
+
+class TooManySubscribers(RuntimeError):
+    """推送连接数已达上限"""
+
+
+class Subscription:
+    """单个客户端的订阅：有界缓冲，写满时丢弃最旧的事件并计数，慢客户端不会拖住发布线程"""
+
+    def __init__(self, topics, codes=(), buffer_size=CLIENT_BUFFER_SIZE):
+        self.topics = frozenset(topics)
+        self.codes = frozenset(codes)
+        self._events = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._dropped = 0
+        self.closed = False
+
+    def put(self, event):
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self._dropped += 1
+                SSE_DROPPED.inc(event=self._events[0][1])
+            self._events.append(event)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """取出下一个事件，返回 (事件, 此前被丢弃的事件数)；超时返回 (None, 0)"""
+        with self._cond:
+            if not self._events and not self.closed:
+                self._cond.wait(timeout)
+            if not self._events:
+                return None, 0
+            dropped, self._dropped = self._dropped, 0
+            return self._events.popleft(), dropped
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+def format_event(event_id, name, data):
+    return f"id: {event_id}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class EventPublisher:
+    """
+    进程内唯一的发布线程，把变化扇出给全部订阅者：
+    - progress：全部更新任务的进度 (与 /api/update_status 相同的字段)，有变化时推送；
+    - jobs：单支股票更新任务的状态变化，结束时推送最终结果；
+    - quotes：最新行情快照中有变化的股票，只推给订阅了这些代码的客户端。
+    任务状态保存在 SQLite、行情写在快照表中，所以无论更新跑在哪个工作进程里，
+    每个进程的发布线程都能看到；有多少客户端，数据库侧都只有这一个线程在查询，没有订阅者时不查询。
+    """
+
+    def __init__(self, engine, job_manager, interval=PUBLISH_INTERVAL, max_clients=MAX_CLIENTS):
+        self.engine = engine
+        self.job_manager = job_manager
+        self.interval = interval
+        self.max_clients = max_clients
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._next_id = 0
+        self._last_status = None
+        self._single_jobs = {}  # 进行中的单支任务: id -> (状态, 更新时间)
+        self._single_after = None  # 已见过的最大单支任务 id
+        self._quote_since = None
+        self._last_quotes = {}  # 已推送的行情: 代码 -> (日期, 收盘价, 成交量)
+        SSE_CLIENTS.add_callback(lambda: {(): len(self._subscribers)})
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='event-publisher', daemon=True)
+        self._thread.start()
+
+    # --- 订阅 ---
+    def subscribe(self, topics, codes=()):
+        subscription = Subscription(topics, codes)
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                raise TooManySubscribers(f"推送连接数已达上限 {self.max_clients}")
+            self._subscribers.add(subscription)
+            last_status = self._last_status
+        # 新连接先收到当前进度，不必等下一次变化
+        if last_status is not None and 'progress' in subscription.topics:
+            subscription.put((self._event_id(), 'progress', last_status))
+        self.start()
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _event_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def publish(self, topic, name, data, code_filter=None):
+        """
+        把事件放入订阅了 topic 的客户端缓冲；code_filter(subscription) 返回该客户端应收到的数据，
+        返回 None 或空时跳过该客户端。
+        """
+        with self._lock:
+            subscribers = [s for s in self._subscribers if topic in s.topics]
+        if not subscribers:
+            return
+        event_id = self._event_id()
+        for subscription in subscribers:
+            payload = data if code_filter is None else code_filter(subscription)
+            if payload:
+                subscription.put((event_id, name, payload))
+                SSE_EVENTS.inc(event=name)
+
+    # --- 发布线程 ---
+    def _run(self):
+        while True:
+            with self._lock:
+                topics = set().union(*(s.topics for s in self._subscribers)) if self._subscribers else set()
+            if not topics:
+                # 没有订阅者时不轮询，下次订阅时再从数据库重新取基准
+                self._last_status, self._single_jobs, self._single_after = None, {}, None
+                self._quote_since, self._last_quotes = None, {}
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            try:
+                with metrics.stage('events.poll'):
+                    if topics & {'progress', 'jobs'}:
+                        self._poll_jobs(topics)
+                    if 'quotes' in topics:
+                        self._poll_quotes()
+            except Exception as e:
+                metrics.error('event_publisher')
+                print(f"推送事件轮询失败: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _poll_jobs(self, topics):
+        if 'progress' in topics:
+            status = self.job_manager.status()
+            status.pop('singleJobs', None)
+            if status != self._last_status:
+                self._last_status = status
+                self.publish('progress', 'progress', status)
+        if 'jobs' not in topics:
+            return
+        if self._single_after is None:
+            self._single_after = self.job_manager.last_single_job_id()
+        # 两次轮询之间就已结束的新任务也会被读到 (id 大于已见过的最大 id)
+        jobs = self.job_manager.single_jobs(self._single_after)
+        active = {}
+        for job in jobs:
+            signature = (job['status'], job['updatedAt'])
+            if self._single_jobs.get(job['id']) != signature:
+                self.publish('jobs', 'job', job)
+            if job['status'] in ('pending', 'running'):
+                active[job['id']] = signature
+            self._single_after = max(self._single_after, job['id'])
+        # 从进行中列表消失的任务已经结束，推送最终状态
+        for job_id in set(self._single_jobs) - set(active):
+            job = self.job_manager.job(job_id)
+            if job is not None and job['status'] not in ('pending', 'running'):
+                self.publish('jobs', 'job', {
+                    "id": job['id'], "stockCode": job['stock_code'], "status": job['status'],
+                    "message": job['message'], "attempts": job['attempts'], "updatedAt": job['updated_at']})
+        self._single_jobs = active
+
+    def _poll_quotes(self):
+        quote_snapshot.ensure_snapshot(self.engine)
+        with self.engine.connect() as conn:
+            if self._quote_since is None:
+                # 首次轮询只记录基准：此时已有的行情客户端已经通过列表接口拿到
+                self._quote_since = conn.execute(text(QUOTE_BASELINE_SQL)).scalar()
+                if self._quote_since is None:
+                    return
+                baseline = conn.execute(text(CHANGED_QUOTES_SQL),
+                                        {"since": self._quote_since, "limit": QUOTE_BATCH_LIMIT}).mappings().all()
+                self._last_quotes = {row['code']: (row['date'], row['price'], row['volume']) for row in baseline}
+                return
+            rows = conn.execute(text(CHANGED_QUOTES_SQL),
+                                {"since": self._quote_since, "limit": QUOTE_BATCH_LIMIT}).mappings().all()
+        # 更新时间只精确到秒，同一秒内的行会被重复读到，按已推送的值去重
+        changed = {}
+        for row in rows:
+            signature = (row['date'], row['price'], row['volume'])
+            if self._last_quotes.get(row['code']) == signature:
+                continue
+            self._last_quotes[row['code']] = signature
+            changed[row['code']] = {
+                "code": row['code'], "date": row['date'], "price": row['price'], "prevPrice": row['prevPrice'],
+                "changePercent": row['changePercent'],
+                "volume": f"{max(row['volume'] or 0, 0) / 10000:.2f}",
+            }
+        if rows:
+            self._quote_since = rows[-1]['updatedAt']
+        if changed:
+            self.publish('quotes', 'quotes', changed, code_filter=lambda s: [
+                changed[code] for code in s.codes if code in changed])
+
+
+def stream(publisher, subscription):
+    """SSE 响应体：逐个输出事件，有事件被丢弃时先发 resync 让客户端重新拉取全量；连接断开时退订"""
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        last_sent = time.monotonic()
+        while True:
+            event, dropped = subscription.get(timeout=HEARTBEAT_INTERVAL)
+            if subscription.closed:
+                break
+            if event is None:
+                if time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+                continue
+            if dropped:
+                yield format_event(event[0], 'resync', {"dropped": dropped})
+            yield format_event(*event)
+            last_sent = time.monotonic()
+    finally:
+        publisher.unsubscribe(subscription)
@@ -0,0 +1,261 @@
+import os
+import json
+import fcntl
+import shutil
+import time
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+# --- 配置 ---
+CACHE_DIR = 'cache/history'
+CHUNK_ROWS = 200000  # 流式读取时每块的行数
+REFETCH_OVERLAP_DAYS = 10  # 增量刷新时向前多取的天数，覆盖晚到或被重写的近期数据
+CLOSE_SUM_RTOL = 1e-5  # 缓存为 float32，收盘价合计与数据库的比对容差
+RELOAD_CODES_CHUNK = 500  # 按股票重新读取时每条查询的股票数
+PRICE_COLUMNS = ['open', 'close', 'high', 'low']
+
+HISTORY_SQL = """
+SELECT `股票代码` as code, `日期` as date, `开盘价` as open, `收盘价` as close,
+       `最高价` as high, `最低价` as low, `成交量` as volume
+FROM t_stocks
+{where_clause}
+ORDER BY `股票代码`, `日期`
+"""
+
+# 每支股票在库中的最后日期与行数，增量刷新后用来找出增量查询覆盖不到的股票
+CODE_STATS_SQL = """
+SELECT `股票代码` as code, MAX(`日期`) as last_date, COUNT(*) as row_count, SUM(`收盘价`) as close_sum
+FROM t_stocks
+GROUP BY `股票代码`
+"""
+
+
+class HistoryCache:
+    """
+    全市场日线历史的本地列式缓存。
+    一次有序的流式查询读出 t_stocks，按股票代码切分为连续的 float32 数组，
+    以 .npy + 偏移索引的形式保存在本地 (读取时内存映射)，并记录最新的 `日期`。
+    之后的刷新只拉取该日期之后的数据，再按股票比对行数与最后日期，补读增量覆盖不到的股票。
+    训练脚本、API 服务和更新任务均可复用。
+    """
+
+    def __init__(self, engine, cache_dir=CACHE_DIR):
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.codes = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.columns = {}
+        self.latest_date = None
+        self._code_index = {}
+
+    # --- 读取接口 ---
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self._code_index
+
+    def get(self, code):
+        """返回某支股票的全部列 (数组视图)，不存在时返回 None"""
+        i = self._code_index.get(code)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {name: values[start:end] for name, values in self.columns.items()}
+
+    def series(self, code, column='close'):
+        i = self._code_index.get(code)
+        if i is None:
+            return None
+        return self.columns[column][self.offsets[i]:self.offsets[i + 1]]
+
+    def iter_series(self, column='close'):
+        values = self.columns.get(column)
+        if values is None:
+            return
+        for i, code in enumerate(self.codes):
+            yield code, values[self.offsets[i]:self.offsets[i + 1]]
+
+    def latest_dates(self):
+        """每支股票在缓存中的最后一个交易日"""
+        if not self.codes:
+            return {}
+        last_rows = self.offsets[1:] - 1
+        dates = self.columns['date'][last_rows]
+        return {code: pd.Timestamp(d).date() for code, d in zip(self.codes, dates)}
+
+    # --- 刷新与持久化 ---
+    def refresh(self, full=False):
+        """
+        加载本地缓存并从数据库拉取增量；full=True 时忽略缓存整表重建。
+        多个进程 (各工作进程、训练脚本) 可能同时刷新同一个目录，整个刷新过程持有目录上的文件锁。
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self._refresh_locked(full)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh_locked(self, full):
+        start = time.perf_counter()
+        if not full:
+            self._load()
+        refetch_from = None
+        if self.latest_date is not None and not full:
+            refetch_from = self.latest_date - timedelta(days=REFETCH_OVERLAP_DAYS)
+        new_rows = self._fetch(refetch_from)
+        changed = refetch_from is None or not new_rows.empty
+        if refetch_from is None:
+            self._replace(new_rows)
+        elif not new_rows.empty:
+            self._replace(pd.concat([self._to_frame(), new_rows], ignore_index=True))
+        if refetch_from is not None:
+            changed = self._reconcile() or changed
+        if changed:
+            self._save()
+        print(f"历史数据缓存已就绪: {len(self.codes)} 支股票, {len(self.columns.get('date', []))} 行, "
+              f"最新日期 {self.latest_date}, 本次拉取 {len(new_rows)} 行, 耗时 {time.perf_counter() - start:.1f} 秒。")
+        return self
+
+    def _reconcile(self):
+        """
+        按股票比对缓存与数据库的行数、最后日期与收盘价合计：新增的股票、补录了早于重叠窗口的历史、
+        长期停更后补齐的股票、以及除权除息后整段改写的前复权价格，增量查询都取不到，这些股票单独整支重新读取。
+        返回是否有变化。
+        """
+        with self.engine.connect() as conn:
+            stored = {row[0]: (pd.Timestamp(row[1]).date(), int(row[2]), float(row[3] or 0.0))
+                      for row in conn.execute(text(CODE_STATS_SQL))}
+        cached_dates = self.latest_dates()
+        lengths = np.diff(self.offsets)
+        close_sums = np.add.reduceat(np.nan_to_num(self.columns['close'].astype(np.float64)), self.offsets[:-1]) \
+            if len(self.codes) and len(self.columns['close']) else np.zeros(len(self.codes))
+        cached = {code: (int(count), float(total)) for code, count, total in zip(self.codes, lengths, close_sums)}
+        stale = []
+        for code, (last, count, close_sum) in stored.items():
+            entry = cached.get(code)
+            if entry is None or cached_dates.get(code) != last or entry[0] != count or \
+                    not np.isclose(entry[1], close_sum, rtol=CLOSE_SUM_RTOL, atol=0):
+                stale.append(code)
+        removed = set(self.codes) - set(stored)
+        if not stale and not removed:
+            return False
+        frame = self._to_frame()
+        if len(frame):
+            frame = frame[~frame['code'].isin(set(stale) | removed)]
+        reloaded = [self._fetch(codes=stale[i:i + RELOAD_CODES_CHUNK]) for i in range(0, len(stale), RELOAD_CODES_CHUNK)]
+        self._replace(pd.concat([frame] + reloaded, ignore_index=True))
+        print(f"历史数据缓存按股票重新读取 {len(stale)} 支 (新增、补录或改写历史)，移除 {len(removed)} 支。")
+        return True
+
+    def _fetch(self, since=None, codes=None):
+        conditions, params = [], {}
+        if since is not None:
+            conditions.append("`日期` >= :since")
+            params['since'] = since
+        if codes is not None:
+            conditions.append("`股票代码` IN :codes")
+            params['codes'] = list(codes)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = text(HISTORY_SQL.format(where_clause=where_clause))
+        if codes is not None:
+            sql = sql.bindparams(bindparam('codes', expanding=True))
+        chunks = []
+        with self.engine.connect() as conn:
+            streaming_conn = conn.execution_options(stream_results=True)
+            for chunk in pd.read_sql(sql, con=streaming_conn, params=params, chunksize=CHUNK_ROWS):
+                chunks.append(self._normalize(chunk))
+        if not chunks:
+            return self._normalize(pd.DataFrame(columns=['code', 'date', 'volume'] + PRICE_COLUMNS))
+        return pd.concat(chunks, ignore_index=True)
+
+    @staticmethod
+    def _normalize(df):
+        df['code'] = df['code'].astype(str)
+        df['date'] = pd.to_datetime(df['date']).values.astype('datetime64[D]')
+        for name in PRICE_COLUMNS:
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype(np.float32)
+        df['volume'] = pd.to_numeric(df['volume'], errors='coerce').astype(np.float64)
+        return df
+
+    def _to_frame(self):
+        if not self.codes:
+            return pd.DataFrame()
+        frame = pd.DataFrame({name: np.asarray(values) for name, values in self.columns.items()})
+        frame.insert(0, 'code', np.repeat(np.array(self.codes, dtype=object), np.diff(self.offsets)))
+        return frame
+
+    def _replace(self, df):
+        """用按 (code, date) 去重排序后的数据重建列数组和偏移索引"""
+        df = df.drop_duplicates(['code', 'date'], keep='last').sort_values(['code', 'date'], kind='stable')
+        codes = df['code'].to_numpy()
+        if len(codes):
+            boundaries = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+            starts = np.concatenate([[0], boundaries])
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+        self.codes = codes[starts].tolist()
+        self.offsets = np.append(starts, len(codes)).astype(np.int64)
+        self.columns = {'date': df['date'].to_numpy().astype('datetime64[D]')}
+        for name in PRICE_COLUMNS:
+            self.columns[name] = df[name].to_numpy(dtype=np.float32)
+        self.columns['volume'] = df['volume'].to_numpy(dtype=np.float64)
+        self.latest_date = pd.Timestamp(self.columns['date'].max()).date() if len(codes) else None
+        self._code_index = {code: i for i, code in enumerate(self.codes)}
+
+    def _save(self):
+        """
+        写入新的版本目录，再原子地替换指针文件，读取方不会看到写了一半的缓存。
+        只清理比上一个版本更早的目录：上一个版本可能仍被其他进程内存映射着。
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        pointer = os.path.join(self.cache_dir, 'CURRENT')
+        previous = None
+        if os.path.exists(pointer):
+            with open(pointer) as f:
+                previous = f.read().strip()
+        generation = f"gen-{time.time_ns()}"
+        target = os.path.join(self.cache_dir, generation)
+        os.makedirs(target)
+        for name, values in self.columns.items():
+            np.save(os.path.join(target, f"{name}.npy"), values)
+        with open(os.path.join(target, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                "codes": self.codes, "offsets": self.offsets.tolist(),
+                "latest_date": self.latest_date.isoformat() if self.latest_date else None,
+            }, f, ensure_ascii=False)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(generation)
+        os.replace(pointer + '.tmp', pointer)
+        if previous is None or not previous.startswith('gen-'):
+            return
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith('gen-') and int(entry[4:]) < int(previous[4:]):
+                shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
+
+    def _load(self):
+        pointer = os.path.join(self.cache_dir, 'CURRENT')
+        if not os.path.exists(pointer):
+            return False
+        try:
+            with open(pointer) as f:
+                target = os.path.join(self.cache_dir, f.read().strip())
+            with open(os.path.join(target, 'index.json'), encoding='utf-8') as f:
+                index = json.load(f)
+            self.columns = {
+                name: np.load(os.path.join(target, f"{name}.npy"), mmap_mode='r')
+                for name in ['date', 'volume'] + PRICE_COLUMNS
+            }
+        except Exception as e:
+            print(f"历史数据缓存读取失败，将重新全量加载: {e}")
+            self.columns, self.latest_date = {}, None
+            return False
+        self.codes = index['codes']
+        self.offsets = np.array(index['offsets'], dtype=np.int64)
+        self.latest_date = pd.Timestamp(index['latest_date']).date() if index['latest_date'] else None
+        self._code_index = {code: i for i, code in enumerate(self.codes)}
+        return True
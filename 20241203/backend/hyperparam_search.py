@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import db_compat
+from history_cache import HistoryCache
+from norm_stats import NormalizationStats, scale
+import model_registry
+
+# --- 配置 ---
+# 搜索空间：每个参数的候选值，试验从全部组合中无放回随机抽取
+SEARCH_SPACE = {
+    'look_back': [30, 60, 90],
+    'units': [32, 50, 64, 96],
+    'layers': [1, 2, 3],
+    'dropout': [0.0, 0.1, 0.2, 0.3],
+    'batch_size': [64, 128, 256],
+    'learning_rate': [3e-4, 1e-3, 3e-3],
+}
+TRIALS = 24
+THREADS_PER_WORKER = 2  # 每个工作进程的 TensorFlow/BLAS 线程数，进程数 = CPU 核数 / 该值
+WORKERS = max(1, (os.cpu_count() or 2) // THREADS_PER_WORKER)
+MAX_EPOCHS = 20
+PATIENCE = 3  # 验证损失连续多少个回合没有改善就提前停止
+VALIDATION_DATES = 60  # 留出最近多少个交易日 (按目标日期) 作为验证集，训练只用更早的窗口
+MAX_TRAIN_WINDOWS = 200000  # 每个试验最多使用的训练窗口数 (随机抽样)，控制单个试验的耗时
+MAX_VALIDATION_WINDOWS = 50000
+PRUNE_WARMUP_EPOCHS = 2  # 前几个回合不剪枝
+PRUNE_MIN_TRIALS = 4  # 同一回合至少有多少个其他试验的结果才开始比较
+INFERENCE_BATCH_SIZE = 256  # 测量推理耗时的批大小
+INFERENCE_REPEATS = 5
+SEARCH_DIR = 'models/search'
+SEED = 42
+
+# 工作进程内的全局状态，由 _init_worker 设置
+_worker = {}
+
+
+# --- 数据 ---
+def load_series(engine, min_length):
+    """按股票归一化的收盘价序列与对应日期；归一化方式与 ml.py 的全量训练一致"""
+    history = HistoryCache(engine).refresh()
+    if not len(history):
+        raise ValueError("在数据库中未找到任何股票代码。")
+    norm = NormalizationStats.from_history(history, 'per_stock', min_length=min_length)
+    series, dates = [], []
+    for code in history.codes:
+        columns = history.get(code)
+        if len(columns['close']) > min_length:
+            lo, hi, _ = norm.bounds(code)
+            series.append(scale(columns['close'], lo, hi).astype(np.float32))
+            dates.append(columns['date'])
+    if not series:
+        raise ValueError("没有找到足够长的股票数据来搜索超参数。")
+    return history, norm, series, dates
+
+
+def validation_cutoff(dates, validation_dates=VALIDATION_DATES):
+    """全市场倒数第 validation_dates 个交易日：目标日期不早于它的窗口属于验证集"""
+    all_dates = np.unique(np.concatenate(dates))
+    return all_dates[max(0, len(all_dates) - validation_dates)]
+
+
+def sample_trials(space, trials, seed=SEED):
+    """从搜索空间的全部组合中无放回抽取 trials 个"""
+    names = list(space)
+    combos = list(itertools.product(*(space[name] for name in names)))
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(combos), size=min(trials, len(combos)), replace=False)
+    return [dict(zip(names, combos[i]), trial=n) for n, i in enumerate(sorted(picked))]
+
+
+# --- 工作进程 ---
+def _init_worker(series, dates, cutoff, threads, reports, search_dir):
+    # 线程数必须在导入 TensorFlow 之前设定；各进程只用 CPU，避免争抢同一块 GPU 的显存
+    os.environ.update(OMP_NUM_THREADS=str(threads), TF_NUM_INTRAOP_THREADS=str(threads),
+                      TF_NUM_INTEROP_THREADS='1', CUDA_VISIBLE_DEVICES='-1', TF_CPP_MIN_LOG_LEVEL='2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    import ml
+    _worker.update(tf=tf, ml=ml, series=series, dates=dates, cutoff=cutoff, reports=reports,
+                   search_dir=search_dir, windows={})
+
+
+def _split_windows(look_back):
+    """按目标日期把窗口切分为训练集与验证集 (同一 look_back 的试验复用)"""
+    w = _worker
+    if look_back not in w['windows']:
+        flat, starts = w['ml'].build_window_index(w['series'], look_back)
+        flat_dates = np.concatenate(w['dates'])
+        is_validation = flat_dates[starts + look_back] >= w['cutoff']
+        w['windows'][look_back] = (flat, starts[~is_validation], starts[is_validation])
+    return w['windows'][look_back]
+
+
+def _should_prune(trial_id, epoch, best_loss):
+    """中位数剪枝：本回合的最优验证损失差于其他试验同一回合的中位数时放弃"""
+    reports = dict(_worker['reports'])
+    others = [loss for (other, reported_epoch), loss in reports.items() if reported_epoch == epoch and other != trial_id]
+    return epoch >= PRUNE_WARMUP_EPOCHS and len(others) >= PRUNE_MIN_TRIALS and best_loss > np.median(others)
+
+
+def _direction_accuracy(model, flat, starts, look_back, batch_size):
+    windows = np.lib.stride_tricks.sliding_window_view(flat, look_back)
+    predicted = model.predict(windows[starts][..., None], batch_size=batch_size, verbose=0).ravel()
+    last, actual = flat[starts + look_back - 1], flat[starts + look_back]
+    return float(np.mean(np.sign(predicted - last) == np.sign(actual - last)))
+
+
+def _inference_cost(model, flat, starts, look_back):
+    """单批推理耗时的中位数 (毫秒)，与服务端的微批量推理对应"""
+    windows = np.lib.stride_tricks.sliding_window_view(flat, look_back)
+    batch = np.ascontiguousarray(windows[starts[:INFERENCE_BATCH_SIZE]][..., None])
+    model.predict_on_batch(batch)  # 预热
+    timings = []
+    for _ in range(INFERENCE_REPEATS):
+        start = time.perf_counter()
+        model.predict_on_batch(batch)
+        timings.append(time.perf_counter() - start)
+    return round(float(np.median(timings)) * 1000, 2)
+
+
+def run_trial(params, max_epochs=MAX_EPOCHS, patience=PATIENCE):
+    """训练一个候选模型，按验证损失提前停止或剪枝；返回准确度与训练/推理开销"""
+    w = _worker
+    tf, ml = w['tf'], w['ml']
+    trial_id, look_back, batch_size = params['trial'], params['look_back'], params['batch_size']
+    np.random.seed(SEED + trial_id)
+    tf.random.set_seed(SEED + trial_id)
+    flat, train_starts, val_starts = _split_windows(look_back)
+    rng = np.random.default_rng(SEED + trial_id)
+    if len(train_starts) > MAX_TRAIN_WINDOWS:
+        train_starts = np.sort(rng.choice(train_starts, MAX_TRAIN_WINDOWS, replace=False))
+    if len(val_starts) > MAX_VALIDATION_WINDOWS:
+        val_starts = np.sort(rng.choice(val_starts, MAX_VALIDATION_WINDOWS, replace=False))
+    result = dict(params, status='failed', epochs=0, train_windows=int(len(train_starts)),
+                  validation_windows=int(len(val_starts)))
+    if not len(train_starts) or not len(val_starts):
+        result['message'] = "训练集或验证集为空"
+        return result
+
+    model = ml.build_model(look_back=look_back, units=params['units'], layers=params['layers'],
+                           dropout=params['dropout'], learning_rate=params['learning_rate'])
+    train_dataset = ml.create_dataset(flat, train_starts, look_back, batch_size)
+    val_dataset = ml.create_dataset(flat, val_starts, look_back, batch_size, shuffle=False)
+    best_loss, best_weights, best_epoch, losses = float('inf'), None, 0, []
+    status, train_seconds = 'completed', 0.0
+    for epoch in range(1, max_epochs + 1):
+        start = time.perf_counter()
+        model.fit(train_dataset, epochs=1, verbose=0)
+        train_seconds += time.perf_counter() - start
+        loss = float(model.evaluate(val_dataset, verbose=0))
+        losses.append(round(loss, 8))
+        if loss < best_loss:
+            best_loss, best_weights, best_epoch = loss, model.get_weights(), epoch
+        w['reports'][(trial_id, epoch)] = best_loss
+        if _should_prune(trial_id, epoch, best_loss):
+            status = 'pruned'
+            break
+        if epoch - best_epoch >= patience:
+            break
+    model.set_weights(best_weights)
+    result.update(
+        status=status, epochs=len(losses), best_epoch=best_epoch, val_loss=best_loss, val_losses=losses,
+        val_rmse=float(np.sqrt(best_loss)),
+        direction_accuracy=_direction_accuracy(model, flat, val_starts, look_back, batch_size),
+        train_seconds=round(train_seconds, 2),
+        samples_per_sec=round(len(train_starts) * len(losses) / train_seconds, 1) if train_seconds > 0 else 0.0,
+        inference_ms=_inference_cost(model, flat, val_starts, look_back),
+        params=int(model.count_params()),
+    )
+    if status == 'completed':
+        result['model_path'] = os.path.join(w['search_dir'], f"trial-{trial_id:03d}.h5")
+        model.save(result['model_path'])
+    return result
+
+
+# --- 主进程 ---
+def _format_result(result):
+    if result['status'] == 'failed':
+        return f"试验 {result['trial']:>3} 失败: {result.get('message')}"
+    return (f"试验 {result['trial']:>3} [{result['status']}] look_back={result['look_back']} units={result['units']} "
+            f"layers={result['layers']} dropout={result['dropout']} batch={result['batch_size']} "
+            f"lr={result['learning_rate']}: val_loss={result['val_loss']:.6f} "
+            f"方向准确率={result['direction_accuracy']:.3f} 回合={result['epochs']} "
+            f"训练 {result['train_seconds']} 秒, 推理 {result['inference_ms']} 毫秒/{INFERENCE_BATCH_SIZE} 条")
+
+
+def search(engine, trials=TRIALS, workers=WORKERS, threads=THREADS_PER_WORKER, max_epochs=MAX_EPOCHS,
+           search_dir=SEARCH_DIR, seed=SEED):
+    """
+    并行随机搜索：主进程加载一次数据，以 spawn 方式启动进程池 (主进程不导入 TensorFlow)，
+    每个进程限制线程数后训练分到的试验。各回合的验证损失写入共享字典，供其他进程做中位数剪枝。
+    每个试验结束即追加到 trials.jsonl，返回 (全部结果, 历史数据, 归一化参数)。
+    """
+    os.makedirs(search_dir, exist_ok=True)
+    history, norm, series, dates = load_series(engine, max(SEARCH_SPACE['look_back']))
+    cutoff = validation_cutoff(dates)
+    candidates = sample_trials(SEARCH_SPACE, trials, seed)
+    print(f"共 {len(candidates)} 个试验, {workers} 个进程 x {threads} 线程, 验证集为 {cutoff} 之后的目标日期。")
+    results_path = os.path.join(search_dir, 'trials.jsonl')
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        reports = manager.dict()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(series, dates, cutoff, threads, reports, search_dir)) as pool:
+            futures = {pool.submit(run_trial, params, max_epochs): params for params in candidates}
+            with open(results_path, 'a', encoding='utf-8') as f:
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = dict(futures[future], status='failed', message=str(e))
+                    result['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    results.append(result)
+                    f.write(json.dumps(result, ensure_ascii=False) + '\n')
+                    f.flush()
+                    print(_format_result(result))
+    return results, history, norm
+
+
+def best_trial(results, look_back=None):
+    completed = [r for r in results if r['status'] == 'completed' and (look_back is None or r['look_back'] == look_back)]
+    return min(completed, key=lambda r: r['val_loss']) if completed else None
+
+
+def export_best(results, history, norm):
+    """
+    用 ml.publish_model 发布验证损失最低的模型 (与全量训练相同的文件、归一化参数与水位线)，服务端自动热加载。
+    服务端的窗口长度固定为 model_registry.LOOK_BACK_DAYS，只在窗口长度与之相同的试验中选择。
+    """
+    serving_look_back = model_registry.LOOK_BACK_DAYS
+    overall, best = best_trial(results), best_trial(results, serving_look_back)
+    if overall is not None and overall is not best:
+        print(f"验证损失最低的是试验 {overall['trial']} (look_back={overall['look_back']})，"
+              f"需同步修改服务端的 LOOK_BACK_DAYS 后才能使用，本次发布窗口长度为 {serving_look_back} 的最优试验。")
+    if best is None:
+        print(f"没有窗口长度为 {serving_look_back} 的完成试验，不发布模型。")
+        return None
+    import ml
+    from tensorflow.keras.models import load_model
+    meta = {key: best[key] for key in ('trial', 'units', 'layers', 'dropout', 'batch_size', 'learning_rate',
+                                       'val_loss', 'direction_accuracy', 'train_seconds', 'samples_per_sec',
+                                       'inference_ms')}
+    return ml.publish_model(load_model(best['model_path']), norm,
+                            dict(meta, mode='search', look_back=best['look_back'],
+                                 watermark=str(history.latest_date)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="并行搜索 LSTM 超参数与结构")
+    parser.add_argument('--trials', type=int, default=TRIALS, help="试验数")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="并行的进程数")
+    parser.add_argument('--threads', type=int, default=THREADS_PER_WORKER, help="每个进程的线程数")
+    parser.add_argument('--max-epochs', type=int, default=MAX_EPOCHS, help="每个试验最多训练的回合数")
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--export', action='store_true', help="搜索结束后发布最优模型")
+    args = parser.parse_args()
+    search_results, search_history, search_norm = search(
+        db_compat.create_db_engine(name='search'), args.trials, args.workers, args.threads, args.max_epochs, seed=args.seed)
+    ranked = sorted((r for r in search_results if r['status'] == 'completed'), key=lambda r: r['val_loss'])
+    print("验证损失最低的试验:")
+    for r in ranked[:5]:
+        print("  " + _format_result(r))
+    if args.export:
+        export_best(search_results, search_history, search_norm)
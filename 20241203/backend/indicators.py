@@ -0,0 +1,482 @@
+import re
+import time
+import threading
+import numpy as np
+import pandas as pd
+import metrics
+from history_cache import HistoryCache
+
+# --- 配置 ---
+PANEL_BARS = 320  # 每支股票保留的最近日线根数 (K 线接口默认返回 200 根，其余用作指数均线的预热)
+# 预先计算的指标；名称为 "族_参数"，参数省略时使用族的默认参数
+INDICATORS = ['EMA_12', 'EMA_26', 'MACD', 'RSI_14', 'BOLL', 'ATR_14', 'VMA_5', 'VMA_10']
+REFRESH_INTERVAL = 300  # 面板的最长使用时间 (秒)，过期后在后台增量刷新；多进程部署时作为兜底
+MAX_INCREMENTAL_BARS = 20  # 单支股票新增超过该根数时整体重算
+SCREEN_LIMIT = 100
+SCREEN_MAX_LIMIT = 1000
+INPUT_COLUMNS = ['CLOSE', 'HIGH', 'LOW', 'VOLUME']  # 筛选条件中可直接引用的行情列
+
+CONDITION_PATTERN = re.compile(r'^\s*([A-Za-z0-9_]+)\s*(<=|>=|==|!=|<|>)\s*([A-Za-z0-9_.\-]+)\s*$')
+OPERATORS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal,
+             '==': np.equal, '!=': np.not_equal}
+
+
+# --- 面板上的向量化计算 (每行一支股票，按时间向右排列，左侧不足的部分为 NaN) ---
+def rolling_mean(x, n):
+    """按行的 n 期简单移动平均，窗口不满时为 NaN"""
+    valid = ~np.isnan(x)
+    sums = np.cumsum(np.where(valid, x, 0.0), axis=1)
+    counts = np.cumsum(valid, axis=1)
+    sums[:, n:] = sums[:, n:] - sums[:, :-n]
+    counts[:, n:] = counts[:, n:] - counts[:, :-n]
+    out = sums / n
+    out[counts < n] = np.nan
+    return out
+
+
+def rolling_std(x, n):
+    """按行的 n 期总体标准差 (ddof=0，与 pandas_ta.bbands 一致)"""
+    mean = rolling_mean(x, n)
+    mean_sq = rolling_mean(x * x, n)
+    return np.sqrt(np.maximum(mean_sq - mean * mean, 0.0))
+
+
+def ema_next(prev, x, seed, alpha):
+    """指数均线递推一步；尚无上一期值的行用 seed (前 n 期简单均值) 起算"""
+    return np.where(np.isnan(prev), seed, alpha * x + (1 - alpha) * prev)
+
+
+def ema_panel(x, n, alpha=None):
+    """
+    以前 n 期简单均值为起点的指数均线 (alpha 默认 2/(n+1)；Wilder 平滑为 1/n)。
+    递推只沿时间方向循环，每一步对全部股票向量化计算。
+    """
+    alpha = 2.0 / (n + 1) if alpha is None else alpha
+    seed = rolling_mean(x, n)
+    out = np.full(x.shape, np.nan)
+    prev = np.full(x.shape[0], np.nan)
+    for t in range(x.shape[1]):
+        prev = ema_next(prev, x[:, t], seed[:, t], alpha)
+        out[:, t] = prev
+    return out
+
+
+def shift_right(x):
+    out = np.full(x.shape, np.nan)
+    out[:, 1:] = x[:, :-1]
+    return out
+
+
+def true_range(high, low, prev_close):
+    """真实波幅；没有前收盘价时为最高价 - 最低价"""
+    return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def rsi_value(avg_gain, avg_loss):
+    total = avg_gain + avg_loss
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, 100.0 * avg_gain / total, np.where(np.isnan(total), np.nan, 50.0))
+
+
+# --- 指标族 ---
+class Indicator:
+    """
+    一个指标族的实例。compute 在整个面板上计算全部输出，step 在新增一根 K 线后
+    只计算指定行的最后一列 (面板已左移一格、新行情已写入最后一列)。
+    需要跨 K 线保存的中间量 (不在输出中的均线) 按行保存在 state 中。
+    """
+    defaults = ()
+
+    def __init__(self, spec, params):
+        self.spec = spec
+        self.params = params
+        self.state = {}
+
+    @property
+    def outputs(self):
+        return [self.spec]
+
+    def compute(self, panel):
+        raise NotImplementedError
+
+    def step(self, panel, rows):
+        raise NotImplementedError
+
+
+class EMA(Indicator):
+    defaults = (12,)
+
+    def compute(self, panel):
+        return {self.spec: ema_panel(panel['CLOSE'], self.params[0])}
+
+    def step(self, panel, rows):
+        n = self.params[0]
+        close = panel['CLOSE'][rows]
+        out = panel[self.spec]
+        out[rows, -1] = ema_next(out[rows, -2], close[:, -1], close[:, -n:].mean(axis=1), 2.0 / (n + 1))
+
+
+class MACD(Indicator):
+    """DIF = EMA(fast) - EMA(slow)，DEA = EMA(DIF, signal)，柱 = 2 * (DIF - DEA) (国内行情软件的口径)"""
+    defaults = (12, 26, 9)
+
+    @property
+    def outputs(self):
+        return [f"{self.spec}_DIF", f"{self.spec}_DEA", f"{self.spec}_HIST"]
+
+    def compute(self, panel):
+        fast, slow, signal = self.params
+        ema_fast, ema_slow = ema_panel(panel['CLOSE'], fast), ema_panel(panel['CLOSE'], slow)
+        self.state = {'fast': ema_fast[:, -1].copy(), 'slow': ema_slow[:, -1].copy()}
+        dif = ema_fast - ema_slow
+        dea = ema_panel(dif, signal)
+        return dict(zip(self.outputs, (dif, dea, 2 * (dif - dea))))
+
+    def step(self, panel, rows):
+        fast, slow, signal = self.params
+        dif_name, dea_name, hist_name = self.outputs
+        close = panel['CLOSE'][rows]
+        for key, n in (('fast', fast), ('slow', slow)):
+            self.state[key][rows] = ema_next(self.state[key][rows], close[:, -1], close[:, -n:].mean(axis=1),
+                                             2.0 / (n + 1))
+        dif = self.state['fast'][rows] - self.state['slow'][rows]
+        panel[dif_name][rows, -1] = dif
+        dea = ema_next(panel[dea_name][rows, -2], dif, panel[dif_name][rows, -signal:].mean(axis=1),
+                       2.0 / (signal + 1))
+        panel[dea_name][rows, -1] = dea
+        panel[hist_name][rows, -1] = 2 * (dif - dea)
+
+
+class RSI(Indicator):
+    """Wilder 平滑的相对强弱指标"""
+    defaults = (14,)
+
+    def compute(self, panel):
+        n = self.params[0]
+        close = panel['CLOSE']
+        delta = close - shift_right(close)
+        gain = np.where(np.isnan(delta), np.nan, np.maximum(delta, 0.0))
+        loss = np.where(np.isnan(delta), np.nan, np.maximum(-delta, 0.0))
+        avg_gain, avg_loss = ema_panel(gain, n, 1.0 / n), ema_panel(loss, n, 1.0 / n)
+        self.state = {'gain': avg_gain[:, -1].copy(), 'loss': avg_loss[:, -1].copy()}
+        return {self.spec: rsi_value(avg_gain, avg_loss)}
+
+    def step(self, panel, rows):
+        n = self.params[0]
+        deltas = np.diff(panel['CLOSE'][rows, -(n + 1):], axis=1)
+        for key, values in (('gain', np.maximum(deltas, 0.0)), ('loss', np.maximum(-deltas, 0.0))):
+            # np.maximum 会传播 NaN，不足 n + 1 根时起算值仍为 NaN
+            self.state[key][rows] = ema_next(self.state[key][rows], values[:, -1], values.mean(axis=1), 1.0 / n)
+        panel[self.spec][rows, -1] = rsi_value(self.state['gain'][rows], self.state['loss'][rows])
+
+
+class BOLL(Indicator):
+    """布林带：中轨为 n 期均线，上下轨为中轨 ± k 倍总体标准差"""
+    defaults = (20, 2)
+
+    @property
+    def outputs(self):
+        return [f"{self.spec}_MID", f"{self.spec}_UPPER", f"{self.spec}_LOWER"]
+
+    def compute(self, panel):
+        n, k = self.params
+        mid, std = rolling_mean(panel['CLOSE'], n), rolling_std(panel['CLOSE'], n)
+        return dict(zip(self.outputs, (mid, mid + k * std, mid - k * std)))
+
+    def step(self, panel, rows):
+        n, k = self.params
+        window = panel['CLOSE'][rows, -n:]
+        mid, std = window.mean(axis=1), window.std(axis=1)
+        for name, values in zip(self.outputs, (mid, mid + k * std, mid - k * std)):
+            panel[name][rows, -1] = values
+
+
+class ATR(Indicator):
+    """平均真实波幅 (Wilder 平滑)"""
+    defaults = (14,)
+
+    def compute(self, panel):
+        n = self.params[0]
+        tr = true_range(panel['HIGH'], panel['LOW'], shift_right(panel['CLOSE']))
+        return {self.spec: ema_panel(tr, n, 1.0 / n)}
+
+    def step(self, panel, rows):
+        n = self.params[0]
+        close = panel['CLOSE'][rows, -(n + 1):]
+        tr = true_range(panel['HIGH'][rows, -n:], panel['LOW'][rows, -n:], close[:, :-1])
+        out = panel[self.spec]
+        out[rows, -1] = ema_next(out[rows, -2], tr[:, -1], tr.mean(axis=1), 1.0 / n)
+
+
+class VMA(Indicator):
+    """成交量均线"""
+    defaults = (5,)
+
+    def compute(self, panel):
+        return {self.spec: rolling_mean(panel['VOLUME'], self.params[0])}
+
+    def step(self, panel, rows):
+        panel[self.spec][rows, -1] = panel['VOLUME'][rows, -self.params[0]:].mean(axis=1)
+
+
+FAMILIES = {'EMA': EMA, 'MACD': MACD, 'RSI': RSI, 'BOLL': BOLL, 'ATR': ATR, 'VMA': VMA}
+
+
+def make_indicator(spec):
+    """由 "RSI_14"、"MACD_12_26_9"、"BOLL" 这样的名称构造指标；名称无效时抛出 ValueError"""
+    family, *params = spec.upper().split('_')
+    cls = FAMILIES.get(family)
+    if cls is None or len(params) > len(cls.defaults):
+        raise ValueError(f"未知的指标: {spec}")
+    try:
+        values = tuple(float(p) if '.' in p else int(p) for p in params)
+    except ValueError:
+        raise ValueError(f"无效的指标参数: {spec}")
+    values += cls.defaults[len(values):]
+    if any(value <= 0 for value in values) or max(values) > PANEL_BARS // 2:
+        raise ValueError(f"指标参数超出范围: {spec}")
+    return cls(spec.upper(), values)
+
+
+def resolve(tokens, specs):
+    """
+    把请求中的 indicators= 解析为输出列：可以写指标名 (得到它的全部输出，如 MACD) 或单个输出列 (如 MACD_HIST)。
+    返回 (需要的指标名列表, 输出列列表)。
+    """
+    by_output = {}
+    for spec in specs:
+        for output in make_indicator(spec).outputs:
+            by_output[output] = spec
+    needed, outputs = [], []
+    for token in tokens:
+        token = token.strip().upper()
+        if not token:
+            continue
+        if token in specs:
+            spec, names = token, make_indicator(token).outputs
+        elif token in by_output:
+            spec, names = by_output[token], [token]
+        else:
+            raise ValueError(f"未知的指标: {token}，可选: {', '.join(specs)}")
+        if spec not in needed:
+            needed.append(spec)
+        outputs.extend(name for name in names if name not in outputs)
+    return needed, outputs
+
+
+def compute_frame(bars, specs, outputs):
+    """
+    在一支股票自己的 K 线 (如周线/月线，列为 price/high/low/volume) 上现算指标，
+    与面板使用同一套实现；返回 {输出列: 数组}。
+    """
+    panel = {
+        'CLOSE': bars['price'].to_numpy(dtype=np.float64)[None, :],
+        'HIGH': bars['high'].to_numpy(dtype=np.float64)[None, :],
+        'LOW': bars['low'].to_numpy(dtype=np.float64)[None, :],
+        'VOLUME': bars['volume'].to_numpy(dtype=np.float64)[None, :],
+    }
+    values = {}
+    for spec in specs:
+        values.update(make_indicator(spec).compute(panel))
+    return {name: values[name][0] for name in outputs}
+
+
+# --- 全市场面板 ---
+class IndicatorEngine:
+    """
+    全市场技术指标引擎：从 HistoryCache 取每支股票最近 PANEL_BARS 根日线，按 (股票 x K 线) 右对齐成面板，
+    一次性向量化计算配置的全部指标；之后有新交易日时只左移有新 K 线的行、递推最后一列。
+    支持按股票取指标序列 (K 线接口的 indicators= 参数)，以及在最新一根 K 线上做全市场横截面筛选。
+    """
+
+    def __init__(self, engine, specs=INDICATORS, bars=PANEL_BARS, refresh_interval=REFRESH_INTERVAL):
+        self.engine = engine
+        self.specs = [spec.upper() for spec in specs]
+        self.bars = bars
+        self.refresh_interval = refresh_interval
+        self.history = HistoryCache(engine)
+        self._indicators = []
+        self._panel = None  # 列名 -> (股票数 x bars) 数组，包括输入列、DATE 与全部指标输出
+        self._codes = []
+        self._code_index = {}
+        self._built_at = None
+        self._lock = threading.Lock()  # 保护面板的读取与原地增量更新
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._panel is not None
+
+    @property
+    def outputs(self):
+        return [name for indicator in self._indicators for name in indicator.outputs]
+
+    # --- 构建与刷新 ---
+    def _build(self, history):
+        start = time.perf_counter()
+        n, bars = len(history.codes), self.bars
+        lengths = np.diff(history.offsets)
+        take = np.minimum(lengths, bars)
+        total = int(take.sum())
+        within = np.arange(total) - np.repeat(np.cumsum(take) - take, take)
+        rows = np.repeat(np.arange(n), take)
+        cols = bars - np.repeat(take, take) + within
+        source = np.repeat(history.offsets[1:] - take, take) + within
+        panel = {'DATE': np.full((n, bars), np.datetime64('NaT'), dtype='datetime64[D]')}
+        panel['DATE'][rows, cols] = history.columns['date'][source]
+        for name, column in (('CLOSE', 'close'), ('HIGH', 'high'), ('LOW', 'low'), ('VOLUME', 'volume')):
+            panel[name] = np.full((n, bars), np.nan)
+            panel[name][rows, cols] = history.columns[column][source]
+        indicators = [make_indicator(spec) for spec in self.specs]
+        for indicator in indicators:
+            panel.update(indicator.compute(panel))
+        with self._lock:
+            self._panel, self._indicators = panel, indicators
+            self._codes = list(history.codes)
+            self._code_index = {code: i for i, code in enumerate(self._codes)}
+        self._built_at = time.monotonic()
+        print(f"技术指标面板已构建: {n} 支股票 x {bars} 根, {len(self.outputs)} 个指标列, "
+              f"耗时 {(time.perf_counter() - start) * 1000:.0f} 毫秒。")
+
+    def _new_bar_counts(self, history):
+        """每支股票在面板最后一根之后新增的 K 线数；已有 K 线被改写 (收盘价不同) 时返回 None"""
+        panel = self._panel
+        counts = np.zeros(len(self._codes), dtype=np.int64)
+        dates, closes = history.columns['date'], history.columns['close']
+        for i in range(len(self._codes)):
+            start, end = history.offsets[i], history.offsets[i + 1]
+            last_date = panel['DATE'][i, -1]
+            if np.isnat(last_date):
+                counts[i] = end - start
+                continue
+            position = start + np.searchsorted(dates[start:end], last_date, side='right')
+            if position - 1 < start or dates[position - 1] != last_date or \
+                    not np.isclose(closes[position - 1], panel['CLOSE'][i, -1], rtol=1e-6):
+                return None
+            counts[i] = end - position
+        return counts
+
+    def _apply_new_bars(self, history, counts):
+        """逐根追加新 K 线：第 j 轮处理新增数超过 j 的行，每轮对这些行整体左移一格后递推最后一列"""
+        panel = self._panel
+        inputs = (('DATE', 'date'), ('CLOSE', 'close'), ('HIGH', 'high'), ('LOW', 'low'), ('VOLUME', 'volume'))
+        for j in range(int(counts.max())):
+            rows = np.flatnonzero(counts > j)
+            source = history.offsets[1:][rows] - counts[rows] + j
+            for values in panel.values():
+                values[rows, :-1] = values[rows, 1:]
+            for name, column in inputs:
+                panel[name][rows, -1] = history.columns[column][source]
+            for indicator in self._indicators:
+                indicator.step(panel, rows)
+
+    def refresh(self, full=False):
+        """从历史缓存拉取增量；股票集合变化、新增过多或历史被改写时整体重算"""
+        with self._refresh_lock:
+            start = time.perf_counter()
+            history = self.history.refresh()
+            if full or self._panel is None or history.codes != self._codes:
+                self._build(history)
+                return
+            counts = self._new_bar_counts(history)
+            if counts is None or counts.max(initial=0) > MAX_INCREMENTAL_BARS:
+                self._build(history)
+                return
+            if counts.max(initial=0) > 0:
+                with self._lock:
+                    self._apply_new_bars(history, counts)
+                print(f"技术指标面板增量更新: {int((counts > 0).sum())} 支股票, 共 {int(counts.sum())} 根新 K 线, "
+                      f"耗时 {(time.perf_counter() - start) * 1000:.0f} 毫秒。")
+            self._built_at = time.monotonic()
+
+    def refresh_in_background(self, full=False):
+        if self._refresh_lock.locked():
+            return
+
+        def run():
+            try:
+                self.refresh(full)
+            except Exception as e:
+                metrics.error('indicator_engine')
+                print(f"技术指标面板刷新失败: {e}")
+
+        threading.Thread(target=run, name='indicator-refresh', daemon=True).start()
+
+    def _ensure(self):
+        """尚未构建时同步构建；过期时在后台刷新并继续使用当前面板"""
+        if self._panel is None:
+            self.refresh()
+        elif self._built_at is None or time.monotonic() - self._built_at > self.refresh_interval:
+            self.refresh_in_background()
+
+    # --- 查询 ---
+    def resolve(self, tokens):
+        return resolve(tokens, self.specs)
+
+    def series(self, code, outputs):
+        """某支股票的指标序列：DataFrame (date + 输出列)，股票不在面板中时返回 None"""
+        self._ensure()
+        with self._lock:
+            i = self._code_index.get(code)
+            if i is None:
+                return None
+            dates = self._panel['DATE'][i]
+            valid = ~np.isnat(dates)
+            frame = pd.DataFrame({'date': dates[valid]})
+            for name in outputs:
+                frame[name] = self._panel[name][i][valid]
+        return frame
+
+    def screen(self, conditions, sort=None, limit=SCREEN_LIMIT, include_stale=False):
+        """
+        在每支股票最新一根 K 线上做横截面筛选 (全部股票一次向量化比较)。
+        conditions 如 ["RSI_14<30", "CLOSE<BOLL_LOWER"]，右侧可以是数值或另一列；
+        sort 为列名，前缀 "-" 表示降序。默认只包含最新交易日有行情的股票 (排除停牌)。
+        """
+        parsed = [self._parse_condition(condition) for condition in conditions]
+        columns = [column for lhs, _, rhs in parsed for column in (lhs, rhs) if isinstance(column, str)]
+        sort_column = sort.lstrip('-').upper() if sort else None
+        if sort_column:
+            columns.append(sort_column)
+        self._ensure()
+        unknown = [name for name in columns if name not in INPUT_COLUMNS and name not in self.outputs]
+        if unknown:
+            raise ValueError(f"未知的列: {', '.join(unknown)}，可选: {', '.join(INPUT_COLUMNS + self.outputs)}")
+        with self._lock:
+            panel = self._panel
+            latest = {name: panel[name][:, -1].copy() for name in set(columns) | {'CLOSE'}}
+            dates = panel['DATE'][:, -1].copy()
+            codes = self._codes
+        mask = ~np.isnat(dates)
+        if not include_stale and mask.any():
+            mask &= dates == dates[mask].max()
+        with np.errstate(invalid='ignore'):
+            for lhs, op, rhs in parsed:
+                right = latest[rhs] if isinstance(rhs, str) else rhs
+                mask &= OPERATORS[op](latest[lhs], right)
+        matched = np.flatnonzero(mask)
+        if sort_column:
+            order = np.argsort(latest[sort_column][matched], kind='stable')
+            if sort.startswith('-'):
+                order = order[::-1]
+            matched = matched[order]
+        as_of = pd.Timestamp(dates[mask].max()).date() if mask.any() else None
+        rows = []
+        for i in matched[:limit]:
+            row = {"code": codes[i], "date": pd.Timestamp(dates[i]).date()}
+            for name in dict.fromkeys(['CLOSE'] + columns):
+                value = latest[name][i]
+                row[name] = None if np.isnan(value) else round(float(value), 4)
+            rows.append(row)
+        return {"asOf": as_of, "total": int(len(matched)), "data": rows}
+
+    def _parse_condition(self, condition):
+        match = CONDITION_PATTERN.match(condition)
+        if not match:
+            raise ValueError(f"无效的筛选条件: {condition}")
+        lhs, op, rhs = match.group(1).upper(), match.group(2), match.group(3)
+        try:
+            rhs = float(rhs)
+        except ValueError:
+            rhs = rhs.upper()
+        return lhs, op, rhs
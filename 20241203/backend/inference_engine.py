@@ -0,0 +1,154 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy as np
+import metrics
+
+# --- 配置 ---
+LOOK_BACK_DAYS = 60
+FORECAST_DAYS = 5
+BATCH_WINDOW_MS = 3  # 收集同一批请求的等待窗口 (毫秒)
+MAX_BATCH_SIZE = 64  # 单次前向计算的最大样本数
+MAX_QUEUE_SIZE = 256  # 等待队列上限，超出后直接拒绝
+REQUEST_TIMEOUT = 5.0  # 单个请求的最长等待时间 (秒)
+
+BATCH_SIZE = metrics.histogram('stock_inference_batch_size', "每次前向计算合并的请求数", buckets=metrics.SIZE_BUCKETS)
+FORWARD_SECONDS = metrics.histogram('stock_inference_forward_seconds', "每批多步预测的前向计算耗时")
+QUEUE_WAIT_SECONDS = metrics.histogram('stock_inference_queue_wait_seconds', "请求在推理队列中的等待时间")
+
+
+def rollout_forecast(predict_fn, sequences, horizon=FORECAST_DAYS):
+    """
+    对整批序列做递归多步预测：每一步把预测值追加到窗口末尾、丢弃最早一天。
+    sequences 形状为 (B, look_back, 1)，返回 (B, horizon) 的归一化预测值。
+    """
+    current = np.asarray(sequences, dtype=np.float32)
+    outputs = np.empty((current.shape[0], horizon), dtype=np.float32)
+    for step in range(horizon):
+        predicted = np.asarray(predict_fn(current), dtype=np.float32).reshape(-1, 1)
+        outputs[:, step] = predicted[:, 0]
+        current = np.concatenate([current[:, 1:, :], predicted[:, :, None]], axis=1)
+    return outputs
+
+
+class InferenceQueueFull(RuntimeError):
+    """等待队列已满，请求被拒绝"""
+
+
+class BatchInferenceEngine:
+    """
+    微批量推理引擎：把各个 Flask 线程提交的预测请求在一个很短的时间窗口内合并成一批，
+    每个预测步只做一次前向计算，再把各自的 5 日预测路径返还给调用方。
+    predict_fn 接收 (B, LOOK_BACK_DAYS, 1) 的数组，返回 (B, 1) 的归一化预测值。
+    """
+
+    def __init__(self, predict_fn, look_back=LOOK_BACK_DAYS, horizon=FORECAST_DAYS,
+                 batch_window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE,
+                 max_queue_size=MAX_QUEUE_SIZE, request_timeout=REQUEST_TIMEOUT):
+        self.predict_fn = predict_fn
+        self.look_back = look_back
+        self.horizon = horizon
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.request_timeout = request_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0, "rejected": 0, "timeouts": 0, "late": 0, "errors": 0,
+            "batches": 0, "batched_items": 0, "max_batch_size": 0,
+            "queue_wait_ms_total": 0.0, "queue_wait_ms_max": 0.0,
+            "forward_ms_total": 0.0, "forward_ms_max": 0.0,
+        }
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="batch-inference", daemon=True)
+        self._worker.start()
+
+    # --- 调用方接口 ---
+    def submit(self, sequence, timeout=None):
+        """提交一条长度为 look_back 的归一化序列，阻塞直到拿到 horizon 步的归一化预测值"""
+        seq = np.asarray(sequence, dtype=np.float32).reshape(self.look_back, 1)
+        future = Future()
+        try:
+            self._queue.put_nowait((seq, future, time.perf_counter()))
+        except queue.Full:
+            self._incr("rejected")
+            raise InferenceQueueFull("推理队列已满，请稍后重试")
+        self._incr("requests")
+        try:
+            return future.result(timeout=timeout if timeout is not None else self.request_timeout)
+        except FutureTimeoutError:
+            # 取消成功的请求在出队时会被跳过，不再占用前向计算；
+            # 取消失败说明已被工作线程取走，前向计算照常进行，只是结果来得太晚，单独计数
+            self._incr("timeouts" if future.cancel() else "late")
+            raise
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        batches = s["batches"] or 1
+        items = s["batched_items"] or 1
+        s["avg_batch_size"] = round(s["batched_items"] / batches, 2)
+        s["avg_queue_wait_ms"] = round(s["queue_wait_ms_total"] / items, 3)
+        s["avg_forward_ms"] = round(s["forward_ms_total"] / batches, 3)
+        s["queue_depth"] = self._queue.qsize()
+        return s
+
+    def stop(self):
+        self._stopped.set()
+        self._worker.join(timeout=1.0)
+
+    # --- 内部实现 ---
+    def _incr(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def _collect_batch(self):
+        """阻塞等待第一条请求，然后在时间窗口内尽量凑满一批"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # 丢弃已超时取消的请求
+        return [item for item in batch if item[1].set_running_or_notify_cancel()]
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            start = time.perf_counter()
+            waits = [(start - enqueued) * 1000 for _, _, enqueued in batch]
+            try:
+                outputs = rollout_forecast(self.predict_fn, np.stack([seq for seq, _, _ in batch]), self.horizon)
+            except Exception as e:
+                self._incr("errors", len(batch))
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            forward_ms = (time.perf_counter() - start) * 1000
+            for (_, future, _), row in zip(batch, outputs):
+                future.set_result(row)
+            BATCH_SIZE.observe(len(batch))
+            FORWARD_SECONDS.observe(forward_ms / 1000)
+            for wait in waits:
+                QUEUE_WAIT_SECONDS.observe(wait / 1000)
+            with self._stats_lock:
+                s = self._stats
+                s["batches"] += 1
+                s["batched_items"] += len(batch)
+                s["max_batch_size"] = max(s["max_batch_size"], len(batch))
+                s["queue_wait_ms_total"] += sum(waits)
+                s["queue_wait_ms_max"] = max(s["queue_wait_ms_max"], max(waits))
+                s["forward_ms_total"] += forward_ms
+                s["forward_ms_max"] = max(s["forward_ms_max"], forward_ms)
@@ -0,0 +1,262 @@
+import threading
+from datetime import timedelta
+import pandas as pd
+from sqlalchemy import bindparam, text
+import db_compat
+
+# --- 配置 ---
+BARS_TABLE = 't_stock_bars'
+PERIODS = ['day', 'week', 'month']
+SMA_LENGTHS = [5, 10, 20]
+# 增量计算均线时，向前读取已存 K 线的日历天数 (需覆盖 max(SMA_LENGTHS) - 1 根)
+SMA_LOOKBACK_DAYS = {'day': 45, 'week': 7 * 21, 'month': 31 * 21}
+
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {BARS_TABLE} (
+    `股票代码` VARCHAR(10) NOT NULL,
+    `周期` VARCHAR(8) NOT NULL,
+    `日期` DATE NOT NULL,
+    `开盘价` DOUBLE,
+    `收盘价` DOUBLE,
+    `最高价` DOUBLE,
+    `最低价` DOUBLE,
+    `成交量` DOUBLE,
+    `SMA_5` DOUBLE,
+    `SMA_10` DOUBLE,
+    `SMA_20` DOUBLE,
+    PRIMARY KEY (`股票代码`, `周期`, `日期`)
+)
+"""
+
+DAILY_SQL = """
+SELECT `股票代码` as code, `日期` as date, `开盘价` as open, `收盘价` as close,
+       `最高价` as high, `最低价` as low, `成交量` as volume
+FROM t_stocks
+WHERE `股票代码` IN :codes {date_clause}
+ORDER BY `股票代码`, `日期`
+"""
+
+# 接口返回的列 (与原 K 线接口保持一致，收盘价命名为 price)
+BAR_SELECT = """`日期` as date, `开盘价` as open, `收盘价` as price, `最低价` as low, `最高价` as high,
+               `成交量` as volume, `SMA_5`, `SMA_10`, `SMA_20`"""
+
+# 单支股票某一周期的最后 limit 根 K 线 (倒序)
+READ_BARS_SQL = f"""
+SELECT {BAR_SELECT}
+FROM {BARS_TABLE}
+WHERE `股票代码` = :code AND `周期` = :period
+ORDER BY `日期` DESC
+LIMIT :limit
+"""
+
+# K 线接口附带的股票名称 (单支 / 批量)
+STOCK_INFO_SQL = "SELECT `股票代码` as code, `股票名称` as name FROM t_stock_basic WHERE `股票代码` = :code"
+STOCK_INFO_MANY_SQL = "SELECT `股票代码` as code, `股票名称` as name FROM t_stock_basic WHERE `股票代码` IN :codes"
+
+BAR_COLUMNS = ['open', 'close', 'high', 'low', 'volume']
+SMA_COLUMNS = [f"SMA_{n}" for n in SMA_LENGTHS]
+UPSERT_COLUMNS = ['开盘价', '收盘价', '最高价', '最低价', '成交量'] + SMA_COLUMNS
+
+_table_ready = False
+_table_lock = threading.Lock()
+_known_codes = set()  # 已确认存在聚合数据的股票，避免每次请求都检查
+
+
+# --- 计算 ---
+def period_labels(dates: pd.Series, period: str) -> pd.Series:
+    """K 线的标签日期，与 resample('W') / resample('M') 一致：周日 / 月末"""
+    if period == 'day':
+        return dates
+    freq = 'W-SUN' if period == 'week' else 'M'
+    return dates.dt.to_period(freq).dt.end_time.dt.normalize()
+
+
+def build_bars(daily: pd.DataFrame, period: str) -> pd.DataFrame:
+    """把按 (code, date) 排序的日线聚合为指定周期的 OHLCV"""
+    if period == 'day':
+        return daily[['code', 'date'] + BAR_COLUMNS].reset_index(drop=True)
+    labelled = daily.assign(date=period_labels(daily['date'], period))
+    return labelled.groupby(['code', 'date'], sort=True).agg(
+        open=('open', 'first'), close=('close', 'last'), high=('high', 'max'),
+        low=('low', 'min'), volume=('volume', 'sum')
+    ).reset_index()
+
+
+def add_sma(bars: pd.DataFrame) -> pd.DataFrame:
+    """按股票分组计算收盘价均线 (与 pandas_ta.sma 一致，窗口不满时为空)"""
+    grouped = bars.groupby('code', sort=False)['close']
+    for n, column in zip(SMA_LENGTHS, SMA_COLUMNS):
+        bars[column] = grouped.transform(lambda s, n=n: s.rolling(n, min_periods=n).mean())
+    return bars
+
+
+# --- 存储 ---
+def _codes_stmt(sql):
+    """IN :codes 按列表展开 (MySQL 驱动可以直接传列表，SQLite 等需要由 SQLAlchemy 展开)"""
+    return text(sql).bindparams(bindparam('codes', expanding=True))
+
+
+def ensure_table(engine):
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if not _table_ready:
+            with engine.begin() as conn:
+                conn.execute(text(CREATE_TABLE_SQL))
+            _table_ready = True
+
+
+def _load_daily(conn, codes, since=None):
+    date_clause, params = "", {"codes": list(codes)}
+    if since is not None:
+        date_clause = "AND `日期` >= :since"
+        params['since'] = since
+    df = pd.read_sql(_codes_stmt(DAILY_SQL.format(date_clause=date_clause)), con=conn, params=params)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def _save_bars(conn, bars: pd.DataFrame, period: str):
+    if bars.empty:
+        return
+    columns = ['code', 'date'] + BAR_COLUMNS + SMA_COLUMNS
+    frame = bars[columns].astype(object).where(bars[columns].notna(), None)
+    frame['date'] = bars['date'].dt.date
+    rows = [dict(zip(columns, record), period=period) for record in frame.itertuples(index=False, name=None)]
+    stmt = text(f"""
+        INSERT INTO {BARS_TABLE} (`股票代码`, `周期`, `日期`, `开盘价`, `收盘价`, `最高价`, `最低价`, `成交量`,
+                                  `SMA_5`, `SMA_10`, `SMA_20`)
+        VALUES (:code, :period, :date, :open, :close, :high, :low, :volume, :SMA_5, :SMA_10, :SMA_20)
+        {db_compat.upsert_clause(conn, ['股票代码', '周期', '日期'], UPSERT_COLUMNS)}
+    """)
+    for start in range(0, len(rows), 1000):
+        conn.execute(stmt, rows[start:start + 1000])
+
+
+def rebuild_codes(conn, codes):
+    """用全部日线历史重建若干股票的各周期 K 线与均线"""
+    daily = _load_daily(conn, codes)
+    if daily.empty:
+        return
+    for period in PERIODS:
+        _save_bars(conn, add_sma(build_bars(daily, period)), period)
+
+
+def refresh_codes(conn, first_changed_dates: dict):
+    """
+    增量维护：first_changed_dates 为 {股票代码: 本次写入的最早日期}。
+    只重算受影响的 (可能尚未收盘的) 最后一根周/月线及其之后的 K 线，
+    均线所需的更早数据直接取自已存的 K 线，而不是重读全部日线。
+    """
+    codes = list(first_changed_dates)
+    stored = {row[0] for row in conn.execute(
+        _codes_stmt(f"SELECT DISTINCT `股票代码` FROM {BARS_TABLE} WHERE `股票代码` IN :codes AND `周期` = 'day'"),
+        {"codes": codes})}
+    new_codes = [code for code in codes if code not in stored]
+    if new_codes:
+        rebuild_codes(conn, new_codes)
+    codes = [code for code in codes if code in stored]
+    if not codes:
+        return
+    changed_from = pd.Series({code: pd.Timestamp(first_changed_dates[code]) for code in codes})
+    # 受影响的最早周期起点：所在周的周一与所在月的 1 日中更早者
+    period_starts = pd.concat([
+        changed_from - pd.to_timedelta(changed_from.dt.weekday, unit='D'),
+        changed_from.dt.to_period('M').dt.start_time,
+    ], axis=1).min(axis=1)
+    daily = _load_daily(conn, codes, since=period_starts.min().date())
+    daily = daily[daily['date'] >= daily['code'].map(period_starts)]
+    for period in PERIODS:
+        bars = build_bars(daily, period)
+        first_label = period_labels(changed_from, period)
+        bars = bars[bars['date'] >= bars['code'].map(first_label)]
+        if bars.empty:
+            continue
+        since = (first_label.min() - timedelta(days=SMA_LOOKBACK_DAYS[period])).date()
+        history = pd.read_sql(_codes_stmt(f"""
+            SELECT `股票代码` as code, `日期` as date, `收盘价` as close FROM {BARS_TABLE}
+            WHERE `股票代码` IN :codes AND `周期` = :period AND `日期` >= :since
+        """), con=conn, params={"codes": codes, "period": period, "since": since})
+        history['date'] = pd.to_datetime(history['date'])
+        history = history[history['date'] < history['code'].map(first_label)]
+        history = history.sort_values(['code', 'date']).groupby('code').tail(max(SMA_LENGTHS) - 1)
+        combined = pd.concat([history.assign(_new=False), bars.assign(_new=True)], ignore_index=True)
+        combined = add_sma(combined.sort_values(['code', 'date'], kind='stable'))
+        _save_bars(conn, combined[combined['_new']], period)
+
+
+def refresh_from_written_rows(conn, written: pd.DataFrame):
+    """由数据写入任务在同一事务中调用，written 为本次实际写入 t_stocks 的行"""
+    if written.empty:
+        return
+    first_dates = pd.to_datetime(written['日期']).groupby(written['股票代码']).min()
+    refresh_codes(conn, first_dates.to_dict())
+
+
+# --- 查询 ---
+def ensure_bars(engine, stock_code):
+    """股票尚无聚合数据时 (如首次部署) 从全部日线构建一次"""
+    if stock_code in _known_codes:
+        return
+    ensure_table(engine)
+    with engine.begin() as conn:
+        exists = conn.execute(text(f"SELECT 1 FROM {BARS_TABLE} WHERE `股票代码` = :code LIMIT 1"),
+                              {"code": stock_code}).first()
+        if not exists:
+            rebuild_codes(conn, [stock_code])
+    _known_codes.add(stock_code)
+
+
+def ensure_bars_many(engine, codes):
+    """批量版 ensure_bars：一次查询找出缺少聚合数据的股票，并一起构建"""
+    missing = [code for code in codes if code not in _known_codes]
+    if not missing:
+        return
+    ensure_table(engine)
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(
+            _codes_stmt(f"SELECT DISTINCT `股票代码` FROM {BARS_TABLE} WHERE `股票代码` IN :codes AND `周期` = 'day'"),
+            {"codes": missing})}
+        absent = [code for code in missing if code not in existing]
+        if absent:
+            rebuild_codes(conn, absent)
+    _known_codes.update(missing)
+
+
+def read_bars(engine, stock_code, period='day', limit=200):
+    """只读取需要返回的最后 limit 根 K 线"""
+    df = pd.read_sql(text(READ_BARS_SQL), con=engine, params={"code": stock_code, "period": period, "limit": limit})
+    return df.iloc[::-1].reset_index(drop=True)
+
+
+def iter_bars_many(engine, codes, period='day', limit=200, chunk_rows=10000):
+    """
+    一次 IN 查询读取多支股票各自最后 limit 根 K 线，按股票代码顺序流式读取，
+    每读完一支股票就产出 (code, DataFrame)，调用方可以边读边返回。
+    """
+    sql = f"""
+        SELECT code, date, open, price, low, high, volume, SMA_5, SMA_10, SMA_20 FROM (
+            SELECT `股票代码` as code, {BAR_SELECT},
+                   ROW_NUMBER() OVER (PARTITION BY `股票代码` ORDER BY `日期` DESC) as rn
+            FROM {BARS_TABLE}
+            WHERE `股票代码` IN :codes AND `周期` = :period
+        ) ranked
+        WHERE rn <= :limit
+        ORDER BY code, date
+    """
+    params = {"codes": list(codes), "period": period, "limit": limit}
+    with engine.connect() as conn:
+        streaming_conn = conn.execution_options(stream_results=True)
+        pending = None
+        for chunk in pd.read_sql(_codes_stmt(sql), con=streaming_conn, params=params, chunksize=chunk_rows):
+            if pending is not None:
+                chunk = pd.concat([pending, chunk], ignore_index=True)
+            # 最后一支股票可能还有数据在下一块中，留到下一轮
+            last_code = chunk['code'].iloc[-1]
+            is_last = (chunk['code'] == last_code).to_numpy()
+            pending = chunk[is_last]
+            for code, group in chunk[~is_last].groupby('code', sort=False):
+                yield code, group.drop(columns='code').reset_index(drop=True)
+        if pending is not None and not pending.empty:
+            yield pending['code'].iloc[0], pending.drop(columns='code').reset_index(drop=True)
@@ -0,0 +1,91 @@
+import json
+import time
+import random
+import threading
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# --- 配置 ---
+KLINE_PATH = '/api/qt/stock/kline/get'
+DEFAULT_LIMIT = 120
+
+
+def generate_klines(code: str, limit: int, end: date = None):
+    """按股票代码生成确定性的随机游走日K线，格式与东方财富接口的 klines 字段一致"""
+    rng = random.Random(zlib.crc32(code.encode()))
+    end = end or date.today()
+    day = end - timedelta(days=int(limit * 1.5))
+    close = rng.uniform(5, 100)
+    klines = []
+    while len(klines) < limit and day <= end:
+        day += timedelta(days=1)
+        if day.weekday() >= 5:
+            continue
+        prev_close = close
+        open_price = prev_close * (1 + rng.gauss(0, 0.005))
+        close = max(0.5, prev_close * (1 + rng.gauss(0, 0.02)))
+        high = max(open_price, close) * (1 + abs(rng.gauss(0, 0.005)))
+        low = min(open_price, close) * (1 - abs(rng.gauss(0, 0.005)))
+        volume = rng.randint(10000, 2000000)
+        amount = volume * close * 100
+        change = close - prev_close
+        klines.append(",".join([
+            day.isoformat(), f"{open_price:.2f}", f"{close:.2f}", f"{high:.2f}", f"{low:.2f}",
+            str(volume), f"{amount:.2f}", f"{(high - low) / prev_close * 100:.2f}",
+            f"{change / prev_close * 100:.2f}", f"{change:.2f}", f"{rng.uniform(0.1, 5):.2f}",
+        ]))
+    return klines
+
+
+class KlineStubHandler(BaseHTTPRequestHandler):
+    latency_ms = 0
+    failure_rate = 0.0
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path != KLINE_PATH:
+            self.send_error(404)
+            return
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.send_error(503)
+            return
+        query = parse_qs(parsed.query)
+        secid = query.get('secid', ['0.000000'])[0]
+        code = secid.split('.', 1)[-1]
+        limit = int(query.get('lmt', [DEFAULT_LIMIT])[0])
+        body = json.dumps({
+            "rc": 0, "data": {"code": code, "market": int(secid.split('.')[0]), "name": code,
+                              "klines": generate_klines(code, limit)}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host='127.0.0.1', port=0, latency_ms=0, failure_rate=0.0):
+    """在后台线程启动桩服务，返回 (server, base_url)；用完调用 server.shutdown()"""
+    handler = type('ConfiguredKlineStubHandler', (KlineStubHandler,),
+                   {"latency_ms": latency_ms, "failure_rate": failure_rate})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='kline-stub', daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    stub, url = start_stub_server(port=8765)
+    print(f"K线桩服务已启动: {url}{KLINE_PATH}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.shutdown()
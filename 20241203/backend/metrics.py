@@ -0,0 +1,366 @@
+import os
+import json
+import shutil
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# --- 配置 ---
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+SLOW_QUERY_SECONDS = float(os.environ.get('STOCK_SLOW_QUERY_SECONDS', '0.5'))  # 超过该耗时的 SQL 打印慢查询日志
+SLOW_QUERY_LOG_CHARS = 500  # 慢查询日志中 SQL 的最大长度
+SNAPSHOT_DIR = 'cache/metrics'  # 多进程部署时各进程的指标快照目录
+SNAPSHOT_INTERVAL = 5.0  # 写快照的间隔 (秒)
+GAUGE_AGGREGATES = {'sum': lambda a, b: a + b, 'max': max, 'min': min}  # 仪表在进程间的汇总方式
+
+
+class _Metric:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def collect(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+
+class Gauge(_Metric):
+    """
+    瞬时值；可以直接 set，也可以由 callback 在采集时计算 (返回 {标签元组: 值})。
+    aggregate 为多进程汇总方式：'sum' 适合各进程占用之和 (如连接池)，
+    'max' / 'min' 适合时点值 (如最近一次任务的吞吐、是否全部就绪)。
+    """
+    type = 'gauge'
+
+    def __init__(self, name, help_text, label_names=(), callback=None, aggregate='sum'):
+        super().__init__(name, help_text, label_names)
+        if aggregate not in GAUGE_AGGREGATES:
+            raise ValueError(f"未知的汇总方式: {aggregate}")
+        self.aggregate = aggregate
+        self._values = {}
+        self._callbacks = [callback] if callback is not None else []
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        for callback in self._callbacks:
+            try:
+                values.update(callback())
+            except Exception as e:
+                print(f"指标 {self.name} 采集失败: {e}")
+        return values
+
+
+class Histogram(_Metric):
+    """累计分桶直方图；每个标签组合保存各桶计数、总和与样本数"""
+    type = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            return {key: [list(entry[0]), entry[1], entry[2]] for key, entry in self._values.items()}
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, help_text, label_names=()):
+    return _register(Counter(name, help_text, label_names))
+
+
+def gauge(name, help_text, label_names=(), callback=None, aggregate='sum'):
+    metric = _register(Gauge(name, help_text, label_names, aggregate=aggregate))
+    if callback is not None:
+        metric.add_callback(callback)
+    return metric
+
+
+def histogram(name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, help_text, label_names, buckets))
+
+
+# --- 公共指标 ---
+HTTP_REQUEST_SECONDS = histogram('stock_http_request_duration_seconds', "HTTP 请求耗时 (到响应头返回为止)",
+                                 ('endpoint', 'method', 'status'))
+STAGE_SECONDS = histogram('stock_stage_duration_seconds', "热点路径各阶段耗时", ('stage',))
+DB_QUERY_SECONDS = histogram('stock_db_query_duration_seconds', "SQL 执行耗时", ('engine', 'operation'))
+DB_SLOW_QUERIES = counter('stock_db_slow_queries_total', "超过慢查询阈值的 SQL 数", ('engine', 'operation'))
+ERRORS = counter('stock_errors_total', "被捕获并记录的错误数", ('component',))
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name):
+    """
+    记录一个阶段的耗时。请求内的阶段同时记入 Server-Timing 响应头，
+    单个慢请求也能看出时间花在了哪一步。
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def begin_request_timings():
+    _local.timings = []
+
+
+def end_request_timings():
+    timings, _local.timings = getattr(_local, 'timings', None), None
+    return timings or []
+
+
+def server_timing_header(timings):
+    """Server-Timing: stockkline.read_bars;dur=3.2, ... (同名阶段累加)"""
+    merged = {}
+    for name, elapsed in timings:
+        merged[name] = merged.get(name, 0.0) + elapsed
+    return ', '.join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in merged.items())
+
+
+def error(component):
+    ERRORS.inc(component=component)
+
+
+# --- SQLAlchemy 引擎 ---
+def _operation_of(statement):
+    head = statement.lstrip().split(None, 1)
+    return head[0].upper() if head else 'UNKNOWN'
+
+
+def instrument_engine(engine, name):
+    """为引擎挂上 SQL 计时与慢查询日志，并登记连接池使用情况"""
+    from sqlalchemy import event
+
+    # 开始时间记在本条语句的执行上下文上：语句出错时随上下文一起丢弃，不会残留在池化连接上
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.stock_query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, 'stock_query_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        operation = _operation_of(statement)
+        DB_QUERY_SECONDS.observe(elapsed, engine=name, operation=operation)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            DB_SLOW_QUERIES.inc(engine=name, operation=operation)
+            sql = ' '.join(statement.split())[:SLOW_QUERY_LOG_CHARS]
+            print(f"慢查询 [{name}] {elapsed:.3f} 秒{' (批量)' if executemany else ''}: {sql}")
+
+    pool = engine.pool
+
+    def pool_usage():
+        usage = {(name, 'checked_out'): pool.checkedout()} if hasattr(pool, 'checkedout') else {}
+        if hasattr(pool, 'checkedin'):
+            usage[(name, 'idle')] = pool.checkedin()
+        if hasattr(pool, 'overflow'):
+            usage[(name, 'overflow')] = max(0, pool.overflow())
+        return usage
+
+    gauge('stock_db_pool_connections', "连接池中的连接数", ('engine', 'state'), callback=pool_usage)
+    if hasattr(pool, 'size'):
+        gauge('stock_db_pool_size', "连接池容量 (不含溢出)", ('engine',), callback=lambda: {(name,): pool.size()})
+    return engine
+
+
+# --- 多进程汇总 ---
+def snapshot():
+    """本进程全部指标的当前值 (可 JSON 序列化)"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: [[list(key), value] for key, value in metric.collect().items()] for metric in metrics}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_snapshot(directory=SNAPSHOT_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def _read_peer_snapshots(directory):
+    """其他存活进程的快照；已退出进程的快照文件被清理"""
+    peers = []
+    if not os.path.isdir(directory):
+        return peers
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json') or not filename[:-5].isdigit():
+            continue
+        pid = int(filename[:-5])
+        path = os.path.join(directory, filename)
+        if pid == os.getpid():
+            continue
+        if not _pid_alive(pid):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                peers.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return peers
+
+
+def clear_snapshots(directory=SNAPSHOT_DIR):
+    """服务启动时清掉上一次运行留下的快照"""
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def start_snapshot_writer(directory=SNAPSHOT_DIR, interval=SNAPSHOT_INTERVAL):
+    """预 fork 模式下每个工作进程定期写出快照，任一进程响应 /metrics 时都能汇总全部进程"""
+    def run():
+        while True:
+            try:
+                write_snapshot(directory)
+            except Exception as e:
+                print(f"写入指标快照失败: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+
+
+def _merge(target, source):
+    """计数器与直方图在进程间求和，仪表按各自的 aggregate 汇总 (连接池占用求和，时点值取最大/最小)"""
+    with _registry_lock:
+        combine = {name: GAUGE_AGGREGATES[metric.aggregate] for name, metric in _registry.items()
+                   if metric.type == 'gauge'}
+    for name, series in source.items():
+        merged = target.setdefault(name, {})
+        for key, value in series:
+            key = tuple(key)
+            current = merged.get(key)
+            if current is None:
+                merged[key] = value
+            elif isinstance(value, list):
+                merged[key] = [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1],
+                               current[2] + value[2]]
+            else:
+                merged[key] = combine.get(name, GAUGE_AGGREGATES['sum'])(current, value)
+
+
+# --- Prometheus 文本格式 ---
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(include_peers=False, directory=SNAPSHOT_DIR):
+    merged = {}
+    _merge(merged, snapshot())
+    if include_peers:
+        for peer in _read_peer_snapshots(directory):
+            _merge(merged, peer)
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for key, value in sorted(merged.get(metric.name, {}).items()):
+            if metric.type == 'histogram':
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[0]):
+                    cumulative += count
+                    le = _format_number(bound if bound == float('inf') else float(bound))
+                    lines.append(f"{metric.name}_bucket{_labels(metric.label_names, key, [('le', le)])} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(metric.label_names, key)} {_format_number(float(value[1]))}")
+                lines.append(f"{metric.name}_count{_labels(metric.label_names, key)} {value[2]}")
+            else:
+                lines.append(f"{metric.name}{_labels(metric.label_names, key)} {_format_number(value)}")
+    return '\n'.join(lines) + '\n'
@@ -1,11 +1,19 @@
+import json
+import time
+import shutil
+import argparse
+from datetime import datetime
 import numpy as np
-import pandas as pd
-from sqlalchemy import create_engine
-from sklearn.preprocessing import MinMaxScaler
-from tensorflow.keras.models import Sequential
+from numpy.lib.stride_tricks import sliding_window_view
+import tensorflow as tf
+from tensorflow.keras.models import Sequential, load_model
+from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.layers import LSTM, Dense, Dropout
 import os
 import pymysql
+from history_cache import HistoryCache
+import db_compat
+from norm_stats import NormalizationStats, scale, stats_path_for
 
 # --- 配置区 ---
 # 数据库连接
@@ -19,7 +27,19 @@ DB_CHARSET = 'utf8'
 LOOK_BACK_DAYS = 60  # 使用过去60天的数据来预测未来1天
 EPOCHS = 20  # 训练的回合数 (由于数据量增大，可以适当减少)
 BATCH_SIZE = 64  # 每批次处理的数据量 (可以适当增大)
+LSTM_UNITS = 50  # 每层 LSTM 的单元数
+LSTM_LAYERS = 2  # LSTM 层数
+DROPOUT = 0.2
+LEARNING_RATE = 1e-3  # Adam 的默认学习率 (hyperparam_search.py 可搜索以上参数)
 MODEL_SAVE_PATH = 'models/stock_model_all.h5'  # 新的通用模型保存路径
+MODEL_VERSIONS_DIR = 'models/versions'  # 每次训练/微调发布的模型都保留一份带时间戳的副本
+TRAIN_META_PATH = 'models/stock_model_all.train.json'  # 训练水位线 (已训练到的最新日期) 与训练统计
+KEEP_VERSIONS = 10  # 保留的历史版本数
+NORMALIZATION = 'per_stock'  # 'per_stock': 每支股票按自身全历史区间归一化 (与在线推理一致)；'global': 全市场统一区间
+
+# 增量微调参数
+FINE_TUNE_MAX_STEPS = 200  # 单次微调最多训练的批次数
+FINE_TUNE_LEARNING_RATE = 1e-4  # 比从头训练小，避免遗忘已有的模式
 
 # 确保模型保存目录存在
 os.makedirs(os.path.dirname(MODEL_SAVE_PATH), exist_ok=True)
@@ -27,16 +47,137 @@ os.makedirs(os.path.dirname(MODEL_SAVE_PATH), exist_ok=True)
 
 # --- 训练逻辑 ---
 
-def create_dataset(dataset, look_back=1):
+def build_window_index(series_list, look_back):
+    """
+    把各股票的价格序列首尾相接成一条连续数组，并返回所有合法窗口的起点。
+    每个窗口 [start, start + look_back) 及其目标值 start + look_back 都落在同一支股票内，
+    因此不会出现跨越两支股票的训练样本。
+    """
+    lengths = np.array([len(s) for s in series_list], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    flat = np.concatenate(series_list).astype(np.float32)
+    # 每支股票可生成 len - look_back 个样本
+    sample_counts = np.maximum(lengths - look_back, 0)
+    starts = np.repeat(offsets[:-1], sample_counts) + (
+        np.arange(sample_counts.sum()) - np.repeat(np.cumsum(sample_counts) - sample_counts, sample_counts)
+    )
+    return flat, starts
+
+
+def create_dataset(flat, starts, look_back, batch_size, shuffle=True):
+    """
+    基于 sliding_window_view 的零拷贝窗口视图构建流式 tf.data 数据集。
+    只在生成每个批次时按起点索引拷贝 batch_size 个窗口，完整的 X_train 永远不会被物化。
+    """
+    windows = sliding_window_view(flat, look_back)  # 视图，形状 (len(flat) - look_back + 1, look_back)
+
+    def generator():
+        order = np.random.permutation(starts) if shuffle else starts
+        for i in range(0, len(order), batch_size):
+            batch_starts = order[i:i + batch_size]
+            yield windows[batch_starts][..., None], flat[batch_starts + look_back]
+
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec(shape=(None, look_back, 1), dtype=tf.float32),
+            tf.TensorSpec(shape=(None,), dtype=tf.float32),
+        )
+    )
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def connect_db():
+    pymysql.install_as_MySQLdb()
+    # 环境变量 STOCK_DB_URI 可指向其他数据库 (如基准测试使用的 SQLite 文件)
+    uri = os.environ.get('STOCK_DB_URI',
+                         f'mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}?charset={DB_CHARSET}')
+    return db_compat.create_db_engine(uri)
+
+
+def load_history(engine):
+    """一次有序的流式查询加载全部历史 (本地列式缓存，之后只拉取增量)"""
+    history = HistoryCache(engine).refresh()
+    if not len(history):
+        raise ValueError("在数据库中未找到任何股票代码。")
+    print(f"发现 {len(history)} 支不同的股票。")
+    return history
+
+
+def read_train_meta():
+    if not os.path.exists(TRAIN_META_PATH):
+        return None
+    with open(TRAIN_META_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def publish_model(model, norm, meta):
     """
-    将时间序列数据转换为监督学习问题的数据集
+    发布新模型：先在版本目录写入带时间戳的模型与归一化参数，再复制到服务端读取的路径并原子替换。
+    服务端在模型文件变化时才重新加载，因此归一化参数先于模型替换；训练元数据 (水位线) 最后写入。
     """
-    dataX, dataY = [], []
-    for i in range(len(dataset) - look_back - 1):
-        a = dataset[i:(i + look_back), 0]
-        dataX.append(a)
-        dataY.append(dataset[i + look_back, 0])
-    return np.array(dataX), np.array(dataY)
+    os.makedirs(MODEL_VERSIONS_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(MODEL_SAVE_PATH))[0]
+    versioned_path = os.path.join(MODEL_VERSIONS_DIR, f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.h5")
+    model.save(versioned_path)
+    norm.save(stats_path_for(versioned_path))
+
+    norm.save(stats_path_for(MODEL_SAVE_PATH))
+    tmp_path = MODEL_SAVE_PATH.replace('.h5', '.tmp.h5')
+    shutil.copyfile(versioned_path, tmp_path)
+    os.replace(tmp_path, MODEL_SAVE_PATH)
+
+    meta = dict(meta, versioned_path=versioned_path, published_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    tmp_meta = TRAIN_META_PATH + '.tmp'
+    with open(tmp_meta, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_meta, TRAIN_META_PATH)
+
+    # 清理过旧的版本
+    versions = sorted(name for name in os.listdir(MODEL_VERSIONS_DIR) if name.startswith(stem) and name.endswith('.h5'))
+    for name in versions[:-KEEP_VERSIONS]:
+        for path in (os.path.join(MODEL_VERSIONS_DIR, name), stats_path_for(os.path.join(MODEL_VERSIONS_DIR, name))):
+            if os.path.exists(path):
+                os.remove(path)
+    print(f"模型已发布: {MODEL_SAVE_PATH} (版本文件 {versioned_path}, 归一化方式 {norm.mode}, {len(norm)} 支股票)")
+    return versioned_path
+
+
+def timed_fit(model, dataset, samples, epochs=1):
+    """训练并返回耗时与吞吐统计"""
+    start = time.perf_counter()
+    model.fit(dataset, epochs=epochs, verbose=1)
+    elapsed = time.perf_counter() - start
+    stats = {"train_seconds": round(elapsed, 2), "samples": int(samples) * epochs,
+             "samples_per_sec": round(samples * epochs / elapsed, 1) if elapsed > 0 else 0.0}
+    print(f"训练耗时 {stats['train_seconds']} 秒，样本数 {stats['samples']}，吞吐 {stats['samples_per_sec']} 样本/秒。")
+    return stats
+
+
+def prepare_training_windows(history, norm):
+    """按股票归一化收盘价序列，返回首尾相接的数组与所有不跨越股票边界的窗口起点"""
+    all_stocks_data = []
+    for code, prices in history.iter_series('close'):
+        if len(prices) > LOOK_BACK_DAYS:
+            lo, hi, _ = norm.bounds(code)
+            all_stocks_data.append(scale(prices, lo, hi).astype(np.float32))
+    if not all_stocks_data:
+        raise ValueError("没有找到足够长的股票数据来训练模型。")
+    print(f"数据加载完成，共找到 {len(all_stocks_data)} 支符合训练条件的股票。")
+    return build_window_index(all_stocks_data, LOOK_BACK_DAYS)
+
+
+def build_model(look_back=LOOK_BACK_DAYS, units=LSTM_UNITS, layers=LSTM_LAYERS, dropout=DROPOUT,
+                learning_rate=LEARNING_RATE):
+    """堆叠 layers 层 LSTM (除最后一层外都返回序列)，每层后接 Dropout，最后一个单输出的全连接层"""
+    model = Sequential()
+    for i in range(layers):
+        kwargs = {'input_shape': (look_back, 1)} if i == 0 else {}
+        model.add(LSTM(units=units, return_sequences=i < layers - 1, **kwargs))
+        model.add(Dropout(dropout))
+    model.add(Dense(units=1))
+    model.compile(optimizer=Adam(learning_rate=learning_rate), loss='mean_squared_error')
+    return model
 
 
 def train_all_stocks_model():
@@ -47,82 +188,109 @@ def train_all_stocks_model():
 
     # 1. 连接数据库
     try:
-        pymysql.install_as_MySQLdb()
-        engine = create_engine(
-            f'mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}?charset={DB_CHARSET}'
-        )
+        engine = connect_db()
         print("数据库连接成功。")
     except Exception as e:
         print(f"数据库连接失败: {e}")
         return
 
-    # 2. 获取所有股票代码
+    # 2. 一次有序的流式查询加载全部历史 (本地列式缓存，之后只拉取增量)
     try:
-        stock_codes_df = pd.read_sql("SELECT DISTINCT `股票代码` as code FROM t_stocks", con=engine)
-        stock_codes = stock_codes_df['code'].tolist()
-        if not stock_codes:
-            print("错误：在数据库中未找到任何股票代码。")
-            return
-        print(f"发现 {len(stock_codes)} 支不同的股票。")
+        history = load_history(engine)
     except Exception as e:
-        print(f"获取股票代码列表失败: {e}")
+        print(f"加载股票历史数据失败: {e}")
         return
 
-    # 3. 循环加载所有股票数据并合并
-    all_stocks_data = []
-    print("开始加载所有股票的历史数据...")
-    for code in stock_codes:
-        sql = "SELECT `收盘价` as price FROM t_stocks WHERE `股票代码` = %s ORDER BY `日期` ASC"
-        df = pd.read_sql(sql, con=engine, params=(code,))
-
-        # 只有数据量足够长的股票才被用于训练
-        if len(df) > LOOK_BACK_DAYS:
-            # 我们只关心价格序列，将其添加到总列表中
-            all_stocks_data.append(df['price'].values)
-
-    if not all_stocks_data:
-        print("没有找到足够长的股票数据来训练模型。")
-        return
-
-    print(f"数据加载完成，共找到 {len(all_stocks_data)} 支符合训练条件的股票。")
+    # 3. 筛选数据量足够长的股票，统计并归一化
+    # 只有数据量足够长的股票才被用于训练，我们只关心收盘价序列；归一化参数随模型一起保存，供在线推理使用
+    norm = NormalizationStats.from_history(history, NORMALIZATION, min_length=LOOK_BACK_DAYS)
 
     # 4. 数据预处理
-    # 将所有价格数据连接成一个长序列，然后reshape
-    combined_data = np.concatenate(all_stocks_data).reshape(-1, 1)
-
-    # 对所有数据进行统一归一化
-    scaler = MinMaxScaler(feature_range=(0, 1))
-    scaled_data = scaler.fit_transform(combined_data)
-
-    # 使用处理后的全部数据创建训练集
-    X_train, y_train = create_dataset(scaled_data, LOOK_BACK_DAYS)
+    try:
+        flat_data, window_starts = prepare_training_windows(history, norm)
+    except ValueError as e:
+        print(e)
+        return
 
-    # Reshape输入数据以满足LSTM的要求 [样本数, 时间步, 特征数]
-    X_train = np.reshape(X_train, (X_train.shape[0], X_train.shape[1], 1))
-    print(f"数据预处理完成。总训练样本数: {X_train.shape[0]}")
+    # 训练样本以流式批次的方式送入 Keras，附带预取
+    train_dataset = create_dataset(flat_data, window_starts, LOOK_BACK_DAYS, BATCH_SIZE)
+    print(f"数据预处理完成。总训练样本数: {len(window_starts)}")
 
     # 5. 构建LSTM模型 (模型结构可以保持不变)
-    model = Sequential([
-        LSTM(units=50, return_sequences=True, input_shape=(LOOK_BACK_DAYS, 1)),
-        Dropout(0.2),
-        LSTM(units=50, return_sequences=False),
-        Dropout(0.2),
-        Dense(units=1)
-    ])
-
-    model.compile(optimizer='adam', loss='mean_squared_error')
+    model = build_model()
     print("通用LSTM模型构建完成。")
     model.summary()
 
     # 6. 训练模型
     print("开始模型训练（这可能需要一些时间）...")
-    model.fit(X_train, y_train, epochs=EPOCHS, batch_size=BATCH_SIZE, verbose=1)
+    stats = timed_fit(model, train_dataset, len(window_starts), epochs=EPOCHS)
     print("模型训练完成。")
 
-    # 7. 保存模型
-    model.save(MODEL_SAVE_PATH)
-    print(f"通用模型已成功保存到: {MODEL_SAVE_PATH}")
+    # 7. 发布模型，记录水位线供之后的增量微调使用
+    publish_model(model, norm, dict(stats, mode='full', watermark=str(history.latest_date)))
+    return stats
+
+
+def fine_tune_model(max_steps=FINE_TUNE_MAX_STEPS):
+    """
+    增量微调：从当前发布的模型出发，只用目标日期晚于水位线的新窗口训练有限的步数，
+    并发布为新版本。没有水位线 (尚未做过全量训练) 时需要先全量训练。
+    """
+    meta = read_train_meta()
+    if meta is None or not meta.get('watermark') or not os.path.exists(MODEL_SAVE_PATH):
+        print("没有可用的训练水位线或模型，请先运行全量训练。")
+        return None
+    watermark = np.datetime64(meta['watermark'], 'D')
+    print(f"开始增量微调，水位线 {meta['watermark']}...")
+    try:
+        history = load_history(connect_db())
+    except Exception as e:
+        print(f"加载股票历史数据失败: {e}")
+        return None
+
+    stats_path = stats_path_for(MODEL_SAVE_PATH)
+    norm = (NormalizationStats.load(stats_path) if os.path.exists(stats_path)
+            else NormalizationStats.from_history(history, NORMALIZATION, min_length=LOOK_BACK_DAYS))
+    tails = []
+    for code in history.codes:
+        columns = history.get(code)
+        dates, prices = columns['date'], columns['close']
+        # 目标日期晚于水位线的样本数 (窗口本身可以包含水位线之前的数据)
+        new_samples = min(int(np.count_nonzero(dates > watermark)), len(prices) - LOOK_BACK_DAYS)
+        if new_samples <= 0:
+            continue
+        new_prices = prices[-new_samples:]
+        if code in norm:
+            norm.update(code, float(new_prices.min()), float(new_prices.max()), dates[-1])
+        else:
+            norm.update(code, float(prices.min()), float(prices.max()), dates[-1])
+        lo, hi, _ = norm.bounds(code)
+        tails.append(scale(prices[-(new_samples + LOOK_BACK_DAYS):], lo, hi).astype(np.float32))
+    if not tails:
+        print("水位线之后没有新数据，无需微调。")
+        return None
+
+    flat_data, window_starts = build_window_index(tails, LOOK_BACK_DAYS)
+    del tails
+    steps = min(max_steps, -(-len(window_starts) // BATCH_SIZE))
+    train_dataset = create_dataset(flat_data, window_starts, LOOK_BACK_DAYS, BATCH_SIZE).take(steps)
+    samples = min(len(window_starts), steps * BATCH_SIZE)
+    print(f"新窗口 {len(window_starts)} 个，本次训练 {steps} 批 ({samples} 个样本)。")
+
+    model = load_model(MODEL_SAVE_PATH)
+    model.compile(optimizer=Adam(learning_rate=FINE_TUNE_LEARNING_RATE), loss='mean_squared_error')
+    stats = timed_fit(model, train_dataset, samples)
+    publish_model(model, norm, dict(stats, mode='incremental', watermark=str(history.latest_date),
+                                    base_watermark=meta['watermark'], new_windows=int(len(window_starts))))
+    return stats
 
 
 if __name__ == '__main__':
-    train_all_stocks_model()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="训练通用股票预测模型")
+    parser.add_argument('--incremental', action='store_true', help="从当前模型出发，只用水位线之后的新数据微调")
+    parser.add_argument('--max-steps', type=int, default=FINE_TUNE_MAX_STEPS, help="增量微调最多训练的批次数")
+    args = parser.parse_args()
+    if args.incremental:
+        fine_tune_model(args.max_steps)
+    else:
+        train_all_stocks_model()
\ No newline at end of file
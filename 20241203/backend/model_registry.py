@@ -0,0 +1,187 @@
+import os
+import time
+import threading
+import numpy as np
+import prediction_job
+from norm_stats import NormalizationStats, stats_path_for
+
+# --- 配置 ---
+MODEL_PATH = 'models/stock_model_all.h5'
+LOOK_BACK_DAYS = 60
+WATCH_INTERVAL = 5.0  # 检查模型文件是否更新的间隔 (秒)
+WARMUP_BATCH_SIZE = 8  # 预热时前向计算的批大小
+
+
+class LoadedModel:
+    """一次加载的结果：模型、版本号与训练时的归一化参数总是成对替换，请求不会拿到不匹配的组合"""
+
+    def __init__(self, model, version, norm, file_stat, loaded_at, load_seconds):
+        self.model = model
+        self.version = version
+        self.norm = norm
+        self.file_stat = file_stat
+        self.loaded_at = loaded_at
+        self.load_seconds = load_seconds
+
+
+def _file_stat(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_norm_stats(model_path):
+    """读取随模型保存的归一化参数；旧模型没有该文件时按股票在线登记"""
+    path = stats_path_for(model_path)
+    if not os.path.exists(path):
+        print(f"未找到归一化参数文件 {path}，按股票全历史区间在线统计。")
+        return NormalizationStats.empty()
+    return NormalizationStats.load(path)
+
+
+def load_model_file(path, backend='numpy'):
+    """按推理后端加载模型；TensorFlow 只在选择 keras 后端时才导入"""
+    if backend == 'keras':
+        from tensorflow.keras.models import load_model
+        return load_model(path)
+    from numpy_lstm import NumpyLSTMModel
+    return NumpyLSTMModel.from_h5(path)
+
+
+class ModelRegistry:
+    """
+    持有当前服务使用的模型：
+    - start() 在后台线程中加载模型并用一个假批次预热，服务进程无需等待即可开始接收请求；
+    - 之后定期检查模型文件，ml.py 写入新模型后在后台加载、预热，再整体替换引用，
+      正在进行的推理继续使用旧模型完成，不会丢弃请求；新模型加载失败时保留旧模型。
+    """
+
+    def __init__(self, model_path=MODEL_PATH, backend='numpy', look_back=LOOK_BACK_DAYS,
+                 watch_interval=WATCH_INTERVAL, on_reloaded=None):
+        self.model_path = model_path
+        self.backend = backend
+        self.look_back = look_back
+        self.watch_interval = watch_interval
+        self.on_reloaded = on_reloaded
+        self.current = None
+        self.last_error = None
+        self.reload_count = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- 对外接口 ---
+    def start(self, watch=True):
+        """启动后台预热 (及文件监视)，重复调用无副作用；fork 出的子进程需要重新调用以启动自己的监视线程"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(watch,), name='model-registry', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def wait_ready(self, timeout=None):
+        """阻塞直到模型可用或超时，返回是否就绪"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.current is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    @property
+    def version(self):
+        loaded = self.current
+        return loaded.version if loaded is not None else None
+
+    def predict_on_batch(self, batch):
+        """供推理引擎调用：每个批次读取一次当前模型引用"""
+        loaded = self.current
+        if loaded is None:
+            raise RuntimeError("模型尚未加载完成")
+        return loaded.model.predict_on_batch(batch)
+
+    def status(self):
+        loaded = self.current
+        status = {
+            "ready": loaded is not None,
+            "backend": self.backend,
+            "modelPath": self.model_path,
+            "reloadCount": self.reload_count,
+            "lastError": self.last_error,
+        }
+        if loaded is not None:
+            status.update({
+                "modelVersion": loaded.version,
+                "loadedAt": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(loaded.loaded_at)),
+                "loadSeconds": round(loaded.load_seconds, 3),
+                "normalization": loaded.norm.mode,
+                "normalizedStocks": len(loaded.norm),
+            })
+        return status
+
+    def reload(self):
+        """模型文件有变化时加载新模型并替换，返回是否发生了替换"""
+        with self._reload_lock:
+            if not os.path.exists(self.model_path):
+                self.last_error = f"模型文件 {self.model_path} 不存在"
+                return False
+            file_stat = _file_stat(self.model_path)
+            previous = self.current
+            if previous is not None and previous.file_stat == file_stat:
+                return False
+            start = time.perf_counter()
+            try:
+                version = prediction_job.model_version_of(self.model_path)
+                if previous is not None and previous.version == version:
+                    previous.file_stat = file_stat
+                    return False
+                model = load_model_file(self.model_path, self.backend)
+                norm = load_norm_stats(self.model_path)
+                self._warm_up(model)
+            except Exception as e:
+                self.last_error = f"模型加载失败: {e}"
+                print(self.last_error)
+                return False
+            self.current = LoadedModel(model, version, norm, file_stat, time.time(), time.perf_counter() - start)
+            self.last_error = None
+            if previous is not None:
+                self.reload_count += 1
+                print(f"模型已热更新: {previous.version} -> {version}")
+            else:
+                print(f"通用模型 {self.model_path} 加载成功 (推理后端: {self.backend}, 版本: {version})。")
+        if previous is not None and self.on_reloaded is not None:
+            try:
+                self.on_reloaded(version)
+            except Exception as e:
+                print(f"模型更新回调失败: {e}")
+        return True
+
+    # --- 内部实现 ---
+    def _warm_up(self, model):
+        """首次前向计算 (Keras 图构建 / NumPy 内存分配) 在替换前完成，不落在用户请求上"""
+        dummy = np.zeros((WARMUP_BATCH_SIZE, self.look_back, 1), dtype=np.float32)
+        output = np.asarray(model.predict_on_batch(dummy))
+        if output.shape[0] != WARMUP_BATCH_SIZE or not np.all(np.isfinite(output)):
+            raise ValueError(f"模型预热输出异常: shape={output.shape}")
+
+    def _run(self, watch):
+        if self.current is None:
+            self.reload()
+        while watch and not self._stop.wait(self.watch_interval):
+            try:
+                if os.path.exists(self.model_path) and (
+                        self.current is None or _file_stat(self.model_path) != self.current.file_stat):
+                    self.reload()
+            except OSError as e:
+                # 模型文件正在被替换
+                self.last_error = str(e)
@@ -0,0 +1,146 @@
+import os
+import threading
+import numpy as np
+
+# --- 配置 ---
+FORMAT_VERSION = 1  # 磁盘格式版本，格式变化时递增，旧服务拒绝加载不认识的版本
+MODES = ('per_stock', 'global')
+
+
+def stats_path_for(model_path: str) -> str:
+    """归一化参数与模型放在一起：models/stock_model_all.h5 -> models/stock_model_all.norm.npz"""
+    return os.path.splitext(model_path)[0] + '.norm.npz'
+
+
+def scale(values, lo, hi):
+    """MinMax 归一化，区间为 0 时按 1 处理 (与 MinMaxScaler 一致)；lo/hi 可以是标量或按行广播的数组"""
+    price_range = np.asarray(hi, dtype=np.float64) - lo
+    price_range = np.where(price_range == 0, 1.0, price_range)
+    return (np.asarray(values, dtype=np.float64) - lo) / price_range
+
+
+def unscale(values, lo, hi):
+    price_range = np.asarray(hi, dtype=np.float64) - lo
+    price_range = np.where(price_range == 0, 1.0, price_range)
+    return np.asarray(values, dtype=np.float64) * price_range + lo
+
+
+class NormalizationStats:
+    """
+    训练时使用的归一化参数：每支股票收盘价的最小/最大值与统计截止日期，以及全市场的最小/最大值。
+    mode 为 'per_stock' 时每支股票按自己的区间归一化，'global' 时所有股票共用全市场区间。
+    服务端加载一次后常驻内存 (代码 -> 下标 + 紧凑数组)，新数据到来时按股票增量扩展区间，
+    不再对全部历史重新拟合；更新加锁，可被多个请求线程并发读写。
+    """
+
+    def __init__(self, mode, codes, mins, maxs, last_dates, global_min, global_max):
+        if mode not in MODES:
+            raise ValueError(f"未知的归一化方式: {mode}")
+        self.mode = mode
+        self.codes = list(codes)
+        self.mins = np.asarray(mins, dtype=np.float64)
+        self.maxs = np.asarray(maxs, dtype=np.float64)
+        self.last_dates = np.asarray(last_dates, dtype='datetime64[D]')
+        self.global_min = float(global_min)
+        self.global_max = float(global_max)
+        self._index = {code: i for i, code in enumerate(self.codes)}
+        self._extra = {}  # 训练后新出现的股票: code -> [min, max, last_date]
+        self._lock = threading.Lock()
+
+    # --- 构建与持久化 ---
+    @classmethod
+    def from_history(cls, history, mode='per_stock', min_length=0):
+        """由 HistoryCache 一次性向量化计算各股票的区间 (只统计长度超过 min_length 的股票)"""
+        prices, offsets = history.columns['close'], history.offsets
+        lengths = np.diff(offsets)
+        keep = lengths > min_length
+        if not keep.any():
+            raise ValueError("没有可用于统计归一化参数的股票数据")
+        mins = np.minimum.reduceat(prices, offsets[:-1])[keep]
+        maxs = np.maximum.reduceat(prices, offsets[:-1])[keep]
+        last_dates = history.columns['date'][offsets[1:][keep] - 1]
+        codes = [code for code, k in zip(history.codes, keep) if k]
+        return cls(mode, codes, mins, maxs, last_dates, mins.min(), maxs.max())
+
+    @classmethod
+    def empty(cls, mode='per_stock'):
+        """没有随模型保存的归一化参数时 (旧模型) 使用：各股票的区间在首次请求时登记"""
+        return cls(mode, [], [], [], [], 0.0, 1.0)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            version = int(data['format_version'])
+            if version != FORMAT_VERSION:
+                raise ValueError(f"不支持的归一化参数格式版本: {version} (当前 {FORMAT_VERSION})")
+            return cls(str(data['mode']), data['codes'].tolist(), data['mins'], data['maxs'], data['last_dates'],
+                       data['global_min'], data['global_max'])
+
+    def save(self, path):
+        """先写临时文件再原子替换"""
+        with self._lock:
+            codes = self.codes + list(self._extra)
+            extra = list(self._extra.values())
+            mins = np.concatenate([self.mins, [e[0] for e in extra]])
+            maxs = np.concatenate([self.maxs, [e[1] for e in extra]])
+            last_dates = np.concatenate([self.last_dates, np.array([e[2] for e in extra], dtype='datetime64[D]')])
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, format_version=np.int64(FORMAT_VERSION), mode=np.str_(self.mode),
+                 codes=np.array(codes, dtype=str), mins=mins, maxs=maxs, last_dates=last_dates,
+                 global_min=np.float64(self.global_min), global_max=np.float64(self.global_max))
+        os.replace(tmp_path, path)
+
+    # --- 查询与增量更新 ---
+    def __len__(self):
+        return len(self.codes) + len(self._extra)
+
+    def __contains__(self, code):
+        return code in self._index or code in self._extra
+
+    def bounds(self, code):
+        """返回 (min, max, 统计截止日期)；全局模式下区间取全市场值。未知股票返回 None"""
+        i = self._index.get(code)
+        if i is not None:
+            lo, hi, last = self.mins[i], self.maxs[i], self.last_dates[i]
+        else:
+            entry = self._extra.get(code)
+            if entry is None:
+                return None
+            lo, hi, last = entry
+        if self.mode == 'global':
+            return self.global_min, self.global_max, last
+        return float(lo), float(hi), last
+
+    def bounds_many(self, codes, history_mins, history_maxs):
+        """
+        批量取区间 (离线预计算用)。history_mins/maxs 为调用方从数据库统计的截至目前的全历史区间，
+        按股票归一化时它就是已存区间并入新数据后的结果，与已存区间取并集即可。
+        """
+        if self.mode == 'global':
+            n = len(codes)
+            return np.full(n, self.global_min), np.full(n, self.global_max)
+        mins = np.array(history_mins, dtype=np.float64)
+        maxs = np.array(history_maxs, dtype=np.float64)
+        for j, code in enumerate(codes):
+            found = self.bounds(code)
+            if found is not None:
+                mins[j], maxs[j] = min(mins[j], found[0]), max(maxs[j], found[1])
+        return mins, maxs
+
+    def update(self, code, lo, hi, last_date):
+        """把截止日期之后的新数据并入区间 (只会扩大区间)；未知股票直接登记"""
+        last_date = np.datetime64(last_date, 'D')
+        with self._lock:
+            i = self._index.get(code)
+            if i is not None:
+                if last_date <= self.last_dates[i]:
+                    return
+                self.mins[i] = min(self.mins[i], lo)
+                self.maxs[i] = max(self.maxs[i], hi)
+                self.last_dates[i] = last_date
+                return
+            entry = self._extra.get(code)
+            if entry is None:
+                self._extra[code] = [float(lo), float(hi), last_date]
+            elif last_date > entry[2]:
+                self._extra[code] = [min(entry[0], lo), max(entry[1], hi), last_date]
@@ -0,0 +1,159 @@
+import json
+import numpy as np
+import h5py
+
+# --- 配置 ---
+MODEL_PATH = 'models/stock_model_all.h5'
+PARITY_TOLERANCE = 1e-4  # 与 Keras 输出的最大允许绝对误差
+
+
+def _sigmoid(x):
+    # 0.5 * (1 + tanh(x / 2))，与 1 / (1 + exp(-x)) 等价，但运算更少且不会溢出
+    out = np.multiply(x, 0.5)
+    np.tanh(out, out=out)
+    out += 1.0
+    out *= 0.5
+    return out
+
+
+def _hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+
+ACTIVATIONS = {
+    'tanh': np.tanh,
+    'sigmoid': _sigmoid,
+    'hard_sigmoid': _hard_sigmoid,
+    'relu': lambda x: np.maximum(x, 0.0),
+    'linear': lambda x: x,
+    None: lambda x: x,
+}
+
+
+class LSTMLayer:
+    """
+    Keras LSTM 层的前向计算。Keras 中门的排列顺序为 i, f, c, o，
+    加载时把权重列重排为 i, f, o, c，使三个 sigmoid 门在内存中连续，每步只需一次激活调用。
+    """
+
+    def __init__(self, kernel, recurrent_kernel, bias, return_sequences, activation, recurrent_activation):
+        units = recurrent_kernel.shape[0]
+        order = np.concatenate([np.arange(0, 2 * units), np.arange(3 * units, 4 * units),
+                                np.arange(2 * units, 3 * units)])
+        self.kernel = np.ascontiguousarray(kernel[:, order], dtype=np.float32)
+        self.recurrent_kernel = np.ascontiguousarray(recurrent_kernel[:, order], dtype=np.float32)
+        self.bias = bias[order].astype(np.float32)
+        self.units = units
+        self.return_sequences = return_sequences
+        self.activation = ACTIVATIONS[activation]
+        self.recurrent_activation = ACTIVATIONS[recurrent_activation]
+
+    def __call__(self, x):
+        batch, steps, _ = x.shape
+        units = self.units
+        # 输入投影对所有时间步做一次二维矩阵乘，按 (steps, batch, 4 * units) 的时间优先布局存放，
+        # 循环内只剩隐藏状态的矩阵乘 (上一层输出本身就是时间优先的，这里的转置不产生拷贝)
+        time_major = np.ascontiguousarray(x.transpose(1, 0, 2)).reshape(steps * batch, -1)
+        projected = (time_major @ self.kernel + self.bias).reshape(steps, batch, 4 * units)
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+        z = np.empty((batch, 4 * units), dtype=np.float32)
+        outputs = np.empty((steps, batch, units), dtype=np.float32) if self.return_sequences else None
+        for t in range(steps):
+            np.matmul(h, self.recurrent_kernel, out=z)
+            z += projected[t]
+            gates = self.recurrent_activation(z[:, :3 * units])
+            g = self.activation(z[:, 3 * units:])
+            c *= gates[:, units:2 * units]
+            c += gates[:, :units] * g
+            h = gates[:, 2 * units:] * self.activation(c)
+            if outputs is not None:
+                outputs[t] = h
+        return outputs.transpose(1, 0, 2) if outputs is not None else h
+
+
+class DenseLayer:
+    def __init__(self, kernel, bias, activation):
+        self.kernel = kernel.astype(np.float32)
+        self.bias = bias.astype(np.float32) if bias is not None else 0.0
+        self.activation = ACTIVATIONS[activation]
+
+    def __call__(self, x):
+        return self.activation(x @ self.kernel + self.bias)
+
+
+class NumpyLSTMModel:
+    """
+    不依赖 TensorFlow 的推理后端：从 Keras 保存的 .h5 文件读取 LSTM/Dense 权重，
+    用向量化的 NumPy 完成前向计算。Dropout 在推理时不起作用，直接跳过。
+    对外提供与 Keras 模型相同的 predict / predict_on_batch 接口。
+    """
+
+    def __init__(self, layers, input_shape):
+        self.layers = layers
+        self.input_shape = input_shape
+
+    @classmethod
+    def from_h5(cls, path=MODEL_PATH):
+        with h5py.File(path, 'r') as f:
+            config = f.attrs['model_config']
+            config = json.loads(config.decode('utf-8') if isinstance(config, bytes) else config)
+            if config.get('class_name') != 'Sequential':
+                raise ValueError(f"仅支持 Sequential 模型，实际为 {config.get('class_name')}")
+            weights_group = f['model_weights'] if 'model_weights' in f else f
+            layers, input_shape = [], None
+            for layer_config in config['config']['layers']:
+                class_name, layer = layer_config['class_name'], layer_config['config']
+                if class_name == 'InputLayer':
+                    input_shape = tuple(layer.get('batch_shape') or layer.get('batch_input_shape'))[1:]
+                    continue
+                if class_name == 'Dropout':
+                    continue
+                weights = cls._layer_weights(weights_group[layer['name']])
+                if class_name == 'LSTM':
+                    layers.append(LSTMLayer(weights[0], weights[1], weights[2] if layer.get('use_bias', True) else
+                                            np.zeros(weights[1].shape[1], dtype=np.float32),
+                                            layer.get('return_sequences', False), layer.get('activation', 'tanh'),
+                                            layer.get('recurrent_activation', 'sigmoid')))
+                elif class_name == 'Dense':
+                    layers.append(DenseLayer(weights[0], weights[1] if layer.get('use_bias', True) else None,
+                                             layer.get('activation')))
+                else:
+                    raise ValueError(f"不支持的层类型: {class_name}")
+        return cls(layers, input_shape)
+
+    @staticmethod
+    def _layer_weights(group):
+        names = group.attrs.get('weight_names', [])
+        return [np.asarray(group[name.decode('utf-8') if isinstance(name, bytes) else name]) for name in names]
+
+    def predict_on_batch(self, x):
+        out = np.asarray(x, dtype=np.float32)
+        for layer in self.layers:
+            out = layer(out)
+        return out
+
+    def predict(self, x, batch_size=1024, verbose=0):
+        x = np.asarray(x, dtype=np.float32)
+        if len(x) <= batch_size:
+            return self.predict_on_batch(x)
+        return np.concatenate([self.predict_on_batch(x[i:i + batch_size]) for i in range(0, len(x), batch_size)])
+
+
+def check_parity(path=MODEL_PATH, samples=256, tolerance=PARITY_TOLERANCE):
+    """在随机输入上对比 Keras 与 NumPy 后端的输出，返回最大绝对误差 (需要安装 TensorFlow)"""
+    from tensorflow.keras.models import load_model
+
+    numpy_model = NumpyLSTMModel.from_h5(path)
+    keras_model = load_model(path, compile=False)  # 只做推理，不需要反序列化损失与指标
+    rng = np.random.default_rng(0)
+    x = rng.random((samples,) + numpy_model.input_shape, dtype=np.float32)
+    max_error = float(np.max(np.abs(keras_model.predict(x, verbose=0) - numpy_model.predict(x))))
+    print(f"NumPy 与 Keras 输出最大绝对误差: {max_error:.2e} (允许 {tolerance:.0e})")
+    if max_error > tolerance:
+        raise AssertionError(f"NumPy 推理结果与 Keras 不一致: {max_error}")
+    return max_error
+
+
+if __name__ == '__main__':
+    check_parity()
@@ -0,0 +1,178 @@
+import os
+import time
+import hashlib
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from inference_engine import rollout_forecast, FORECAST_DAYS
+from norm_stats import scale, unscale
+import db_compat
+
+# --- 配置 ---
+LOOK_BACK_DAYS = 60
+PREDICTION_TABLE = 't_predictions'
+PREDICT_CHUNK_SIZE = 1024  # 每次前向计算的股票数，控制显存/内存占用
+WRITE_CHUNK_SIZE = 5000  # 每条多行 INSERT 写入的行数
+
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {PREDICTION_TABLE} (
+    stock_code VARCHAR(10) NOT NULL,
+    model_version VARCHAR(40) NOT NULL,
+    as_of_date DATE NOT NULL,
+    horizon TINYINT NOT NULL,
+    pred_date DATE NOT NULL,
+    price DOUBLE NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (stock_code, model_version, as_of_date, horizon)
+)
+"""
+
+# 一次查询取出每支股票最近 LOOK_BACK_DAYS 天的收盘价，以及全历史的最小/最大值
+# (在线预测按全历史做 MinMax 归一化，离线结果必须与之一致)
+LATEST_WINDOWS_SQL = """
+SELECT code, date, price, min_price, max_price FROM (
+    SELECT `股票代码` as code, `日期` as date, `收盘价` as price,
+           MIN(`收盘价`) OVER (PARTITION BY `股票代码`) as min_price,
+           MAX(`收盘价`) OVER (PARTITION BY `股票代码`) as max_price,
+           ROW_NUMBER() OVER (PARTITION BY `股票代码` ORDER BY `日期` DESC) as rn
+    FROM t_stocks
+) t
+WHERE rn <= :look_back
+ORDER BY code, date
+"""
+
+CACHED_PREDICTIONS_SQL = f"""
+SELECT pred_date as date, price FROM {PREDICTION_TABLE}
+WHERE stock_code = :code AND model_version = :version AND as_of_date = :as_of
+ORDER BY horizon
+"""
+
+# 写入新结果时，同一事务内清掉这些股票其他模型版本与更早基准日期的结果，表只保留每支股票的当前预测
+PRUNE_STALE_SQL = f"""
+DELETE FROM {PREDICTION_TABLE}
+WHERE stock_code = :code AND (model_version <> :version OR as_of_date < :as_of)
+"""
+
+# 在线预测 (api_server) 读取单支股票最近的收盘价窗口，以及归一化区间统计之后的新数据范围
+WINDOW_SQL = """
+SELECT `日期` as date, `收盘价` as price FROM t_stocks WHERE `股票代码` = :code
+ORDER BY `日期` DESC LIMIT :limit
+"""
+NORM_BOUNDS_SQL = "SELECT MIN(`收盘价`), MAX(`收盘价`), MAX(`日期`) FROM t_stocks WHERE `股票代码` = :code"
+NORM_BOUNDS_SINCE_SQL = NORM_BOUNDS_SQL + " AND `日期` > :since"
+
+
+# --- 核心函数 ---
+def model_version_of(model_path: str) -> str:
+    """用模型文件内容的哈希作为模型版本号，模型重新训练后版本自动变化"""
+    digest = hashlib.sha1()
+    with open(model_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def ensure_prediction_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_TABLE_SQL))
+
+
+def load_latest_windows(engine, look_back=LOOK_BACK_DAYS):
+    """
+    返回 (codes, as_of_dates, windows, min_prices, max_prices)，
+    windows 形状为 (N, look_back)，只包含历史长度足够的股票。
+    """
+    df = pd.read_sql(text(LATEST_WINDOWS_SQL), con=engine, params={"look_back": look_back})
+    if df.empty:
+        return [], [], np.empty((0, look_back), dtype=np.float32), np.empty(0), np.empty(0)
+    counts = df.groupby('code', sort=False)['price'].transform('size')
+    df = df[counts == look_back]
+    if df.empty:
+        return [], [], np.empty((0, look_back), dtype=np.float32), np.empty(0), np.empty(0)
+    # 已按 (code, date) 排序，每 look_back 行恰好是一支股票的窗口
+    windows = df['price'].to_numpy(dtype=np.float32).reshape(-1, look_back)
+    last_rows = df.iloc[look_back - 1::look_back]
+    codes = last_rows['code'].tolist()
+    as_of_dates = pd.to_datetime(last_rows['date']).dt.date.tolist()
+    return (codes, as_of_dates, windows,
+            last_rows['min_price'].to_numpy(dtype=np.float64),
+            last_rows['max_price'].to_numpy(dtype=np.float64))
+
+
+def forecast_windows(predict_fn, windows, min_prices, max_prices, horizon=FORECAST_DAYS):
+    """对 (N, look_back) 的收盘价窗口做批量归一化 + 递归预测，返回 (N, horizon) 的价格"""
+    scaled = scale(windows, min_prices[:, None], max_prices[:, None])
+    outputs = np.empty((windows.shape[0], horizon), dtype=np.float64)
+    for start in range(0, windows.shape[0], PREDICT_CHUNK_SIZE):
+        chunk = scaled[start:start + PREDICT_CHUNK_SIZE, :, None].astype(np.float32)
+        outputs[start:start + PREDICT_CHUNK_SIZE] = rollout_forecast(predict_fn, chunk, horizon)
+    return unscale(outputs, min_prices[:, None], max_prices[:, None])
+
+
+def save_predictions(engine, codes, as_of_dates, prices, model_version):
+    """
+    按 (股票代码, 模型版本, 基准日期, 预测步) 批量写入，重复执行时覆盖旧值；
+    同一事务内删除这些股票的旧版本/旧基准日期结果，表的大小不随重训与每日更新增长
+    """
+    rows = []
+    for code, as_of, path in zip(codes, as_of_dates, prices):
+        for step, price in enumerate(path, start=1):
+            rows.append({
+                "code": code, "version": model_version, "as_of": as_of, "horizon": step,
+                "pred_date": as_of + timedelta(days=step), "price": float(price),
+            })
+    upsert = db_compat.upsert_clause(engine, ['stock_code', 'model_version', 'as_of_date', 'horizon'],
+                                     ['pred_date', 'price'])
+    stmt = text(f"""
+        INSERT INTO {PREDICTION_TABLE} (stock_code, model_version, as_of_date, horizon, pred_date, price)
+        VALUES (:code, :version, :as_of, :horizon, :pred_date, :price)
+        {upsert}
+    """)
+    stale = [{"code": code, "version": model_version, "as_of": as_of} for code, as_of in zip(codes, as_of_dates)]
+    with engine.begin() as conn:
+        for start in range(0, len(stale), WRITE_CHUNK_SIZE):
+            conn.execute(text(PRUNE_STALE_SQL), stale[start:start + WRITE_CHUNK_SIZE])
+        for start in range(0, len(rows), WRITE_CHUNK_SIZE):
+            conn.execute(stmt, rows[start:start + WRITE_CHUNK_SIZE])
+    return len(rows)
+
+
+def fetch_cached_predictions(engine, stock_code, as_of_date, model_version):
+    """读取预计算结果；缺失或不完整时返回 None，由调用方回退到在线推理"""
+    with engine.connect() as conn:
+        rows = conn.execute(text(CACHED_PREDICTIONS_SQL), {"code": stock_code, "version": model_version, "as_of": as_of_date}).fetchall()
+    if len(rows) < FORECAST_DAYS:
+        return None
+    return [{"date": pd.Timestamp(row[0]), "price": float(row[1])} for row in rows]
+
+
+def run_prediction_job(engine, predict_fn, model_version, look_back=LOOK_BACK_DAYS, norm=None):
+    """全市场批量预计算：一次读取、一次向量化递归预测、一次批量写入；norm 为模型训练时的归一化参数"""
+    start = time.perf_counter()
+    ensure_prediction_table(engine)
+    codes, as_of_dates, windows, min_prices, max_prices = load_latest_windows(engine, look_back)
+    if not codes:
+        print("没有足够长的股票数据可用于预计算。")
+        return 0
+    if norm is not None:
+        min_prices, max_prices = norm.bounds_many(codes, min_prices, max_prices)
+    prices = forecast_windows(predict_fn, windows, min_prices, max_prices)
+    written = save_predictions(engine, codes, as_of_dates, prices, model_version)
+    print(f"预测预计算完成: {len(codes)} 支股票, 写入 {written} 行, 模型版本 {model_version}, "
+          f"耗时 {time.perf_counter() - start:.1f} 秒。")
+    return len(codes)
+
+
+if __name__ == '__main__':
+    import data_updater
+    from numpy_lstm import NumpyLSTMModel
+    from model_registry import load_norm_stats
+
+    MODEL_PATH = 'models/stock_model_all.h5'
+    if not os.path.exists(MODEL_PATH):
+        print(f"警告: 模型文件 {MODEL_PATH} 不存在。")
+    else:
+        numpy_model = NumpyLSTMModel.from_h5(MODEL_PATH)
+        run_prediction_job(db_compat.create_db_engine(data_updater.DB_URI), numpy_model.predict_on_batch,
+                           model_version_of(MODEL_PATH), norm=load_norm_stats(MODEL_PATH))
@@ -0,0 +1,161 @@
+import time
+import threading
+from sqlalchemy import text
+import db_compat
+
+# --- 配置 ---
+SNAPSHOT_TABLE = 't_stock_latest'
+COUNT_CACHE_TTL = 60  # 总数缓存的有效期 (秒)，多进程部署时作为兜底
+COUNT_CACHE_MAX_KEYS = 1024  # 按关键字缓存的条目上限
+
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (
+    `股票代码` VARCHAR(10) NOT NULL PRIMARY KEY,
+    `日期` DATE NOT NULL,
+    `开盘价` DOUBLE,
+    `收盘价` DOUBLE,
+    `成交量` DOUBLE,
+    `日内涨跌幅` DOUBLE,
+    `更新时间` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+)
+"""
+
+# 只在建表或修复时全量执行一次，之后由写入任务逐支维护
+REBUILD_SQL = f"""
+REPLACE INTO {SNAPSHOT_TABLE} (`股票代码`, `日期`, `开盘价`, `收盘价`, `成交量`, `日内涨跌幅`)
+SELECT code, date, open, close, volume, (close - open) / open * 100 FROM (
+    SELECT `股票代码` as code, `日期` as date, `开盘价` as open, `收盘价` as close, `成交量` as volume,
+           ROW_NUMBER() OVER (PARTITION BY `股票代码` ORDER BY `日期` DESC) as rn
+    FROM t_stocks
+) ranked
+WHERE rn = 1
+"""
+
+UPSERT_SQL = f"""
+INSERT INTO {SNAPSHOT_TABLE} (`股票代码`, `日期`, `开盘价`, `收盘价`, `成交量`, `日内涨跌幅`)
+VALUES (:code, :date, :open, :close, :volume, :change_percent)
+{{upsert}}
+"""
+UPSERT_COLUMNS = ['日期', '开盘价', '收盘价', '成交量', '日内涨跌幅']
+
+# 股票列表：快照 (每支股票一行) 关联股票名称，调用方补充条件、排序与分页
+LIST_SQL = f"""
+SELECT q.`股票代码` as code, COALESCE(b.`股票名称`, q.`股票代码`) as name,
+       q.`收盘价` as price, q.`日期` as date, q.`开盘价` as prevPrice,
+       q.`日内涨跌幅` as changePercent, q.`成交量` as volume
+FROM {SNAPSHOT_TABLE} q
+LEFT JOIN t_stock_basic b ON q.`股票代码` = b.`股票代码`
+{{where_clause}}
+"""
+# 按代码排序的一页：offset_clause 为空时配合 where 中的 `股票代码` > :after 做键集分页
+LIST_PAGE_SQL = LIST_SQL + """ORDER BY q.`股票代码`
+LIMIT :limit {offset_clause}
+"""
+COUNT_SQL = f"SELECT COUNT(*) FROM {SNAPSHOT_TABLE} q"
+COUNT_KEYWORD_SQL = COUNT_SQL + " LEFT JOIN t_stock_basic b ON q.`股票代码` = b.`股票代码` WHERE {condition}"
+STOCK_VERSION_SQL = f"SELECT `日期`, `更新时间`, `开盘价`, `收盘价`, `成交量` FROM {SNAPSHOT_TABLE} WHERE `股票代码` = :code"
+SNAPSHOT_VERSION_SQL = f"SELECT MAX(`更新时间`), COUNT(*) FROM {SNAPSHOT_TABLE}"
+
+_ready = False
+_ready_lock = threading.Lock()
+_count_cache = {}
+_count_lock = threading.Lock()
+
+
+# --- 维护 ---
+def ensure_snapshot(engine):
+    """确保快照表存在；首次创建 (或为空) 时从 t_stocks 全量构建一次"""
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        with engine.begin() as conn:
+            conn.execute(text(db_compat.portable_ddl(conn, CREATE_TABLE_SQL)))
+            has_rows = conn.execute(text(f"SELECT 1 FROM {SNAPSHOT_TABLE} LIMIT 1")).first()
+            if not has_rows:
+                print("最新行情快照为空，正在从 t_stocks 全量构建...")
+                conn.execute(text(REBUILD_SQL))
+        _ready = True
+        invalidate_counts()
+
+
+def rebuild_snapshot(engine):
+    with engine.begin() as conn:
+        conn.execute(text(db_compat.portable_ddl(conn, CREATE_TABLE_SQL)))
+        conn.execute(text(REBUILD_SQL))
+    invalidate_counts()
+
+
+def upsert_latest_quotes(conn, df):
+    """
+    在写入 t_stocks 的同一事务中更新快照：每支股票只取本次数据中最新的一行。
+    df 使用 t_stocks 的列名。
+    """
+    if df.empty:
+        return
+    latest = df.sort_values('日期').groupby('股票代码', sort=False).tail(1)
+    rows = []
+    for row in latest.itertuples(index=False):
+        open_price, close_price = float(getattr(row, '开盘价')), float(getattr(row, '收盘价'))
+        rows.append({
+            "code": getattr(row, '股票代码'), "date": getattr(row, '日期'),
+            "open": open_price, "close": close_price, "volume": float(getattr(row, '成交量')),
+            "change_percent": (close_price - open_price) / open_price * 100 if open_price else None,
+        })
+    # SQLite 不支持 ON UPDATE CURRENT_TIMESTAMP，更新时间在冲突更新时显式写入 (MySQL 下结果相同)
+    upsert = db_compat.upsert_clause(conn, ['股票代码'], UPSERT_COLUMNS, ["`更新时间` = CURRENT_TIMESTAMP"])
+    conn.execute(text(UPSERT_SQL.format(upsert=upsert)), rows)
+    invalidate_counts()
+
+
+# --- 查询 ---
+def keyword_filter(keyword, alias='q', basic_alias='b'):
+    """返回 (where 子句片段, 参数)"""
+    if not keyword:
+        return "", {}
+    return (f"({alias}.`股票代码` LIKE :keyword OR {basic_alias}.`股票名称` LIKE :keyword)",
+            {"keyword": f"%{keyword}%"})
+
+
+def count_quotes(engine, keyword=None):
+    """快照中 (满足关键字的) 股票数，带缓存；快照有写入时失效"""
+    key = keyword or ''
+    now = time.monotonic()
+    with _count_lock:
+        cached = _count_cache.get(key)
+        if cached and now - cached[1] < COUNT_CACHE_TTL:
+            return cached[0]
+    condition, params = keyword_filter(keyword)
+    sql = COUNT_KEYWORD_SQL.format(condition=condition) if condition else COUNT_SQL
+    with engine.connect() as conn:
+        total = conn.execute(text(sql), params).scalar() or 0
+    with _count_lock:
+        if len(_count_cache) >= COUNT_CACHE_MAX_KEYS:
+            _count_cache.clear()
+        _count_cache[key] = (total, now)
+    return total
+
+
+def stock_version(engine, stock_code):
+    """
+    某支股票的版本标识，用于生成 ETag；不存在时返回 None。
+    包含最新交易日、更新时间和最新一行的行情：同一交易日内原地更新也会变化
+    (更新时间只精确到秒，同一秒内的多次更新由行情值区分)。
+    """
+    with engine.connect() as conn:
+        row = conn.execute(text(STOCK_VERSION_SQL), {"code": stock_code}).first()
+    return None if row is None else ':'.join(str(value) for value in row)
+
+
+def snapshot_version(engine):
+    """快照整体的版本标识 (最后更新时间 + 行数)，任何股票有新行情都会变化"""
+    with engine.connect() as conn:
+        row = conn.execute(text(SNAPSHOT_VERSION_SQL)).first()
+    return f"{row[0]}:{row[1]}"
+
+
+def invalidate_counts():
+    with _count_lock:
+        _count_cache.clear()
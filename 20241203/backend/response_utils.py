@@ -0,0 +1,102 @@
+import gzip
+import json
+import hashlib
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # 未安装时退回标准库 json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# --- 配置 ---
+COMPRESS_MIN_BYTES = 1024  # 小于该大小的响应不压缩
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+# --- 序列化 ---
+def _default(obj):
+    """与 CustomJSONEncoder 一致：日期统一输出为 YYYY-MM-DD"""
+    if isinstance(obj, (datetime, date, pd.Timestamp)): return obj.strftime('%Y-%m-%d')
+    if isinstance(obj, np.generic): return obj.item()
+    if hasattr(obj, 'tolist'): return obj.tolist()
+    raise TypeError(f"无法序列化的类型: {type(obj)}")
+
+
+def dumps(obj) -> bytes:
+    """快速 JSON 编码；orjson 可直接从 NumPy 缓冲区序列化数组 (NaN 输出为 null)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=(
+            orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS
+            | orjson.OPT_NON_STR_KEYS))
+    return json.dumps(obj, default=_default, ensure_ascii=False, allow_nan=False).encode('utf-8')
+
+
+def to_columnar(df: pd.DataFrame) -> dict:
+    """按列输出：{列名: 数组}，不再为每行构造一个 dict、重复列名"""
+    columns = {}
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if values.dtype.kind == 'f':
+            if orjson is None:
+                # 标准库 json 不接受 NaN，转换为 None
+                values = np.where(np.isnan(values), None, values).tolist()
+            elif not values.flags['C_CONTIGUOUS']:
+                values = np.ascontiguousarray(values)
+        elif values.dtype.kind in 'iub':
+            values = values if orjson is not None else values.tolist()
+        else:
+            values = [None if v is None or (isinstance(v, float) and np.isnan(v)) else v for v in values.tolist()]
+        columns[name] = values
+    return {"columns": list(df.columns), "values": columns, "length": len(df)}
+
+
+# --- 缓存校验与压缩 ---
+def make_etag(*parts) -> str:
+    """由影响响应内容的各项 (如股票最新日期、模型版本、请求参数) 生成强 ETag"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def not_modified(etag):
+    """客户端缓存仍然有效时返回 304 响应，否则返回 None (压缩后的 ETag 带有 -gzip/-br 后缀)"""
+    if not etag:
+        return None
+    base = etag.strip('"')
+    if any(tag.split('-', 1)[0] == base for tag in request.if_none_match.as_set()):
+        response = Response(status=304)
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+
+def json_response(payload, status=200, etag=None) -> Response:
+    """快速编码 + ETag + 按 Accept-Encoding 进行 brotli/gzip 压缩"""
+    body = dumps(payload)
+    response = Response(body, status=status, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if etag:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+            response.headers['Content-Encoding'] = 'br'
+        elif accepted['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+            response.headers['Content-Encoding'] = 'gzip'
+        # 强 ETag 对不同的内容编码必须不同
+        if etag and 'Content-Encoding' in response.headers:
+            base = etag.strip('"')
+            response.headers['ETag'] = f'"{base}-{response.headers["Content-Encoding"]}"'
+    return response
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# --- 配置 ---
+DEFAULT_INTERVAL_MS = 10  # 采样间隔
+DEFAULT_DURATION = 30  # 默认采样时长 (秒)，到时自动停止，避免忘记关闭
+MAX_DURATION = 300
+MAX_STACK_DEPTH = 64
+
+
+class SamplingProfiler:
+    """
+    进程内的采样分析器：后台线程按固定间隔读取所有线程的调用栈 (sys._current_frames)，
+    按折叠栈 (collapsed stack) 计数，结果可直接交给 flamegraph.pl / speedscope 生成火焰图。
+    不修改被采样的代码，也不使用 sys.setprofile，开销只与采样频率有关，适合在生产进程中临时打开。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stacks = Counter()
+        self._samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self.started_at = None
+        self.stopped_at = None
+        self.interval_ms = DEFAULT_INTERVAL_MS
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=DEFAULT_DURATION, interval_ms=DEFAULT_INTERVAL_MS):
+        """开始一次新的采样 (清空上次结果)；已在运行时返回 False"""
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self._samples = 0
+            self.interval_ms = max(1, int(interval_ms))
+            self.started_at, self.stopped_at = time.time(), None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(min(duration, MAX_DURATION),),
+                                            name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=2.0)
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "pid": os.getpid(),
+                "samples": self._samples,
+                "distinctStacks": len(self._stacks),
+                "intervalMs": self.interval_ms,
+                "startedAt": self.started_at,
+                "stoppedAt": self.stopped_at,
+            }
+
+    def collapsed(self):
+        """折叠栈文本：每行 "线程名;最外层帧;...;最内层帧 次数"，按次数降序"""
+        with self._lock:
+            items = self._stacks.most_common()
+        return '\n'.join(f"{stack} {count}" for stack, count in items) + ('\n' if items else '')
+
+    def _run(self, duration):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration
+        interval = self.interval_ms / 1000.0
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                sampled.append(self._fold(names.get(thread_id, str(thread_id)), frame))
+            with self._lock:
+                self._stacks.update(sampled)
+                self._samples += 1
+            self._stop.wait(interval)
+        with self._lock:
+            self.stopped_at = time.time()
+
+    @staticmethod
+    def _fold(thread_name, frame):
+        parts = []
+        while frame is not None and len(parts) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        parts.append(thread_name)
+        return ';'.join(reversed(parts))
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,333 @@
+import re
+import sys
+import datetime
+from sqlalchemy import bindparam, inspect, text
+import db_compat
+import quote_snapshot
+import kline_aggregates
+import prediction_job
+import history_cache
+import event_stream
+import data_updater
+import watchlist_cache
+
+# --- 配置 ---
+MIGRATIONS_TABLE = 'schema_migrations'
+PARTITION_YEARS_AHEAD = 1  # 分区时预留的未来年份数，之后定期执行 partition 滚动补齐
+
+CREATE_MIGRATIONS_SQL = f"""
+CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+    version INT NOT NULL PRIMARY KEY,
+    description VARCHAR(200) NOT NULL,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# 业务表：此前假定已由人工创建，这里补齐主键/唯一键
+BASE_TABLES_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS t_stocks (
+        `股票代码` VARCHAR(10) NOT NULL,
+        `日期` DATE NOT NULL,
+        {', '.join(f'`{c}` DOUBLE' for c in data_updater.KLINE_COLUMNS[2:])},
+        PRIMARY KEY (`股票代码`, `日期`)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_stock_basic (
+        `股票代码` VARCHAR(10) NOT NULL PRIMARY KEY,
+        `股票名称` VARCHAR(50)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        username VARCHAR(50) NOT NULL UNIQUE,
+        password_hash VARCHAR(255) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS t_watchlists (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        stock_code VARCHAR(10) NOT NULL,
+        CONSTRAINT uk_watchlists_user_stock UNIQUE (user_id, stock_code)
+    )
+    """,
+]
+
+# 账户表的查询 (api_server 的注册与登录)
+USER_EXISTS_SQL = "SELECT id FROM t_users WHERE username = :username"
+REGISTER_SQL = "INSERT INTO t_users (username, password_hash) VALUES (:username, :password)"
+LOGIN_SQL = "SELECT id, password_hash FROM t_users WHERE username = :username"
+
+# 热点查询依赖的唯一键：(表, 索引名, 列)。新建的表已经带有，这里补给早先手工建的表
+UNIQUE_KEYS = [
+    ('t_stocks', 'uk_stocks_code_date', ['股票代码', '日期']),
+    ('t_stock_basic', 'uk_stock_basic_code', ['股票代码']),
+    ('t_users', 'uk_users_username', ['username']),
+    ('t_watchlists', 'uk_watchlists_user_stock', ['user_id', 'stock_code']),
+]
+
+
+# --- 工具 ---
+def ensure_index(conn, table, name, columns, unique=False):
+    """按名称创建索引；同名索引或 (唯一索引时) 相同列上的唯一键已存在时跳过。返回是否新建"""
+    if unique and db_compat.has_unique_key(conn, table, columns):
+        return False
+    if any(index['name'] == name for index in inspect(conn).get_indexes(table)):
+        return False
+    keys = ', '.join(f"`{c}`" for c in columns)
+    conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX `{name}` ON {table} ({keys})"))
+    print(f"已创建索引 {table}.{name} ({keys})")
+    return True
+
+
+def _primary_key(conn, table):
+    return inspect(conn).get_pk_constraint(table).get('constrained_columns') or []
+
+
+# --- 迁移 ---
+def _create_tables(conn):
+    for sql in BASE_TABLES_SQL:
+        conn.execute(text(db_compat.portable_ddl(conn, sql)))
+    # 各模块自行维护的派生表也在这里建好，服务启动时不必再等首次请求
+    for sql in (quote_snapshot.CREATE_TABLE_SQL, kline_aggregates.CREATE_TABLE_SQL, prediction_job.CREATE_TABLE_SQL):
+        conn.execute(text(db_compat.portable_ddl(conn, sql)))
+
+
+def _ensure_unique_keys(conn):
+    for table, name, columns in UNIQUE_KEYS:
+        try:
+            ensure_index(conn, table, name, columns, unique=True)
+        except Exception:
+            print(f"为 {table} 添加唯一键 ({', '.join(columns)}) 失败，请先清理重复数据后重新执行 migrate。")
+            raise
+
+
+def _create_secondary_indexes(conn):
+    # 全市场按日期的增量读取 (HistoryCache、K 线聚合) 只带日期条件，(股票代码, 日期) 用不上
+    ensure_index(conn, 't_stocks', 'idx_stocks_date', ['日期'])
+    # InnoDB 按主键聚簇，(股票代码, 日期) 主键本身即覆盖按代码读取收盘价的查询；
+    # SQLite 或主键不同的旧表需要单独的覆盖索引，查询窗口与归一化区间时不必回表
+    if db_compat.is_sqlite(conn) or _primary_key(conn, 't_stocks') != ['股票代码', '日期']:
+        ensure_index(conn, 't_stocks', 'idx_stocks_code_date_close', ['股票代码', '日期', '收盘价'])
+    # 推送线程按更新时间轮询行情变化，快照版本号取 MAX(更新时间)
+    ensure_index(conn, quote_snapshot.SNAPSHOT_TABLE, 'idx_latest_updated', ['更新时间'])
+    # SQLite 不会自动收集统计信息，没有统计时按日期的范围查询会选错索引
+    if db_compat.is_sqlite(conn):
+        conn.execute(text("ANALYZE"))
+
+
+# (版本号, 说明, 执行函数)，只追加不修改；已执行的版本记录在 schema_migrations
+MIGRATIONS = [
+    (1, "创建业务表与派生表", _create_tables),
+    (2, "补齐主键/唯一键", _ensure_unique_keys),
+    (3, "日期、覆盖与更新时间索引", _create_secondary_indexes),
+]
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        conn.execute(text(db_compat.portable_ddl(conn, CREATE_MIGRATIONS_SQL)))
+        return {row[0] for row in conn.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}"))}
+
+
+def pending_migrations(engine):
+    applied = applied_versions(engine)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def migrate(engine):
+    """按版本顺序执行尚未执行的迁移，每个迁移一个事务；返回本次执行的版本号"""
+    done = []
+    for version, description, apply in pending_migrations(engine):
+        print(f"执行迁移 {version}: {description}")
+        with engine.begin() as conn:
+            apply(conn)
+            conn.execute(text(f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES (:version, :description)"),
+                         {"version": version, "description": description})
+        done.append(version)
+    if not done:
+        print("数据库结构已是最新。")
+    return done
+
+
+# --- 分区 (仅 MySQL) ---
+PARTITIONS_SQL = """
+SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+"""
+
+
+def _year_partition(year):
+    return f"PARTITION p{year} VALUES LESS THAN ('{year + 1}-01-01')"
+
+
+def partition_stocks(engine, years_ahead=PARTITION_YEARS_AHEAD, table='t_stocks'):
+    """
+    按年对 t_stocks 做 RANGE COLUMNS(日期) 分区：只带日期条件的增量读取只扫描最近的分区，
+    清理旧数据可以直接 DROP PARTITION。未分区时整表重建 (大表耗时较长，应在维护窗口执行)；
+    已分区时把 pmax 拆出缺少的年份。主键 (股票代码, 日期) 包含分区列，满足 MySQL 的要求。
+    """
+    if db_compat.is_sqlite(engine):
+        print("SQLite 不支持分区，跳过。")
+        return []
+    last_year = datetime.date.today().year + years_ahead
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(text(PARTITIONS_SQL), {"table": table})}
+        if not existing:
+            first = conn.execute(text(f"SELECT MIN(`日期`) FROM {table}")).scalar()
+            first_year = first.year if first is not None else datetime.date.today().year
+            years = list(range(first_year, last_year + 1))
+            parts = ', '.join([_year_partition(year) for year in years] + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+            print(f"正在为 {table} 创建 {len(years) + 1} 个分区 (需要重建整表)...")
+            conn.execute(text(f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS(`日期`) ({parts})"))
+            return years
+        known = {int(name[1:]) for name in existing if re.fullmatch(r'p\d{4}', name)}
+        years = [year for year in range(max(known) + 1, last_year + 1)] if known else []
+        if years and 'pmax' in existing:
+            parts = ', '.join([_year_partition(year) for year in years] + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"])
+            conn.execute(text(f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO ({parts})"))
+        print(f"{table} 已分区，新增年份: {years or '无'}")
+        return years
+
+
+# --- 执行计划检查 ---
+def _stocks_sql(template):
+    return template.format(table_name='t_stocks')
+
+
+# (名称, SQL, 是否预期全表扫描)。直接引用各模块实际执行的 SQL 常量，不另外抄写；
+# 预期全表扫描的是本来就要读全表的批量任务
+HOT_QUERIES = [
+    ('stocklist.page', quote_snapshot.LIST_PAGE_SQL.format(where_clause="", offset_clause="OFFSET :offset"), False),
+    ('stocklist.after', quote_snapshot.LIST_PAGE_SQL.format(where_clause="WHERE q.`股票代码` > :after",
+                                                            offset_clause=""), False),
+    ('stocklist.codes', quote_snapshot.LIST_SQL.format(where_clause="WHERE q.`股票代码` IN :codes"), False),
+    ('stocklist.count', quote_snapshot.COUNT_SQL, False),
+    ('snapshot.version', quote_snapshot.SNAPSHOT_VERSION_SQL, False),
+    ('snapshot.stock_version', quote_snapshot.STOCK_VERSION_SQL, False),
+    ('events.baseline', event_stream.QUOTE_BASELINE_SQL, False),
+    ('events.changed_quotes', event_stream.CHANGED_QUOTES_SQL, False),
+    ('kline.read_bars', kline_aggregates.READ_BARS_SQL, False),
+    ('kline.basic', kline_aggregates.STOCK_INFO_SQL, False),
+    ('kline.basic_many', kline_aggregates.STOCK_INFO_MANY_SQL, False),
+    ('kline.daily', kline_aggregates.DAILY_SQL.format(date_clause="AND `日期` >= :since"), False),
+    ('predictions.window', prediction_job.WINDOW_SQL, False),
+    ('predictions.norm_bounds', prediction_job.NORM_BOUNDS_SINCE_SQL, False),
+    ('predictions.cached', prediction_job.CACHED_PREDICTIONS_SQL, False),
+    ('predictions.prune', prediction_job.PRUNE_STALE_SQL, False),
+    ('history.incremental', history_cache.HISTORY_SQL.format(where_clause="WHERE `日期` >= :since"), False),
+    ('history.reload_codes', history_cache.HISTORY_SQL.format(where_clause="WHERE `股票代码` IN :codes"), False),
+    ('users.exists', USER_EXISTS_SQL, False),
+    ('users.login', LOGIN_SQL, False),
+    ('watchlist.codes', watchlist_cache.WATCHLIST_SQL, False),
+    ('watchlist.delete', watchlist_cache.DELETE_SQL, False),
+    ('watchlist.quotes_since', watchlist_cache.QUOTES_SQL.format(where_clause="WHERE q.`更新时间` >= :since"), False),
+    ('updater.max_dates', _stocks_sql(data_updater.MAX_DATES_SQL), False),
+    ('updater.stored_rows', _stocks_sql(data_updater.STORED_ROWS_SQL), False),
+    ('updater.list_codes', data_updater.LIST_CODES_SQL, False),
+    ('snapshot.rebuild', quote_snapshot.REBUILD_SQL, True),
+    ('predictions.latest_windows', prediction_job.LATEST_WINDOWS_SQL, True),
+    ('history.full', history_cache.HISTORY_SQL.format(where_clause=""), True),
+    ('history.code_stats', history_cache.CODE_STATS_SQL, True),
+    ('watchlist.quotes', watchlist_cache.QUOTES_SQL.format(where_clause=""), True),
+]
+
+
+def _sample_params(conn):
+    """执行计划只与参数类型有关，取库中实际存在的值，空库时用占位值"""
+    code = conn.execute(text("SELECT `股票代码` FROM t_stocks LIMIT 1")).scalar() or '000001'
+    since = conn.execute(text("SELECT MAX(`日期`) FROM t_stocks")).scalar() or datetime.date.today()
+    user_id = conn.execute(text("SELECT MIN(id) FROM t_users")).scalar() or 1
+    return {"code": code, "codes": [code], "since": since, "as_of": since, "after": code, "user_id": user_id,
+            "username": 'user', "stock_code": code, "version": 'model', "period": 'day', "limit": 20, "offset": 0,
+            "look_back": 60}
+
+
+def _explain(conn, prefix, sql, params):
+    stmt = text(f"{prefix} {sql}")
+    if ':codes' in sql:
+        stmt = stmt.bindparams(bindparam('codes', expanding=True))
+    return conn.execute(stmt, params)
+
+
+def _plan_sqlite(conn, sql, params):
+    """EXPLAIN QUERY PLAN：SCAN 后不带 USING 的是全表扫描 (子查询、物化视图除外)"""
+    rows = [row[3] for row in _explain(conn, 'EXPLAIN QUERY PLAN', sql, params)]
+    derived = {detail.split()[-1] for detail in rows if detail.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+    full, index = [], []
+    for detail in rows:
+        if not detail.startswith('SCAN '):
+            continue
+        target = detail.split()[1]
+        if target in derived or target.startswith('(') or target == 'CONSTANT':
+            continue
+        (index if ' USING ' in detail else full).append(target)
+    return rows, full, index
+
+
+def _plan_mysql(conn, sql, params):
+    """EXPLAIN：type=ALL 为全表扫描，type=index 为全索引扫描 (<derived> 等临时表除外)"""
+    rows = _explain(conn, 'EXPLAIN', sql, params).mappings().all()
+    full = [row['table'] for row in rows if row['type'] == 'ALL' and not str(row['table']).startswith('<')]
+    index = [row['table'] for row in rows if row['type'] == 'index']
+    details = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {row.get('Extra') or ''}".strip()
+               for row in rows]
+    return details, full, index
+
+
+def verify(engine, verbose=False):
+    """对热点查询执行 EXPLAIN，报告全表/全索引扫描；返回意外出现全表扫描的查询名"""
+    plan = _plan_sqlite if db_compat.is_sqlite(engine) else _plan_mysql
+    unexpected = []
+    with engine.connect() as conn:
+        params = _sample_params(conn)
+        for name, sql, expect_scan in HOT_QUERIES:
+            try:
+                details, full, index = plan(conn, sql, params)
+            except Exception as e:
+                print(f"[错误] {name}: {e}")
+                unexpected.append(name)
+                continue
+            if full and not expect_scan:
+                status = f"全表扫描: {', '.join(full)}"
+                unexpected.append(name)
+            elif full:
+                status = f"预期的全表扫描: {', '.join(full)}"
+            elif index:
+                status = f"全索引扫描: {', '.join(index)}"
+            else:
+                status = "OK"
+            print(f"[{status}] {name}")
+            if verbose or (full and not expect_scan):
+                for detail in details:
+                    print(f"    {detail}")
+    if unexpected:
+        print(f"{len(unexpected)} 个查询出现意外的全表扫描或执行失败: {', '.join(unexpected)}")
+    else:
+        print("全部热点查询均使用索引。")
+    return unexpected
+
+
+def status(engine):
+    applied = applied_versions(engine)
+    for version, description, _ in MIGRATIONS:
+        print(f"{'已执行' if version in applied else '待执行'} {version}: {description}")
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    engine = db_compat.create_db_engine(name='schema')
+    if command == 'migrate':
+        migrate(engine)
+    elif command == 'partition':
+        partition_stocks(engine)
+    elif command == 'verify':
+        sys.exit(1 if verify(engine, verbose='-v' in sys.argv[2:]) else 0)
+    elif command == 'status':
+        status(engine)
+    else:
+        print("用法: python schema.py [migrate|partition|verify [-v]|status]")
+        sys.exit(2)
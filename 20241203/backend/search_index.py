@@ -0,0 +1,234 @@
+import time
+import bisect
+import threading
+import unicodedata
+from sqlalchemy import text
+import metrics
+import quote_snapshot
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 未安装时按 GB2312 一级汉字的拼音排序推算首字母，多音字词查 _PHRASE_INITIALS
+    lazy_pinyin = None
+
+# --- 配置 ---
+REFRESH_INTERVAL = 300  # 索引的最长使用时间 (秒)，过期后在后台重建；多进程部署时作为兜底
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+NGRAM = 2  # 子串匹配使用的 n 元组长度
+
+# 与股票列表相同的范围：快照中有行情的股票，名称取自 t_stock_basic
+LOAD_SQL = f"""
+SELECT q.`股票代码` as code, COALESCE(b.`股票名称`, q.`股票代码`) as name
+FROM {quote_snapshot.SNAPSHOT_TABLE} q
+LEFT JOIN t_stock_basic b ON q.`股票代码` = b.`股票代码`
+"""
+
+# GB2312 一级汉字按拼音排序，各声母第一个汉字的区位码 (减去 65536 后的值)
+_GB2312_INITIALS = [
+    (-20319, 'a'), (-20283, 'b'), (-19775, 'c'), (-19218, 'd'), (-18710, 'e'), (-18526, 'f'),
+    (-18239, 'g'), (-17922, 'h'), (-17417, 'j'), (-16474, 'k'), (-16212, 'l'), (-15640, 'm'),
+    (-15165, 'n'), (-14922, 'o'), (-14914, 'p'), (-14630, 'q'), (-14149, 'r'), (-14090, 's'),
+    (-13318, 't'), (-12838, 'w'), (-12556, 'x'), (-11847, 'y'), (-11055, 'z'),
+]
+_GB2312_BOUNDS = [bound for bound, _ in _GB2312_INITIALS]
+_GB2312_LEVEL1_END = -10247
+
+# 按区位码推算只能得到每个字的一个读音，股票名称中常见的多音字词单独指定首字母
+_PHRASE_INITIALS = {
+    '银行': 'yh', '重庆': 'cq', '西藏': 'xz', '藏格': 'zg', '会稽': 'kj',
+}
+
+# 匹配类型，数值越小排名越靠前
+MATCH_EXACT, MATCH_CODE_PREFIX, MATCH_NAME_PREFIX, MATCH_PINYIN_PREFIX, MATCH_CONTAINS, MATCH_PINYIN_CONTAINS = range(6)
+MATCH_NAMES = ['exact', 'code_prefix', 'name_prefix', 'pinyin_prefix', 'contains', 'pinyin_contains']
+
+
+def normalize(keyword):
+    """全角转半角、去空白、字母转小写"""
+    return unicodedata.normalize('NFKC', keyword or '').strip().lower().replace(' ', '')
+
+
+def _char_initial(char):
+    if char.isascii():
+        return char.lower() if char.isalnum() else ''
+    try:
+        encoded = char.encode('gb2312')
+    except UnicodeEncodeError:
+        return ''
+    if len(encoded) != 2:
+        return ''
+    value = (encoded[0] << 8 | encoded[1]) - 65536
+    if value < _GB2312_BOUNDS[0] or value >= _GB2312_LEVEL1_END:
+        return ''  # 二级汉字按部首排序，推算不出拼音
+    return _GB2312_INITIALS[bisect.bisect_right(_GB2312_BOUNDS, value) - 1][1]
+
+
+def pinyin_initials(name):
+    """名称的拼音首字母 (如 平安银行 -> payh)；字母与数字原样保留，其他符号忽略"""
+    name = unicodedata.normalize('NFKC', name or '')
+    if lazy_pinyin is not None:
+        initials = lazy_pinyin(name, style=Style.FIRST_LETTER, errors=lambda chars: list(chars))
+        return ''.join(part[0].lower() for part in initials if part and part[0].isascii() and part[0].isalnum())
+    letters, i = [], 0
+    while i < len(name):
+        phrase = _PHRASE_INITIALS.get(name[i:i + 2])
+        if phrase is not None:
+            letters.append(phrase)
+            i += 2
+        else:
+            letters.append(_char_initial(name[i]))
+            i += 1
+    return ''.join(letters)
+
+
+def _grams(value):
+    """value 的全部单字与 NGRAM 元组，作为倒排索引的键"""
+    grams = set(value)
+    grams.update(value[i:i + NGRAM] for i in range(len(value) - NGRAM + 1))
+    return grams
+
+
+class StockSearchIndex:
+    """
+    股票代码/名称的内存搜索索引，取代 LIKE '%关键字%' 的全表扫描：
+    - 代码前缀：按代码排序的数组上二分查找；
+    - 名称、代码、拼音首字母的子串：字与二元组的倒排索引求交集后再校验；
+    - 结果按匹配类型排名 (完全相同 > 代码前缀 > 名称前缀 > 拼音前缀 > 包含)，同类按代码排序。
+    重建时先构造新索引再整体替换，查询不加锁。
+    """
+
+    def __init__(self, engine, refresh_interval=REFRESH_INTERVAL):
+        self.engine = engine
+        self.refresh_interval = refresh_interval
+        self._state = None  # (代码列表, 名称列表, 小写名称列表, 拼音首字母列表, 倒排索引, 构建时间)
+        self._build_lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def ready(self):
+        return self._state is not None
+
+    def build(self):
+        """从数据库加载全部股票并重建索引"""
+        start = time.perf_counter()
+        quote_snapshot.ensure_snapshot(self.engine)
+        with self.engine.connect() as conn:
+            rows = sorted(conn.execute(text(LOAD_SQL)).all())
+        codes = [row[0] for row in rows]
+        names = [row[1] or row[0] for row in rows]
+        lowered = [normalize(name) for name in names]
+        initials = [pinyin_initials(name) for name in names]
+        postings = {}
+        for i in range(len(codes)):
+            for gram in _grams(codes[i]) | _grams(lowered[i]) | _grams(initials[i]):
+                postings.setdefault(gram, []).append(i)
+        self._state = (codes, names, lowered, initials, postings, time.monotonic())
+        print(f"股票搜索索引已构建: {len(codes)} 支股票, {len(postings)} 个索引键, "
+              f"耗时 {(time.perf_counter() - start) * 1000:.0f} 毫秒。")
+
+    def refresh(self, background=False):
+        """重建索引；background=True 时在后台线程中进行，已有重建在进行时直接返回"""
+        with self._build_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.build()
+            except Exception as e:
+                metrics.error('search_index')
+                print(f"股票搜索索引构建失败: {e}")
+            finally:
+                with self._build_lock:
+                    self._refreshing = False
+
+        if background:
+            threading.Thread(target=run, name='search-index', daemon=True).start()
+        else:
+            run()
+
+    def _current(self):
+        """当前索引；尚未构建时同步构建，过期时在后台重建并继续使用旧索引"""
+        state = self._state
+        if state is None:
+            self.refresh()
+            state = self._state
+            if state is None:
+                raise RuntimeError("股票搜索索引不可用")
+        elif time.monotonic() - state[5] > self.refresh_interval:
+            self.refresh(background=True)
+        return state
+
+    def _candidates(self, state, keyword):
+        codes, _, _, _, postings, _ = state
+        grams = [keyword] if len(keyword) <= NGRAM else \
+            [keyword[i:i + NGRAM] for i in range(len(keyword) - NGRAM + 1)]
+        lists = []
+        for gram in set(grams):
+            posting = postings.get(gram)
+            if not posting:
+                return []
+            lists.append(posting)
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return candidates
+
+    def _rank(self, state, i, keyword):
+        codes, _, lowered, initials, _, _ = state
+        code, name, letters = codes[i], lowered[i], initials[i]
+        if keyword == code or keyword == name:
+            return MATCH_EXACT
+        if code.startswith(keyword):
+            return MATCH_CODE_PREFIX
+        if name.startswith(keyword):
+            return MATCH_NAME_PREFIX
+        if letters.startswith(keyword):
+            return MATCH_PINYIN_PREFIX
+        if keyword in code or keyword in name:
+            return MATCH_CONTAINS
+        if keyword in letters:
+            return MATCH_PINYIN_CONTAINS
+        return None
+
+    def search(self, keyword):
+        """返回 [(排名, 下标)]，按排名、代码排序；state 一并返回，保证与结果对应同一版本的索引"""
+        keyword = normalize(keyword)
+        state = self._current()
+        if not keyword:
+            return state, []
+        if keyword.isdigit():
+            # 纯数字：代码前缀用二分查找，其余 (代码中间的数字、名称中的数字) 再走倒排索引
+            codes = state[0]
+            start = bisect.bisect_left(codes, keyword)
+            end = bisect.bisect_left(codes, keyword + '\x7f')
+            prefix = set(range(start, end))
+            candidates = prefix | set(self._candidates(state, keyword))
+        else:
+            candidates = self._candidates(state, keyword)
+        ranked = []
+        for i in candidates:
+            rank = self._rank(state, i, keyword)
+            if rank is not None:
+                ranked.append((rank, i))
+        ranked.sort()
+        return state, ranked
+
+    def match_codes(self, keyword):
+        """匹配关键字的全部股票代码 (按排名)"""
+        with metrics.stage('search.match'):
+            state, ranked = self.search(keyword)
+        return [state[0][i] for _, i in ranked]
+
+    def suggest(self, keyword, limit=SUGGEST_LIMIT):
+        """自动补全：排名前 limit 的股票，只读内存"""
+        with metrics.stage('search.suggest'):
+            state, ranked = self.search(keyword)
+        codes, names, _, initials, _, _ = state
+        return [{"code": codes[i], "name": names[i], "pinyin": initials[i], "match": MATCH_NAMES[rank]}
+                for rank, i in ranked[:limit]]
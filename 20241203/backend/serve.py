@@ -0,0 +1,104 @@
+# 预 fork 多进程服务入口：python serve.py [--workers N] [--host HOST] [--port PORT]
+# 主进程加载并预热模型后再 fork 出多个工作进程，子进程通过写时复制共享模型权重，共同监听同一个端口；
+# 更新任务的状态与进度保存在 SQLite (update_jobs) 中，各进程看到的一致。工作进程意外退出时由主进程重新拉起。
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+
+os.environ['STOCK_API_PREFORK'] = '1'  # 必须在导入 api_server 之前设置，主进程不启动后台线程
+
+import api_server
+import metrics
+from werkzeug.serving import make_server
+
+# --- 配置 ---
+HOST = '0.0.0.0'
+PORT = 5000
+WORKERS = os.cpu_count() or 2
+LISTEN_BACKLOG = 512
+RESPAWN_DELAY = 1.0  # 工作进程退出后重新拉起前的等待 (秒)，避免反复崩溃时空转
+
+
+def create_listener(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, host, port):
+    """子进程：重建进程内资源后，在继承的监听套接字上提供多线程 WSGI 服务"""
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    api_server.init_worker_process()
+    server = make_server(host, port, api_server.app, threaded=True, fd=sock.fileno())
+    print(f"工作进程 {os.getpid()} 已启动。")
+    server.serve_forever()
+
+
+def spawn_worker(sock, host, port):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, host, port)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预 fork 多进程股票 API 服务")
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("当前平台不支持 fork，请直接运行 api_server.py。")
+        sys.exit(1)
+
+    sock = create_listener(args.host, args.port)
+    metrics.clear_snapshots()
+    api_server.preload_for_fork()
+    # 冻结主进程已有对象，避免子进程的垃圾回收改写引用计数、破坏写时复制的共享页
+    gc.collect()
+    gc.freeze()
+
+    workers = {spawn_worker(sock, args.host, args.port) for _ in range(args.workers)}
+    print(f"主进程 {os.getpid()} 监听 {args.host}:{args.port}，工作进程数 {len(workers)}。")
+    stopping = False
+
+    def shutdown(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"工作进程 {pid} 已退出 (状态 {status})，重新启动。")
+            time.sleep(RESPAWN_DELAY)
+            workers.add(spawn_worker(sock, args.host, args.port))
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
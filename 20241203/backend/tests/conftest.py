@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接导入 backend 下的各模块 (与服务、脚本的运行方式一致)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import indicators
+from history_cache import HistoryCache
+
+# 增量递推与整体重算的允许误差 (浮点运算顺序不同带来的差异)
+TOLERANCE = 3e-9
+PANEL_BARS = 80
+# 每支股票的历史长度：短于指标窗口、短于面板 (左侧 NaN 填充)、以及新 K 线把左侧填充挤出后恰好填满面板的股票。
+# 超出面板的历史在两条路径上的均线起算位置不同 (面板外的部分只作预热)，不在逐值比较之列
+LENGTHS = [5, 12, 30, 60, 79, 80, 45, 80]
+NEW_BARS = [1, 3, 0, 2, 1, 5, 4, indicators.MAX_INCREMENTAL_BARS]
+
+
+def _history(lengths, seed=7):
+    """按股票拼接的随机游走日线，结构与 HistoryCache 刷新后相同"""
+    rng = np.random.default_rng(seed)
+    history = HistoryCache(None)
+    history.codes = [f"{600000 + i}" for i in range(len(lengths))]
+    history.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    dates, close, high, low, volume = [], [], [], [], []
+    for length in lengths:
+        prices = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, length)))
+        spread = prices * rng.uniform(0, 0.03, length)
+        dates.append(np.datetime64('2020-01-01') + np.arange(length))
+        close.append(prices)
+        high.append(prices + spread)
+        low.append(prices - spread)
+        volume.append(rng.uniform(1e3, 1e5, length))
+    history.columns = {
+        'date': np.concatenate(dates).astype('datetime64[D]'),
+        'close': np.concatenate(close).astype(np.float32),
+        'high': np.concatenate(high).astype(np.float32),
+        'low': np.concatenate(low).astype(np.float32),
+        'volume': np.concatenate(volume).astype(np.float32),
+    }
+    return history
+
+
+def _truncate(history, drop):
+    """去掉每支股票最后 drop[i] 根 K 线，模拟上一次构建面板时的历史"""
+    keep = np.concatenate([np.arange(start, end - n) for start, end, n in
+                           zip(history.offsets[:-1], history.offsets[1:], drop)])
+    truncated = HistoryCache(None)
+    truncated.codes = list(history.codes)
+    truncated.offsets = np.concatenate([[0], np.cumsum(np.diff(history.offsets) - drop)]).astype(np.int64)
+    truncated.columns = {name: values[keep] for name, values in history.columns.items()}
+    return truncated
+
+
+class _StaticHistory:
+    """替代 HistoryCache：refresh 依次返回给定的历史"""
+
+    def __init__(self, *snapshots):
+        self.snapshots = list(snapshots)
+
+    def refresh(self):
+        return self.snapshots.pop(0)
+
+
+def _engine(*snapshots):
+    engine = indicators.IndicatorEngine(None, bars=PANEL_BARS)
+    engine.history = _StaticHistory(*snapshots)
+    return engine
+
+
+def test_indicators_cover_every_family():
+    families = {type(indicators.make_indicator(spec)) for spec in indicators.INDICATORS}
+    assert families == set(indicators.FAMILIES.values())
+
+
+def test_incremental_update_matches_full_build(monkeypatch):
+    full = _history(LENGTHS)
+    drop = np.array(NEW_BARS)
+    incremental = _engine(_truncate(full, drop), full)
+    incremental.refresh()
+    # 增量路径必须真的被走到，而不是退回整体重算
+    monkeypatch.setattr(incremental, '_build', lambda history: pytest.fail("增量刷新退回了整体重算"))
+    incremental.refresh()
+
+    rebuilt = _engine(full)
+    rebuilt.refresh()
+    assert incremental.outputs == rebuilt.outputs
+    np.testing.assert_array_equal(incremental._panel['DATE'], rebuilt._panel['DATE'])
+    for name in ['CLOSE', 'HIGH', 'LOW', 'VOLUME'] + rebuilt.outputs:
+        expected, actual = rebuilt._panel[name], incremental._panel[name]
+        # NaN 的位置 (左侧填充与指标预热期) 必须一致，其余数值在误差内
+        np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected), err_msg=name)
+        np.testing.assert_allclose(actual, expected, rtol=TOLERANCE, atol=TOLERANCE, equal_nan=True, err_msg=name)
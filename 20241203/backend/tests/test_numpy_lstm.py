@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+import numpy_lstm
+
+tf = pytest.importorskip('tensorflow')
+
+
+def _build_model(look_back=12):
+    """与 ml.build_model 同构的小模型：两层 LSTM (第一层返回序列) + Dropout + Dense"""
+    keras = tf.keras
+    model = keras.Sequential([
+        keras.layers.Input(shape=(look_back, 1)),
+        keras.layers.LSTM(8, return_sequences=True),
+        keras.layers.Dropout(0.2),
+        keras.layers.LSTM(6),
+        keras.layers.Dropout(0.2),
+        keras.layers.Dense(3, activation='relu'),
+        keras.layers.Dense(1),
+    ])
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+
+def test_numpy_forward_matches_keras(tmp_path):
+    path = str(tmp_path / 'model.h5')
+    keras_model = _build_model()
+    keras_model.save(path)
+
+    numpy_model = numpy_lstm.NumpyLSTMModel.from_h5(path)
+    assert numpy_model.input_shape == (12, 1)
+    x = np.random.default_rng(1).random((64, 12, 1), dtype=np.float32)
+    expected = keras_model.predict(x, verbose=0)
+    actual = numpy_model.predict(x)
+    assert actual.shape == expected.shape
+    assert np.max(np.abs(actual - expected)) <= numpy_lstm.PARITY_TOLERANCE
+
+
+def test_check_parity_on_saved_model(tmp_path):
+    path = str(tmp_path / 'model.h5')
+    _build_model().save(path)
+    assert numpy_lstm.check_parity(path, samples=32) <= numpy_lstm.PARITY_TOLERANCE
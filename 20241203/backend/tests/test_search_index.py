@@ -0,0 +1,23 @@
+import pytest
+import search_index
+
+# 用户最常按拼音首字母输入的名称，包含多音字 (银行的"行"、重庆的"重")
+NAMES = [
+    ('平安银行', 'payh'),
+    ('招商银行', 'zsyh'),
+    ('浦发银行', 'pfyh'),
+    ('重庆啤酒', 'cqpj'),
+    ('贵州茅台', 'gzmt'),
+    ('万科Ａ', 'wka'),
+]
+
+
+@pytest.mark.parametrize('name, expected', NAMES)
+def test_pinyin_initials(name, expected):
+    assert search_index.pinyin_initials(name) == expected
+
+
+@pytest.mark.parametrize('name, expected', NAMES)
+def test_pinyin_initials_without_pypinyin(monkeypatch, name, expected):
+    monkeypatch.setattr(search_index, 'lazy_pinyin', None)
+    assert search_index.pinyin_initials(name) == expected
@@ -0,0 +1,457 @@
+import os
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import data_updater
+
+# --- 配置 ---
+JOB_DB_PATH = 'cache/update_jobs.db'
+SINGLE_WORKERS = 4  # 单支股票更新的工作线程数
+MAX_PENDING_JOBS = 200  # 等待中的单支更新任务上限
+DETAIL_LIMIT = 500  # 状态接口返回的任务明细条数上限
+POLL_INTERVAL = 1.0  # 工作线程检查等待任务的间隔 (秒)
+HEARTBEAT_INTERVAL = 5.0  # 进程心跳间隔 (秒)
+HEARTBEAT_TIMEOUT = 30.0  # 超过该时间没有心跳的进程视为已退出
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS update_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    progress INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    owner TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS update_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER,
+    stock_code TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS update_workers (
+    owner TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_update_jobs_run_code ON update_jobs (run_id, stock_code);
+CREATE INDEX IF NOT EXISTS idx_update_jobs_code_status ON update_jobs (stock_code, status);
+"""
+
+# 任务状态：pending 等待 / running 抓取中 / fetched 已抓取待提交 / done 已写入 / empty 无数据 / failed 失败
+
+
+class JobQueueFull(RuntimeError):
+    """单支更新任务的等待队列已满"""
+
+
+class UpdateAlreadyRunning(RuntimeError):
+    """已有全部更新任务在运行"""
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class UpdateJobManager:
+    """
+    数据更新任务子系统，状态全部保存在 SQLite 中，多个服务进程共享同一份任务与进度：
+    - 单支股票更新写入等待表，由各进程的工作线程认领执行，同一股票代码的等待/进行中任务会被合并；
+    - 全部更新按股票逐条持久化状态，同一时间只有一个进程在运行，进程中断后可从未完成的股票继续；
+    - 每个进程定期写心跳，心跳过期或进程已退出时，其名下的任务被标记为中断；
+    - 状态与任务明细供 /api/update_status 查询。
+    """
+
+    def __init__(self, db_path=JOB_DB_PATH, workers=SINGLE_WORKERS, max_pending=MAX_PENDING_JOBS,
+                 on_full_update_finished=None):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.on_full_update_finished = on_full_update_finished
+        self.owner = None
+        self._pid = None
+        self._db_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._full_thread = None
+        self._init_db()
+
+    def start(self):
+        """启动本进程的心跳与工作线程；fork 出的子进程需要各自调用 (按进程号判断，重复调用无副作用)"""
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.owner = f"{socket.gethostname()}:{self._pid}"
+            self._db_lock = threading.Lock()
+            self._full_thread = None
+            self._heartbeat()
+            self._recover_stale()
+            threading.Thread(target=self._heartbeat_loop, name="update-heartbeat", daemon=True).start()
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"update-worker-{i}", daemon=True).start()
+
+    # --- 持久化 ---
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _execute(self, sql, params=(), many=False):
+        with self._db_lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+                    return cursor.lastrowid
+            finally:
+                conn.close()
+
+    def _query(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """跨进程互斥的事务 (BEGIN IMMEDIATE)，用于"检查后写入"的操作"""
+        with self._db_lock:
+            conn = self._connect()
+            conn.isolation_level = None
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA_SQL)
+            # 旧版本创建的表没有 owner 列
+            for table in ('update_runs', 'update_jobs'):
+                columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if 'owner' not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN owner TEXT")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _heartbeat(self):
+        self._execute("INSERT OR REPLACE INTO update_workers (owner, host, pid, heartbeat_at) VALUES (?, ?, ?, ?)",
+                      (self.owner, socket.gethostname(), self._pid, time.time()))
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self._heartbeat()
+                self._recover_stale()
+            except sqlite3.Error as e:
+                print(f"更新任务心跳失败: {e}")
+
+    def _live_owners(self, conn):
+        """心跳未过期、且 (同一主机上) 进程仍存在的 owner 集合"""
+        host, deadline = socket.gethostname(), time.time() - HEARTBEAT_TIMEOUT
+        live = set()
+        for row in conn.execute("SELECT owner, host, pid, heartbeat_at FROM update_workers").fetchall():
+            if row['heartbeat_at'] >= deadline and (row['host'] != host or _pid_alive(row['pid'])):
+                live.add(row['owner'])
+        return live
+
+    def _recover_stale(self):
+        """已退出进程名下的任务：全部更新标记为中断 (可续跑)，单支任务标记为失败"""
+        with self._transaction() as conn:
+            live = self._live_owners(conn)
+            dead_runs = [row['id'] for row in conn.execute(
+                "SELECT id, owner FROM update_runs WHERE status = 'running'").fetchall() if row['owner'] not in live]
+            dead_jobs = [row['id'] for row in conn.execute(
+                "SELECT id, owner FROM update_jobs WHERE run_id IS NULL AND status = 'running'").fetchall()
+                if row['owner'] not in live]
+            if not dead_runs and not dead_jobs:
+                return
+            now = _now()
+            conn.executemany("UPDATE update_runs SET status = 'interrupted', updated_at = ? WHERE id = ?",
+                             [(now, run_id) for run_id in dead_runs])
+            conn.executemany("UPDATE update_jobs SET status = 'pending', updated_at = ? "
+                             "WHERE run_id = ? AND status IN ('running', 'fetched')",
+                             [(now, run_id) for run_id in dead_runs])
+            conn.executemany("UPDATE update_jobs SET status = 'failed', message = '进程中断', updated_at = ? WHERE id = ?",
+                             [(now, job_id) for job_id in dead_jobs])
+            conn.execute("DELETE FROM update_workers WHERE heartbeat_at < ?", (time.time() - HEARTBEAT_TIMEOUT,))
+
+    def _set_job(self, job_id, status, message=None):
+        self._execute("UPDATE update_jobs SET status = ?, message = COALESCE(?, message), updated_at = ? WHERE id = ?",
+                      (status, message, _now(), job_id))
+
+    def _set_run_jobs(self, run_id, codes, status, message=None):
+        now = _now()
+        self._execute("UPDATE update_jobs SET status = ?, message = COALESCE(?, message), updated_at = ?, "
+                      "attempts = attempts + (CASE WHEN ? = 'running' THEN 1 ELSE 0 END) "
+                      "WHERE run_id = ? AND stock_code = ?",
+                      [(status, message, now, status, run_id, code) for code in codes], many=True)
+
+    def _set_run(self, run_id, **fields):
+        fields['updated_at'] = _now()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE update_runs SET {assignments} WHERE id = ?", (*fields.values(), run_id))
+
+    def _refresh_run_progress(self, run_id, message=None):
+        finished = self._query(
+            "SELECT COUNT(*) AS n FROM update_jobs WHERE run_id = ? AND status IN ('done', 'empty', 'failed')",
+            (run_id,))[0]['n']
+        fields = {"progress": finished}
+        if message is not None:
+            fields["message"] = message
+        self._set_run(run_id, **fields)
+
+    # --- 单支股票更新 ---
+    def submit_stock(self, stock_code):
+        """提交单支更新，返回 (job_id, 是否与已有任务合并)"""
+        self.start()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id FROM update_jobs WHERE stock_code = ? AND run_id IS NULL AND status IN ('pending', 'running') "
+                "ORDER BY id DESC LIMIT 1", (stock_code,)).fetchall()
+            if rows:
+                return rows[0]['id'], True
+            # 正在进行的全部更新中尚未完成的同一股票，也不重复抓取
+            rows = conn.execute(
+                "SELECT j.id FROM update_jobs j JOIN update_runs r ON j.run_id = r.id "
+                "WHERE j.stock_code = ? AND r.status = 'running' AND j.status IN ('pending', 'running', 'fetched') "
+                "ORDER BY j.id DESC LIMIT 1", (stock_code,)).fetchall()
+            if rows:
+                return rows[0]['id'], True
+            pending = conn.execute(
+                "SELECT COUNT(*) AS n FROM update_jobs WHERE run_id IS NULL AND status = 'pending'").fetchone()['n']
+            if pending >= self.max_pending:
+                raise JobQueueFull("更新任务过多，请稍后再试")
+            now = _now()
+            job_id = conn.execute(
+                "INSERT INTO update_jobs (run_id, stock_code, status, message, created_at, updated_at) "
+                "VALUES (NULL, ?, 'pending', '等待中', ?, ?)", (stock_code, now, now)).lastrowid
+        self._wake.set()
+        return job_id, False
+
+    def _claim_job(self):
+        """认领最早的一条等待中的单支任务 (任意进程的工作线程都可以认领)"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id, stock_code FROM update_jobs WHERE run_id IS NULL AND status = 'pending' "
+                               "ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE update_jobs SET status = 'running', owner = ?, attempts = attempts + 1, updated_at = ? "
+                         "WHERE id = ?", (self.owner, _now(), row['id']))
+            return row['id'], row['stock_code']
+
+    def _worker(self):
+        while True:
+            try:
+                claimed = self._claim_job()
+            except sqlite3.Error as e:
+                print(f"认领更新任务失败: {e}")
+                claimed = None
+            if claimed is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+                continue
+            job_id, stock_code = claimed
+            try:
+                result = data_updater.update_single_stock_task(stock_code)
+                status = 'done' if result.startswith('成功') else ('empty' if result.startswith('无数据') else 'failed')
+                self._set_job(job_id, status, result)
+            except Exception as e:
+                self._set_job(job_id, 'failed', f"失败: {stock_code} - {e}")
+
+    # --- 全部更新 ---
+    def full_update_running(self):
+        """是否有任意进程正在运行全部更新"""
+        conn = self._connect()
+        try:
+            live = self._live_owners(conn)
+            owners = [row['owner'] for row in conn.execute(
+                "SELECT owner FROM update_runs WHERE kind = 'full' AND status = 'running'")]
+        finally:
+            conn.close()
+        return any(owner in live for owner in owners)
+
+    def start_full_update(self, resume=True):
+        """启动全部更新；resume=True 时若有中断的任务则从未完成的股票续跑。返回 (run_id, 是否续跑)"""
+        self.start()
+        self._recover_stale()
+        with self._transaction() as conn:
+            live = self._live_owners(conn)
+            if any(row['owner'] in live for row in conn.execute(
+                    "SELECT owner FROM update_runs WHERE kind = 'full' AND status = 'running'")):
+                raise UpdateAlreadyRunning("已有更新任务正在运行中。")
+            run_id = None
+            if resume:
+                row = conn.execute("SELECT id, status FROM update_runs WHERE kind = 'full' "
+                                   "ORDER BY id DESC LIMIT 1").fetchone()
+                if row is not None and row['status'] in ('interrupted', 'incomplete', 'failed'):
+                    run_id = row['id']
+            resumed = run_id is not None
+            now = _now()
+            if run_id is None:
+                run_id = conn.execute(
+                    "INSERT INTO update_runs (kind, status, message, owner, created_at, updated_at) "
+                    "VALUES ('full', 'running', '正在获取股票列表...', ?, ?, ?)", (self.owner, now, now)).lastrowid
+            else:
+                conn.execute("UPDATE update_runs SET status = 'running', message = '正在续跑未完成的股票...', "
+                             "owner = ?, updated_at = ? WHERE id = ?", (self.owner, now, run_id))
+        self._full_thread = threading.Thread(target=self._run_full_update, args=(run_id, resumed),
+                                             name=f"full-update-{run_id}", daemon=True)
+        self._full_thread.start()
+        return run_id, resumed
+
+    def _run_full_update(self, run_id, resumed):
+        print(f"开始全部股票数据更新任务 #{run_id}{' (续跑)' if resumed else ''}...")
+        try:
+            existing_jobs = self._query("SELECT COUNT(*) AS n FROM update_jobs WHERE run_id = ?", (run_id,))[0]['n']
+            if not existing_jobs:
+                stock_codes = data_updater.list_stock_codes()
+                if not stock_codes:
+                    self._set_run(run_id, status='done', message="数据库中没有股票可更新。")
+                    return
+                now = _now()
+                self._execute("INSERT OR IGNORE INTO update_jobs (run_id, stock_code, status, created_at, updated_at) "
+                              "VALUES (?, ?, 'pending', ?, ?)", [(run_id, code, now, now) for code in stock_codes],
+                              many=True)
+                self._set_run(run_id, total=len(stock_codes))
+            remaining = [row['stock_code'] for row in self._query(
+                "SELECT stock_code FROM update_jobs WHERE run_id = ? AND status NOT IN ('done', 'empty')", (run_id,))]
+            total = self._query("SELECT total FROM update_runs WHERE id = ?", (run_id,))[0]['total']
+            self._set_run_jobs(run_id, remaining, 'running')
+            self._refresh_run_progress(run_id)
+
+            def on_result(code, status, message):
+                # 抓取成功的股票要等写入事务提交后才算完成，提交的整批由 on_flushed 一次标记
+                if status == 'success':
+                    return
+                self._set_run_jobs(run_id, [code], status, message)
+                if status != 'fetched':
+                    self._refresh_run_progress(run_id, message)
+
+            def on_flushed(codes):
+                self._set_run_jobs(run_id, codes, 'done')
+                self._refresh_run_progress(run_id, f"已写入 {len(codes)} 支股票")
+
+            data_updater.update_stocks(remaining, on_result=on_result, on_flushed=on_flushed)
+            unfinished = self._query(
+                "SELECT COUNT(*) AS n FROM update_jobs WHERE run_id = ? AND status NOT IN ('done', 'empty')",
+                (run_id,))[0]['n']
+            if unfinished:
+                self._set_run(run_id, status='incomplete',
+                              message=f"全部 {total} 支股票更新结束，{unfinished} 支未完成，可再次启动续跑。")
+            else:
+                self._set_run(run_id, status='done', message=f"全部 {total} 支股票更新完成！")
+            self._refresh_run_progress(run_id)
+            print("全部股票数据更新任务完成！")
+            if self.on_full_update_finished is not None:
+                self._set_run(run_id, message=f"全部 {total} 支股票更新完成，正在预计算预测结果...")
+                try:
+                    self.on_full_update_finished()
+                    self._set_run(run_id, message=f"全部 {total} 支股票更新完成，预测结果已刷新！")
+                except Exception as e:
+                    self._set_run(run_id, message=f"全部 {total} 支股票更新完成，但预测预计算失败: {e}")
+                    print(f"预测预计算失败: {e}")
+        except Exception as e:
+            self._set_run(run_id, status='failed', message=f"任务失败: {e}")
+            print(f"全部更新任务失败: {e}")
+
+    # --- 一次性任务 ---
+    def run_once(self, kind, key, fn):
+        """
+        多个进程可能同时触发同一件事 (如模型热更新后的预测预计算)，
+        只有第一个登记 (kind, key) 的进程执行 fn，返回是否由本进程执行。
+        登记的 key 保存在 message 中并按原值精确匹配；已完成、或仍有存活进程在执行时跳过，
+        失败或执行进程已退出的登记不算数，下次触发时重新执行。
+        """
+        self.start()
+        key = str(key)
+        with self._transaction() as conn:
+            live = self._live_owners(conn)
+            for row in conn.execute("SELECT status, owner FROM update_runs WHERE kind = ? AND message = ? "
+                                    "AND status IN ('running', 'done')", (kind, key)).fetchall():
+                if row['status'] == 'done' or row['owner'] in live:
+                    return False
+            now = _now()
+            run_id = conn.execute(
+                "INSERT INTO update_runs (kind, status, message, owner, created_at, updated_at) "
+                "VALUES (?, 'running', ?, ?, ?, ?)", (kind, key, self.owner, now, now)).lastrowid
+        try:
+            fn()
+            self._set_run(run_id, status='done')
+        except Exception as e:
+            self._set_run(run_id, status='failed', message=f"{key} 失败: {e}")
+            print(f"{kind} 任务失败: {e}")
+        return True
+
+    # --- 查询 ---
+    def job(self, job_id):
+        rows = self._query("SELECT * FROM update_jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def last_single_job_id(self):
+        return self._query("SELECT COALESCE(MAX(id), 0) AS id FROM update_jobs WHERE run_id IS NULL")[0]['id']
+
+    def single_jobs(self, after_id):
+        """进行中的单支更新任务，以及 id 大于 after_id 的全部单支任务 (含已结束的)"""
+        return self._query(
+            "SELECT id, stock_code AS stockCode, status, message, attempts, updated_at AS updatedAt "
+            "FROM update_jobs WHERE run_id IS NULL AND (status IN ('pending', 'running') OR id > ?) ORDER BY id",
+            (after_id,))
+
+    def status(self, run_id=None, detail=False):
+        """返回与旧版 UPDATE_STATUS 兼容的字段 (running/progress/total/message)，附带任务统计与明细"""
+        if run_id is None:
+            runs = self._query("SELECT * FROM update_runs WHERE kind = 'full' ORDER BY id DESC LIMIT 1")
+        else:
+            runs = self._query("SELECT * FROM update_runs WHERE id = ?", (run_id,))
+        result = {"running": self.full_update_running(), "progress": 0, "total": 0, "message": "暂无更新任务"}
+        if runs:
+            run = runs[0]
+            result.update({"runId": run['id'], "runStatus": run['status'], "progress": run['progress'],
+                           "total": run['total'], "message": run['message'],
+                           "createdAt": run['created_at'], "updatedAt": run['updated_at']})
+            counts = self._query("SELECT status, COUNT(*) AS n FROM update_jobs WHERE run_id = ? GROUP BY status",
+                                 (run['id'],))
+            result["jobCounts"] = {row['status']: row['n'] for row in counts}
+            if detail:
+                result["jobs"] = self._query(
+                    "SELECT id, stock_code AS stockCode, status, message, attempts, updated_at AS updatedAt "
+                    "FROM update_jobs WHERE run_id = ? ORDER BY updated_at DESC LIMIT ?", (run['id'], DETAIL_LIMIT))
+        result["singleJobs"] = self._query(
+            "SELECT id, stock_code AS stockCode, status, message, attempts, updated_at AS updatedAt "
+            "FROM update_jobs WHERE run_id IS NULL AND status IN ('pending', 'running') ORDER BY id")
+        return result
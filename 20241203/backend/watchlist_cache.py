@@ -0,0 +1,233 @@
+import os
+import mmap
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import jwt
+from sqlalchemy import text
+import metrics
+import quote_snapshot
+
+# --- 配置 ---
+TOKEN_CACHE_SIZE = 10000  # 缓存的已验证 Token 数上限
+WATCHLIST_CACHE_USERS = 10000  # 缓存自选列表的用户数上限
+WATCHLIST_TTL = 300  # 自选列表缓存的最长使用时间 (秒)，跨进程的失效通知之外的兜底
+GENERATION_SLOTS = 1 << 16  # 跨进程失效标记的槽数，用户 id 取模映射
+GENERATION_FILE = 'cache/watchlist_generations.bin'  # 失效标记所在的共享文件，同一主机上的全部进程映射同一份
+QUOTE_REFRESH_INTERVAL = 2.0  # 后台线程同步最新行情快照的间隔 (秒)
+QUOTE_FULL_RELOAD_INTERVAL = 300  # 定期全量重读，补上后来才有名称的股票
+
+WATCHLIST_SQL = "SELECT stock_code FROM t_watchlists WHERE user_id = :user_id ORDER BY id"
+INSERT_SQL = "INSERT INTO t_watchlists (user_id, stock_code) VALUES (:user_id, :stock_code)"
+DELETE_SQL = "DELETE FROM t_watchlists WHERE user_id = :user_id AND stock_code = :stock_code"
+
+# 自选列表需要的行情字段；名称取自 t_stock_basic (与原先的内连接一致，没有名称的股票不返回)
+QUOTES_SQL = f"""
+SELECT q.`股票代码` as code, b.`股票名称` as name, q.`收盘价` as price, q.`开盘价` as prevPrice,
+       q.`日内涨跌幅` as changePercent, q.`成交量` as volume, q.`更新时间` as updatedAt
+FROM {quote_snapshot.SNAPSHOT_TABLE} q
+JOIN t_stock_basic b ON q.`股票代码` = b.`股票代码`
+{{where_clause}}
+"""
+
+AUTH_CACHE = metrics.counter('stock_auth_token_cache_total', "Token 验证缓存命中情况", ('result',))
+WATCHLIST_CACHE = metrics.counter('stock_watchlist_cache_total', "自选列表缓存命中情况", ('result',))
+
+
+def _nan_to_none(value):
+    return None if value is None or value != value else value
+
+
+class TokenCache:
+    """
+    已验证 JWT 的缓存：键为 Token 的 SHA-256 (不保存 Token 原文)，值为 (用户 id, 过期时间)，
+    过期前直接返回用户 id，不再重复验签。只缓存验证通过的 Token，伪造的 Token 每次都会重新验证。
+    """
+
+    def __init__(self, secret_key, max_size=TOKEN_CACHE_SIZE):
+        self.secret_key = secret_key
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def user_id(self, token):
+        """返回 Token 对应的用户 id；无效或已过期时抛出 jwt 的异常"""
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    AUTH_CACHE.inc(result='hit')
+                    return entry[0]
+                del self._entries[key]
+        AUTH_CACHE.inc(result='miss')
+        data = jwt.decode(token, self.secret_key, algorithms=["HS256"])
+        user_id = data['user_id']
+        if 'exp' in data:
+            with self._lock:
+                self._entries[key] = (user_id, float(data['exp']))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return user_id
+
+
+class QuoteBoard:
+    """
+    最新行情快照在进程内的副本 (代码 -> 行情)，后台线程按更新时间增量同步，
+    自选列表的读取直接在内存中关联，不查询数据库。
+    """
+
+    def __init__(self, engine, interval=QUOTE_REFRESH_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._quotes = None
+        self._since = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def start(self):
+        """启动本进程的同步线程 (按进程号判断，fork 出的子进程各自启动)"""
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name='quote-board', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                metrics.error('quote_board')
+                print(f"同步最新行情失败: {e}")
+            time.sleep(self.interval)
+
+    def refresh(self):
+        """定期全量读取，其间只读取更新时间不早于上次最大值的行 (更新时间只精确到秒，同一秒的行会重复读到，覆盖即可)"""
+        with self._lock:
+            quote_snapshot.ensure_snapshot(self.engine)
+            full = self._quotes is None or time.monotonic() - self._loaded_at > QUOTE_FULL_RELOAD_INTERVAL
+            sql = QUOTES_SQL.format(where_clause="" if full else "WHERE q.`更新时间` >= :since")
+            with self.engine.connect() as conn:
+                rows = conn.execute(text(sql), {} if full else {"since": self._since}).mappings().all()
+            quotes = {} if full else dict(self._quotes)
+            if full:
+                self._loaded_at = time.monotonic()
+            for row in rows:
+                quotes[row['code']] = {
+                    "code": row['code'], "name": row['name'], "price": _nan_to_none(row['price']),
+                    "prevPrice": _nan_to_none(row['prevPrice']), "changePercent": _nan_to_none(row['changePercent']),
+                    "volume": row['volume'] / 10000 if _nan_to_none(row['volume']) is not None else None,
+                }
+                if self._since is None or row['updatedAt'] > self._since:
+                    self._since = row['updatedAt']
+            self._quotes = quotes
+
+    def get(self, codes):
+        quotes = self._quotes
+        if quotes is None:
+            self.refresh()
+            quotes = self._quotes
+        return [quotes[code] for code in codes if code in quotes]
+
+
+class WatchlistCache:
+    """
+    按用户缓存自选股代码的有界 LRU，带 TTL，增删时先写数据库再刷新缓存 (write-through)。
+    多进程部署时各进程各有一份缓存：写入后在共享文件映射中更新该用户所在槽的标记，
+    其他进程读取时发现标记变化即重新加载，读路径只读内存。
+    标记放在文件映射而不是匿名映射中：不论工作进程是 fork 出来的还是各自导入模块 (gunicorn/uwsgi)，都能看到彼此的写入。
+    """
+
+    def __init__(self, engine, max_users=WATCHLIST_CACHE_USERS, ttl=WATCHLIST_TTL, generation_file=GENERATION_FILE):
+        self.engine = engine
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (代码列表, 加载时间, 加载时的标记)
+        self._lock = threading.Lock()
+        try:
+            self._shared = self._map_generations(generation_file)
+        except OSError as e:
+            # 无法建立共享标记时其他进程的写入不可见，不缓存 (每次读取都查询数据库)
+            print(f"自选列表缓存已禁用，无法映射失效标记文件 {generation_file}: {e}")
+            self._shared = mmap.mmap(-1, GENERATION_SLOTS * 8)
+            self.ttl = 0
+        self._generations = np.frombuffer(self._shared, dtype=np.int64)
+
+    @staticmethod
+    def _map_generations(path):
+        size = GENERATION_SLOTS * 8
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # 多个进程同时创建时各自扩展到相同大小，结果一致；新扩展的部分为 0
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            return mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _slot(self, user_id):
+        return int(user_id) % GENERATION_SLOTS
+
+    def _touch(self, user_id):
+        # 写入各自不同的值 (纳秒时间戳)，不需要跨进程的原子自增
+        generation = time.time_ns()
+        self._generations[self._slot(user_id)] = generation
+        return generation
+
+    def codes(self, user_id):
+        """用户的自选股代码 (按添加顺序)"""
+        generation = int(self._generations[self._slot(user_id)])
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[2] == generation and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(user_id)
+                WATCHLIST_CACHE.inc(result='hit')
+                return list(entry[0])
+        WATCHLIST_CACHE.inc(result='miss' if entry is None else 'stale')
+        # 先记下标记再读数据库：读取期间发生的写入会让标记变化，下次读取时重新加载
+        with self.engine.connect() as conn:
+            return self._load(conn, user_id, generation)
+
+    def _load(self, conn, user_id, generation):
+        codes = [row[0] for row in conn.execute(text(WATCHLIST_SQL), {"user_id": user_id})]
+        self._store(user_id, codes, generation)
+        return list(codes)
+
+    def _store(self, user_id, codes, generation):
+        with self._lock:
+            self._entries[user_id] = (codes, time.monotonic(), generation)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def _write(self, sql, user_id, stock_code):
+        """
+        写入提交后通知其他进程，并在同一连接上重新读取该用户的列表放入缓存。
+        重新读取而不是在旧列表上增删：其他进程刚提交的写入也会被读到。
+        """
+        with self.engine.connect() as conn:
+            result = conn.execute(text(sql), {"user_id": user_id, "stock_code": stock_code})
+            conn.commit()
+            self._load(conn, user_id, self._touch(user_id))
+        return result.rowcount
+
+    def add(self, user_id, stock_code):
+        """添加自选；已存在时抛出 IntegrityError (由唯一键保证)"""
+        self._write(INSERT_SQL, user_id, stock_code)
+
+    def remove(self, user_id, stock_code):
+        """移除自选，返回是否确实删除了一行"""
+        return self._write(DELETE_SQL, user_id, stock_code) > 0
+
+    def contains(self, user_id, stock_codes):
+        members = set(self.codes(user_id))
+        return {code: code in members for code in stock_codes}